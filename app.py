@@ -1,8 +1,14 @@
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, session
+from flask import Flask, render_template, request, send_file, flash, redirect, url_for, session, jsonify, abort, Response
 import os
-import pandas as pd
+import json
 from werkzeug.utils import secure_filename
-from stock_analyzer import StockAnalyzer
+from stock_analyzer import StockAnalyzer, DEFAULT_RULE_SET, LOG_LEVELS
+from rules import RuleSet
+from table_cache import PdfTableCache, InventorySnapshotCache, ExportCache
+from jobs import JobManager, JobQueueFull, SQLiteJobStore
+from state_store import MemoryStateStore, SQLiteStateStore, StateLocked
+from metrics import MetricsRegistry
+import exports
 import tempfile
 from dotenv import load_dotenv
 from functools import wraps
@@ -15,6 +21,8 @@ app = Flask(__name__)
 # Usar clave secreta del .env
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'default_secret_key') 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# Archivos subidos de hasta este tamaño se mantienen en memoria; los mayores, en un temporal anónimo
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_MB', '8')) * 1024 * 1024
 
 # Credenciales
 ADMIN_USER = os.getenv('FLASK_USER')
@@ -22,14 +30,91 @@ ADMIN_PASS = os.getenv('FLASK_PASSWORD')
 
 ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls'}
 
-# ALMACÉN DE ESTADO GLOBAL (Simulando persistencia simple en memoria)
-# Estructura: {'username': StockAnalyzer_Instance}
-USER_ANALYZERS = {}
+# Caché de tablas PDF compartida por todos los usuarios (re-subidas del mismo archivo)
+PDF_CACHE = PdfTableCache(
+    os.getenv('PDF_CACHE_DIR') or None,
+    max_bytes=int(os.getenv('PDF_CACHE_MAX_MB', '256')) * 1024 * 1024
+)
+
+# Snapshots columnares del Excel de inventario (mismo archivo reutilizado durante el día)
+INVENTORY_CACHE = InventorySnapshotCache(
+    os.getenv('INVENTORY_CACHE_DIR') or None,
+    max_bytes=int(os.getenv('INVENTORY_CACHE_MAX_MB', '512')) * 1024 * 1024
+)
+
+# Exportaciones ya generadas por ejecución (descargas repetidas sin regenerar el archivo)
+EXPORT_CACHE = ExportCache(
+    os.getenv('EXPORT_CACHE_DIR') or None,
+    max_bytes=int(os.getenv('EXPORT_CACHE_MAX_MB', '128')) * 1024 * 1024
+)
+
+# Métricas Prometheus en /metrics (si METRICS_TOKEN está definido se exige como Bearer token)
+METRICS = MetricsRegistry()
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def _cache_metric(field):
+    return lambda: {
+        (('cache', 'pdf'),): PDF_CACHE.stats()[field],
+        (('cache', 'inventory'),): INVENTORY_CACHE.stats()[field],
+        (('cache', 'export'),): EXPORT_CACHE.stats()[field]
+    }
+
+METRICS.gauge('cache_hits_total', _cache_metric('hits'), 'Aciertos de caché.', metric_type='counter')
+METRICS.gauge('cache_misses_total', _cache_metric('misses'), 'Fallos de caché.', metric_type='counter')
+METRICS.gauge('cache_hit_ratio', _cache_metric('hit_rate'), 'Proporción de aciertos de caché.')
+METRICS.gauge('jobs', lambda: {
+    (('status', status),): count
+    for status, count in ((status, JOBS.status_counts().get(status, 0)) for status in ('queued', 'running', 'done', 'error'))
+}, 'Trabajos de análisis por estado.')
+
+# Extracción de tablas PDF: 'auto' (capa de texto con respaldo a extract_table) o 'table'
+PDF_STRATEGY = 'table' if os.getenv('PDF_STRATEGY', 'auto').lower() == 'table' else 'auto'
+
+# Nivel mínimo de los mensajes de análisis enviados al log de cada job (debug, info, warning, error)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'info').lower()
+if LOG_LEVEL not in LOG_LEVELS:
+    LOG_LEVEL = 'info'
+
+# Reglas de negocio: las de rules.py o las declaradas en un JSON (RULES_FILE)
+RULES = RuleSet.from_file(os.environ['RULES_FILE']) if os.getenv('RULES_FILE') else DEFAULT_RULE_SET
+
+def new_analyzer():
+    analyzer = StockAnalyzer(pdf_cache=PDF_CACHE, inventory_cache=INVENTORY_CACHE, stage_callback=METRICS.observe_stage)
+    analyzer.pdf_strategy = PDF_STRATEGY
+    analyzer.rules = RULES
+    analyzer.log_level = LOG_LEVEL
+    return analyzer
+
+# ALMACÉN DE ESTADO POR USUARIO
+# STATE_BACKEND=memory (por defecto): en el proceso, un solo worker.
+# STATE_BACKEND=sqlite: base compartida (STATE_DB_PATH) para correr varios workers de gunicorn.
+# Las sesiones inactivas o que superan el presupuesto de memoria salen de memoria (LRU) y se
+# restauran en la siguiente petición.
+SESSION_LIMITS = {
+    'max_bytes': int(os.getenv('SESSION_MEMORY_MB', '1024')) * 1024 * 1024,
+    'idle_seconds': int(os.getenv('SESSION_IDLE_MINUTES', '60')) * 60
+}
+if os.getenv('STATE_BACKEND', 'memory').lower() == 'sqlite':
+    STATE = SQLiteStateStore(new_analyzer, os.getenv('STATE_DB_PATH') or None, **SESSION_LIMITS)
+else:
+    STATE = MemoryStateStore(new_analyzer, spill_path=os.getenv('SESSION_SPILL_PATH') or None, **SESSION_LIMITS)
+
+# Análisis en segundo plano: /analyze devuelve un ID de trabajo y el cliente consulta /jobs/<id>.
+# Con STATE_BACKEND=sqlite el estado de los trabajos y los límites se comparten entre workers (misma base).
+JOBS = JobManager(
+    max_workers=int(os.getenv('JOB_WORKERS', '2')),
+    max_queued=int(os.getenv('JOB_QUEUE_SIZE', '16')),
+    per_user_limit=int(os.getenv('JOB_PER_USER', '1')),
+    store=SQLiteJobStore(STATE.path) if isinstance(STATE, SQLiteStateStore) else None
+)
+
+METRICS.gauge('active_sessions', lambda: len(STATE), 'Sesiones con estado de análisis.')
+METRICS.gauge('resident_sessions', lambda: len(STATE.analyzers), 'Sesiones con StockAnalyzer en memoria.')
+METRICS.gauge('session_memory_bytes', STATE.memory_bytes, 'Memoria estimada de los analizadores en memoria.')
+METRICS.gauge('session_evictions_total', lambda: STATE.evictions, 'Sesiones desalojadas de memoria.', metric_type='counter')
 
 def get_user_analyzer(username):
-    if username not in USER_ANALYZERS:
-        USER_ANALYZERS[username] = StockAnalyzer()
-    return USER_ANALYZERS[username]
+    return STATE.get(username)
 
 def login_required(f):
     @wraps(f)
@@ -49,7 +134,8 @@ def login():
             session['logged_in'] = True
             session['user'] = username
             # Inicializar analyzer limpio al login
-            USER_ANALYZERS[username] = StockAnalyzer()
+            with STATE.lock(username):
+                STATE.save(username, new_analyzer())
             return redirect(url_for('index'))
         else:
             flash('Usuario o contraseña incorrectos.')
@@ -59,8 +145,8 @@ def login():
 @app.route('/logout')
 def logout():
     username = session.get('user')
-    if username and username in USER_ANALYZERS:
-        del USER_ANALYZERS[username]
+    if username:
+        STATE.discard(username)
     session.pop('logged_in', None)
     session.pop('user', None)
     return redirect(url_for('login'))
@@ -72,6 +158,7 @@ def index():
     
     # Datos para la vista
     inventory_loaded = analyzer.df_inventory_working is not None
+    last_job = JOBS.latest(session['user'])
     history = analyzer.history
     current_results = analyzer.last_results
     
@@ -81,9 +168,72 @@ def index():
         history=history,
         results=current_results, # Resultados actuales si los hay
         stats=analyzer.get_summary_stats() if current_results else None,
-        inventory_summary=analyzer.get_inventory_summary() if current_results else None
+        inventory_summary=analyzer.get_inventory_summary() if current_results else None,
+        active_job=last_job if last_job and last_job.active else None,
+        rules=RULES.rules
     )
 
+def spool_upload(upload):
+    """
+    Copia un archivo subido a un SpooledTemporaryFile: en memoria hasta UPLOAD_SPOOL_BYTES y,
+    por encima, en un archivo temporal anónimo que desaparece al cerrarlo (o si el proceso muere).
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    upload.save(spool)
+    spool.seek(0)
+    return spool
+
+def run_analysis_job(job, uploads, metadata, enabled_rules):
+    """
+    Trabajo en segundo plano de /analyze: analiza los archivos subidos (uploads: {'punch' |
+    'laser' | 'inventory': (nombre, archivo)}) y los cierra al terminar, con o sin error.
+    Los logs del analizador alimentan el progreso del trabajo; al terminar, los resultados
+    quedan en el estado del usuario (last_results / history). El estado permanece bloqueado
+    durante todo el análisis para que otro worker no lo modifique a la vez.
+    """
+    try:
+        with STATE.lock(job.user):
+            analyzer = STATE.get(job.user)
+            stats = _run_analysis(job, analyzer, uploads, metadata, enabled_rules)
+            STATE.save(job.user, analyzer)
+        return stats
+    finally:
+        for _, spool in uploads.values():
+            spool.close()
+
+def _run_analysis(job, analyzer, uploads, metadata, enabled_rules):
+    analyzer.log_callback = job.log
+    try:
+        # Cargar inventario si viene nuevo
+        job.step('Cargando Inventario')
+        inventory_data = analyzer.load_inventory_excel(uploads['inventory'][1], name=uploads['inventory'][0]) if 'inventory' in uploads else None
+
+        if not inventory_data and analyzer.df_inventory_working is None:
+            raise ValueError('No se pudo cargar el inventario.')
+
+        # Los PDFs se leen y analizan por bloques de páginas (run_streaming_analysis)
+        job.step('Analizando')
+        punch, laser = uploads.get('punch', (None, None)), uploads.get('laser', (None, None))
+        previous_run = analyzer.run_id
+        results = analyzer.run_streaming_analysis(
+            punch[1], laser[1], inventory_data, metadata, enabled_rules,
+            punch_name=punch[0], laser_name=laser[0]
+        )
+        if not results:
+            raise ValueError('Debe subir al menos un PDF válido.')
+        EXPORT_CACHE.invalidate(previous_run)
+        METRICS.inc('analysis_runs_total', help_text='Análisis completados.')
+        METRICS.inc('analysis_items_total', len(analyzer.last_results), 'Items analizados.')
+        return analyzer.get_summary_stats()
+    except Exception:
+        METRICS.inc('analysis_failures_total', help_text='Análisis terminados con error.')
+        raise
+    finally:
+        analyzer.log_callback = None
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json' or request.args.get('format') == 'json'
+
 @app.route('/analyze', methods=['POST'])
 @login_required
 def analyze():
@@ -106,34 +256,16 @@ def analyze():
         flash('El archivo de Inventario es requerido para el primer análisis.')
         return redirect(url_for('index'))
 
-    temp_dir = tempfile.mkdtemp()
-    
+    if not punch_file.filename and not laser_file.filename:
+        flash('Debe subir al menos un PDF válido.')
+        return redirect(url_for('index'))
+
+    uploads = {}
     try:
-        # Guardar PDFs
-        if punch_file.filename:
-            punch_path = os.path.join(temp_dir, secure_filename(punch_file.filename))
-            punch_file.save(punch_path)
-            punch_data = analyzer.load_pdf_data(punch_path, "Punch")
-        else:
-            punch_data = None # Permitir correr sin uno? Asumamos que suben ambos o maneja error
-            
-        if laser_file.filename:
-            laser_path = os.path.join(temp_dir, secure_filename(laser_file.filename))
-            laser_file.save(laser_path)
-            laser_data = analyzer.load_pdf_data(laser_path, "Laser")
-        else:
-            laser_data = None
-            
-        # Cargar inventario si viene nuevo
-        inventory_data = None
-        if inventory_file and inventory_file.filename:
-            inventory_path = os.path.join(temp_dir, secure_filename(inventory_file.filename))
-            inventory_file.save(inventory_path)
-            inventory_data = analyzer.load_inventory_excel(inventory_path)
-        
-        if not punch_data and not laser_data:
-             flash('Debe subir al menos un PDF válido.')
-             return redirect(url_for('index'))
+        # Copiar los archivos fuera del request (el trabajo en segundo plano los procesa y los cierra)
+        for key, upload in (('punch', punch_file), ('laser', laser_file), ('inventory', inventory_file)):
+            if upload and upload.filename:
+                uploads[key] = (secure_filename(upload.filename), spool_upload(upload))
         
         # Capturar metadatos del formulario
         metadata = {
@@ -147,32 +279,217 @@ def analyze():
         # Si queremos que por defecto estén activas, el UI debe enviarlas activas.
         # Asumiremos: si la key está presente -> True, sino -> False (si el usuario las desmarca)
         # PERO: Para que esto funcione, el UI debe cargarlas marcadas por defecto.
-        enabled_rules = {
-            'rule_10034': 'rule_10034' in request.form,
-            'rule_special_parts': 'rule_special_parts' in request.form,
-            'rule_external_low': 'rule_external_low' in request.form
-        }
-             
-        analyzer.run_full_analysis(punch_data, laser_data, inventory_data, metadata, enabled_rules)
-        
-        flash('Análisis completado exitosamente.')
+        enabled_rules = {rule.name: rule.name in request.form for rule in RULES.rules}
+
+        job = JOBS.submit(session['user'], run_analysis_job, uploads, metadata, enabled_rules, total_steps=2)
+
+    except JobQueueFull as e:
+        for _, spool in uploads.values():
+            spool.close()
+        if wants_json():
+            return jsonify({'error': str(e)}), 429
+        flash(str(e))
         return redirect(url_for('index'))
-        
     except Exception as e:
+        for _, spool in uploads.values():
+            spool.close()
         flash(f'Error crítico: {str(e)}')
         return redirect(url_for('index'))
 
+    if wants_json():
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    flash('Análisis en curso...')
+    return redirect(url_for('index'))
+
+def run_scenarios_job(job, modules, scenarios):
+    """
+    Trabajo en segundo plano de /scenarios: carga los PDFs de cada módulo (modules: lista de
+    (nombre, {'punch' | 'laser': (archivo, spool)})) y evalúa los escenarios contra el inventario
+    de trabajo del usuario sin guardar nada en su estado.
+    """
+    loader = new_analyzer()
+    loader.log_callback = job.log
+    try:
+        loaded = []
+        for name, uploads in modules:
+            pdfs = {}
+            for key, source in (('punch', 'Punch'), ('laser', 'Laser')):
+                job.step(f'Cargando {source} de {name}')
+                pdfs[key] = loader.load_pdf_data(uploads[key][1], source, name=uploads[key][0]) if key in uploads else None
+            if not pdfs['punch'] and not pdfs['laser']:
+                raise ValueError(f'El módulo {name} no tiene PDFs válidos.')
+            loaded.append((name, pdfs['punch'], pdfs['laser']))
+
+        job.step('Evaluando escenarios')
+        # Solo lectura: el bloqueo evita que otro análisis consuma stock mientras se evalúa
+        with STATE.lock(job.user):
+            analyzer = STATE.get(job.user)
+            analyzer.log_callback = job.log
+            try:
+                summaries = analyzer.run_scenarios(loaded, scenarios)
+            finally:
+                analyzer.log_callback = None
+        METRICS.inc('scenario_runs_total', len(summaries), 'Escenarios evaluados.')
+        return {'scenarios': summaries}
+    finally:
+        for _, uploads in modules:
+            for _, spool in uploads.values():
+                spool.close()
+
+@app.route('/scenarios', methods=['POST'])
+@login_required
+def compare_scenarios():
+    """
+    Escenarios "qué pasaría si" sobre el inventario de trabajo (respuesta JSON, 202 + trabajo).
+    Formulario multipart: por cada módulo, en el mismo orden, un campo 'module' (nombre), un
+    'punch_file' y un 'laser_file' (puede ir vacío). El campo 'scenarios' es una lista JSON de
+    {name, order, enabled_rules}; sin él se comparan el orden enviado y el inverso.
+    """
+    analyzer = get_user_analyzer(session['user'])
+    if analyzer.df_inventory_working is None:
+        return jsonify({'error': 'Primero cargue un inventario con un análisis.'}), 400
+
+    names = request.form.getlist('module')
+    punch_files = request.files.getlist('punch_file')
+    laser_files = request.files.getlist('laser_file')
+    count = max(len(names), len(punch_files), len(laser_files))
+    if not count:
+        return jsonify({'error': 'Debe enviar al menos un módulo.'}), 400
+    names = [names[i] if i < len(names) and names[i] else f'Módulo {i + 1}' for i in range(count)]
+    if len(set(names)) != len(names):
+        return jsonify({'error': 'Los nombres de módulo deben ser únicos.'}), 400
+
+    try:
+        scenario_list = json.loads(request.form['scenarios']) if request.form.get('scenarios') else [
+            {'name': 'Orden enviado', 'order': names},
+            {'name': 'Orden inverso', 'order': names[::-1]}
+        ]
+        if not isinstance(scenario_list, list) or not all(isinstance(s, dict) for s in scenario_list):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': "'scenarios' debe ser una lista JSON de objetos."}), 400
+
+    modules = []
+    try:
+        for i, name in enumerate(names):
+            uploads = {}
+            for key, files in (('punch', punch_files), ('laser', laser_files)):
+                upload = files[i] if i < len(files) else None
+                if upload and upload.filename:
+                    uploads[key] = (secure_filename(upload.filename), spool_upload(upload))
+            modules.append((name, uploads))
+        job = JOBS.submit(session['user'], run_scenarios_job, modules, scenario_list, total_steps=2 * count + 1)
+    except JobQueueFull as e:
+        for _, uploads in modules:
+            for _, spool in uploads.values():
+                spool.close()
+        return jsonify({'error': str(e)}), 429
+    return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """Estado y progreso de un trabajo; ?since=n devuelve solo los mensajes posteriores a n."""
+    job = JOBS.get(job_id, session['user'])
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict(since=request.args.get('since', 0, type=int)))
+
+# Part numbers admitidos por consulta en /parts
+PART_LOOKUP_MAX = int(os.getenv('PART_LOOKUP_MAX', '1000'))
+
+@app.route('/parts/<part_number>')
+@login_required
+def part_lookup(part_number):
+    """Demanda del último análisis y stock restante de una pieza (JSON)."""
+    analyzer = get_user_analyzer(session['user'])
+    part = analyzer.lookup_parts([part_number])[part_number.strip()]
+    if part is None:
+        return jsonify({'error': f'Part # {part_number} no está en el último análisis ni en el inventario.'}), 404
+    return jsonify(dict(part, run_id=analyzer.run_id))
+
+@app.route('/parts', methods=['GET', 'POST'])
+@login_required
+def parts_lookup():
+    """
+    Consulta de varias piezas (JSON): GET /parts?part=10089&part=10093 (o ?parts=10089,10093)
+    o POST con {"parts": [...]}. Las piezas desconocidas vuelven como null.
+    """
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        part_numbers = payload.get('parts') if isinstance(payload, dict) else None
+        if not isinstance(part_numbers, list):
+            return jsonify({'error': 'Envíe {"parts": [part numbers]}.'}), 400
+    else:
+        part_numbers = request.args.getlist('part')
+        for value in request.args.getlist('parts'):
+            part_numbers.extend(value.split(','))
+    part_numbers = [str(pn).strip() for pn in part_numbers if str(pn).strip()]
+    if not part_numbers:
+        return jsonify({'error': 'Debe indicar al menos un part number.'}), 400
+    if len(part_numbers) > PART_LOOKUP_MAX:
+        return jsonify({'error': f'Máximo {PART_LOOKUP_MAX} part numbers por consulta.'}), 400
+
+    analyzer = get_user_analyzer(session['user'])
+    return jsonify({'run_id': analyzer.run_id, 'parts': analyzer.lookup_parts(part_numbers)})
+
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/reset', methods=['POST'])
 @login_required
 def reset_stock():
-    analyzer = get_user_analyzer(session['user'])
-    analyzer.reset()
+    if JOBS.has_active(session['user']):
+        flash('Hay un análisis en curso; espere a que termine para reiniciar.')
+        return redirect(url_for('index'))
+    try:
+        with STATE.lock(session['user'], timeout=1):
+            analyzer = get_user_analyzer(session['user'])
+            EXPORT_CACHE.invalidate(analyzer.run_id)
+            analyzer.reset()
+            STATE.save(session['user'], analyzer)
+    except StateLocked:
+        flash('Hay un análisis en curso; espere a que termine para reiniciar.')
+        return redirect(url_for('index'))
     flash('Stock y memoria reiniciados correctamente.')
     return redirect(url_for('index'))
 
+@app.route('/undo', methods=['POST'])
+@login_required
+def undo_last_run():
+    """Deshace el último análisis: restituye su consumo de stock y lo quita del historial."""
+    try:
+        with STATE.lock(session['user'], timeout=1):
+            analyzer = get_user_analyzer(session['user'])
+            run_id = analyzer.undo_last_run()
+            if run_id:
+                EXPORT_CACHE.invalidate(run_id)
+                STATE.save(session['user'], analyzer)
+    except StateLocked:
+        flash('Hay un análisis en curso; espere a que termine para deshacer.')
+        return redirect(url_for('index'))
+    flash('Último análisis deshecho; stock restituido.' if run_id else 'No hay análisis para deshacer.')
+    return redirect(url_for('index'))
+
+EXPORT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values'
+}
+
 @app.route('/export/<export_type>')
 @login_required
 def export_results(export_type):
+    """
+    Exporta resultados Punch / Laser o el resumen de inventario.
+    ?format=xlsx (por defecto) genera el libro fila a fila; ?format=csv|tsv, texto delimitado
+    enviado por partes mientras se genera.
+    Cada archivo se genera una vez por ejecución (EXPORT_CACHE) y se sirve con ETag:
+    una descarga repetida con If-None-Match responde 304 sin leer el archivo.
+    """
     analyzer = get_user_analyzer(session['user'])
     
     # Validar que haya datos
@@ -180,77 +497,73 @@ def export_results(export_type):
         flash("No hay resultados para exportar.")
         return redirect(url_for('index'))
 
-    import io
-    output = io.BytesIO()
-    
-    # Configurar Pandas Writer
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        
+    file_format = request.args.get('format', 'xlsx').lower()
+    if file_format not in EXPORT_MIMETYPES:
+        flash("Formato de exportación no válido.")
+        return redirect(url_for('index'))
+
+    if export_type == 'inventory':
+        basename = "Inventario_Resumen"
+    elif export_type in ['punch', 'laser']:
+        basename = f"Resultados_{export_type.capitalize()}"
+    else:
+        flash("Tipo de exportación no válido.")
+        return redirect(url_for('index'))
+
+    run_id = analyzer.run_id
+    etag = f"{run_id}-{export_type}-{file_format}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    download_name = f"{basename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_format}"
+    key = EXPORT_CACHE.export_key(run_id, export_type, file_format)
+    output = EXPORT_CACHE.get(key)
+    if output is None:
         # Caso 1: Inventory Summary
         if export_type == 'inventory':
             data = analyzer.get_inventory_summary()
             if not data:
                 flash("No hay resumen de inventario disponible.")
                 return redirect(url_for('index'))
+            headers, rows = exports.INVENTORY_HEADERS, exports.iter_inventory_rows(data)
+            sheet_name = 'Resumen Inventario'
 
-            # Convertir a DataFrame
-            df = pd.DataFrame(data)
-            # Renombrar columnas para el Excel
-            df = df.rename(columns={
-                'part_number': 'Part #',
-                'materiel': 'Matériel',
-                'epaisseur': 'Épaisseur',
-                'total_required': 'Total a Producir',
-                'initial_stock': 'Stock Total (Disp.)',
-                'missing': 'Faltante (Deficit)'
-            })
-            # Asegurar orden de columnas
-            cols = ['Part #', 'Matériel', 'Épaisseur', 'Total a Producir', 'Stock Total (Disp.)', 'Faltante (Deficit)']
-            df = df[cols]
-            
-            df.to_excel(writer, sheet_name='Resumen Inventario', index=False)
-            filename = f"Inventario_Resumen_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            
         # Caso 2: Punch o Laser (Resultados detallados)
-        elif export_type in ['punch', 'laser']:
+        else:
             # Filtrar resultados por origen (Case sensitive en origen: 'Punch', 'Laser')
             target_origin = export_type.capitalize()
-            filtered_data = [r for r in analyzer.last_results if r['origen'] == target_origin]
-            
-            if not filtered_data:
-                # Si está vacío, crear DF vacío pero con columnas
-                df = pd.DataFrame(columns=['Origen', 'Part #', 'Qté Prod.', 'Stock Int.', 'Stock Ext.', 'Clasif.', 'Razón', 'Faltante Auto.'])
-            else:
-                 # Construir lista de dicts plana para DataFrame
-                clean_rows = []
-                for r in filtered_data:
-                    clean_rows.append({
-                        'Origen': r['origen'],
-                        'Part #': r['part_number'],
-                        'Qté Prod.': r['qte_a_produire'],
-                        'Stock Int.': r['stopa_quantity'],
-                        'Stock Ext.': r['external_quantity'],
-                        'Clasif.': r['clasificacion'],
-                        'Razón': r['razon'],
-                        'Faltante Auto.': r.get('deficit_internal', 0) if r.get('deficit_internal') else ''
-                    })
-                df = pd.DataFrame(clean_rows)
-            
-            df.to_excel(writer, sheet_name=f'Resultados {target_origin}', index=False)
-            filename = f"Resultados_{target_origin}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            
+            headers, rows = exports.RESULT_HEADERS, exports.iter_result_rows(analyzer.last_results, target_origin)
+            sheet_name = f'Resultados {target_origin}'
+
+        if file_format == 'xlsx':
+            # El libro (zip) solo es válido al cerrarse: se genera completo y se sirve desde la caché
+            output = EXPORT_CACHE.put(key, lambda f: exports.write_xlsx(f, sheet_name, headers, rows))
         else:
-            flash("Tipo de exportación no válido.")
-            return redirect(url_for('index'))
+            # CSV/TSV: cada bloque se envía en cuanto se genera y a la vez se guarda en la caché
+            delimiter = ',' if file_format == 'csv' else '\t'
+            chunks = EXPORT_CACHE.stream(key, exports.iter_delimited(headers, rows, delimiter))
+            response = Response(chunks, mimetype=EXPORT_MIMETYPES[file_format])
+            response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
 
-    output.seek(0)
-    
-    return send_file(
+    response = send_file(
         output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        mimetype=EXPORT_MIMETYPES[file_format],
         as_attachment=True,
-        download_name=filename
+        download_name=download_name,
+        etag=etag,
+        conditional=True
     )
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True)
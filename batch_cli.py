@@ -0,0 +1,313 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import exports
+from rules import RuleSet
+from stock_analyzer import StockAnalyzer, ResultSummary, ANALYSIS_MODES, DEFAULT_RULE_SET
+from table_cache import PdfTableCache, InventorySnapshotCache
+
+# Columnas del manifiesto (CSV con encabezado o lista JSON de objetos)
+MANIFEST_FIELDS = ('punch', 'laser', 'project', 'model', 'module')
+MODULE_HEADERS = ['Proyecto', 'Modelo', 'Módulo']
+
+_SOURCE_TOKEN = re.compile(r'[ _.-]*(punch|laser)[ _.-]*', re.IGNORECASE)
+
+
+def read_manifest(path, project='', model=''):
+    """
+    Lista de módulos {punch, laser, project, model, module} en el orden de análisis.
+    path puede ser un CSV, un JSON o un directorio: en un directorio los PDFs se emparejan por
+    nombre (p. ej. M101_punch.pdf + M101_laser.pdf -> módulo M101), en orden alfabético.
+    Las rutas relativas del manifiesto se resuelven desde su carpeta.
+    """
+    if os.path.isdir(path):
+        pairs = {}
+        for name in sorted(os.listdir(path)):
+            match = _SOURCE_TOKEN.search(os.path.splitext(name)[0])
+            if not name.lower().endswith('.pdf') or not match:
+                continue
+            stem = _SOURCE_TOKEN.sub('_', os.path.splitext(name)[0]).strip('_') or 'modulo'
+            pairs.setdefault(stem, {})[match.group(1).lower()] = os.path.join(path, name)
+        return [
+            {'punch': files.get('punch', ''), 'laser': files.get('laser', ''),
+             'project': project, 'model': model, 'module': stem}
+            for stem, files in pairs.items()
+        ]
+
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    modules = []
+    for i, row in enumerate(rows, start=1):
+        entry = {field: (row.get(field) or '').strip() for field in MANIFEST_FIELDS}
+        entry['project'] = entry['project'] or project
+        entry['model'] = entry['model'] or model
+        entry['module'] = entry['module'] or str(i)
+        for source in ('punch', 'laser'):
+            if entry[source] and not os.path.isabs(entry[source]):
+                entry[source] = os.path.join(base, entry[source])
+        modules.append(entry)
+    return modules
+
+
+def _load_pdf(file_path, source_name, cache_dir):
+    """
+    Extrae un PDF en un proceso del pool y deja su tabla en la caché de cache_dir (de donde la lee
+    el análisis por bloques); devuelve (filas, mensajes, etapas medidas), sin la tabla.
+    """
+    messages = []
+    analyzer = StockAnalyzer(log_callback=lambda message, msg_type: messages.append((msg_type, message)),
+                             pdf_cache=PdfTableCache(cache_dir))
+    # El paralelismo es entre archivos: cada PDF se extrae en serie dentro de su proceso
+    analyzer.pdf_workers = 1
+    pdf_data = analyzer.load_pdf_data(file_path, source_name)
+    return (len(pdf_data['dataframe']) if pdf_data else 0), messages, analyzer.stage_timings
+
+
+def load_all_pdfs(modules, workers, cache_dir, report):
+    """
+    Extrae todos los PDFs del manifiesto en paralelo (un proceso por archivo) hacia la caché de cache_dir.
+    Devuelve {(ruta, origen): (filas, etapas)}; si no hay soporte de procesos, carga en serie.
+    """
+    jobs = []
+    for module in modules:
+        for source in ('punch', 'laser'):
+            key = (module[source], source.capitalize())
+            if module[source] and key not in jobs:
+                jobs.append(key)
+
+    loaded = {}
+    done = 0
+
+    def collect(key, outcome):
+        nonlocal done
+        rows, messages, timings = outcome
+        done += 1
+        for msg_type, message in messages:
+            if msg_type in ('error', 'warning'):
+                report(f"  {os.path.basename(key[0])}: {message}", msg_type)
+        report(f"[{done}/{len(jobs)}] {key[1]} {os.path.basename(key[0])}: {rows} filas", 'process')
+        loaded[key] = (rows, timings)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs) or 1))) as pool:
+            futures = {key: pool.submit(_load_pdf, key[0], key[1], cache_dir) for key in jobs}
+            for key, future in futures.items():
+                collect(key, future.result())
+    except (OSError, NotImplementedError, BrokenProcessPool) as e:
+        # Sin soporte de procesos o un proceso terminó de forma abrupta: lo que falta se carga en serie
+        report(f"Extracción en paralelo no disponible ({str(e)}), cargando en serie.", 'warning')
+        for key in jobs:
+            if key not in loaded:
+                collect(key, _load_pdf(key[0], key[1], cache_dir))
+    return loaded
+
+
+def _slug(text):
+    return re.sub(r'[^0-9A-Za-z_-]+', '_', text).strip('_') or 'modulo'
+
+
+def write_export(path, file_format, sheet_name, headers, rows):
+    """Escribe una exportación en xlsx (write-only) o csv, fila a fila."""
+    if file_format == 'xlsx':
+        exports.write_xlsx(path, sheet_name, headers, rows)
+    else:
+        with open(path, 'wb') as f:
+            f.writelines(exports.iter_delimited(headers, rows))
+
+
+def iter_module_rows(module, results):
+    prefix = [module['project'], module['model'], module['module']]
+    for origin in ('Punch', 'Laser'):
+        for row in exports.iter_result_rows(results, origin):
+            yield prefix + row
+
+
+def run_batch(modules, inventory_path, output_dir, workers=None, mode=None, enabled_rules=None,
+              file_format='xlsx', cache_dir=None, use_cache=True, report=None, rules=None):
+    """
+    Procesa todos los módulos contra un único inventario de trabajo.
+    1. Extrae todos los PDFs en paralelo hacia la caché de tablas.  2. Analiza los módulos en orden,
+    leyendo cada tabla por bloques (run_streaming_analysis) y descontando stock secuencialmente.
+    3. Escribe una exportación por módulo, los consolidados y resumen.json.
+    :param use_cache: Sin caché, las tablas del turno van a un directorio temporal que se borra al terminar.
+    :param report: Función (mensaje, tipo) para el progreso; por defecto imprime en la consola.
+    :param rules: RuleSet a aplicar (por defecto las reglas de rules.py).
+    :return: Diccionario del resumen (también guardado en resumen.json).
+    """
+    report = report or (lambda message, msg_type='info': print(message))
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    if not use_cache:
+        with tempfile.TemporaryDirectory(prefix='xnrgy_batch_') as scratch:
+            return _run_batch(modules, inventory_path, output_dir, workers, mode, enabled_rules,
+                              file_format, scratch, None, report, rules)
+    pdf_cache_dir = os.path.join(cache_dir, 'pdf_tables') if cache_dir else PdfTableCache().directory
+    inventory_cache = InventorySnapshotCache(os.path.join(cache_dir, 'inventory') if cache_dir else None)
+    return _run_batch(modules, inventory_path, output_dir, workers, mode, enabled_rules,
+                      file_format, pdf_cache_dir, inventory_cache, report, rules)
+
+
+def _run_batch(modules, inventory_path, output_dir, workers, mode, enabled_rules,
+               file_format, pdf_cache_dir, inventory_cache, report, rules):
+    analyzer = StockAnalyzer(
+        log_callback=lambda message, msg_type: report(f"  {message}", msg_type),
+        pdf_cache=PdfTableCache(pdf_cache_dir),
+        inventory_cache=inventory_cache,
+        log_level='error'
+    )
+    if mode:
+        analyzer.analysis_mode = mode
+    if rules is not None:
+        analyzer.rules = rules
+
+    started = time.perf_counter()
+    report(f"Extrayendo PDFs de {len(modules)} módulos con {workers} procesos...", 'process')
+    pdfs = load_all_pdfs(modules, workers, pdf_cache_dir, report)
+    parse_wall = time.perf_counter() - started
+
+    inventory_data = analyzer.load_inventory_excel(inventory_path)
+    if not inventory_data:
+        raise ValueError(f"No se pudo cargar el inventario {inventory_path}")
+    with analyzer.stage("initialize_inventory") as timer:
+        analyzer.initialize_inventory(inventory_data)
+        timer.rows = inventory_data['rows']
+
+    all_results = []
+    summary_modules = []
+    for i, module in enumerate(modules, start=1):
+        punch_rows, punch_timings = pdfs.get((module['punch'], 'Punch'), (0, []))
+        laser_rows, laser_timings = pdfs.get((module['laser'], 'Laser'), (0, []))
+        label = f"[{i}/{len(modules)}] {module['module']}"
+        if not punch_rows and not laser_rows:
+            report(f"{label}: sin PDFs válidos, se omite.", 'error')
+            summary_modules.append({'module': module, 'status': 'error', 'error': 'Sin PDFs válidos'})
+            continue
+
+        # Las etapas de extracción (medidas en los procesos) quedan en la entrada del historial
+        analyzer.stage_timings.extend(punch_timings + laser_timings)
+        metadata = {'project': module['project'], 'model': module['model'], 'module': module['module']}
+        try:
+            results = analyzer.run_streaming_analysis(module['punch'] if punch_rows else None,
+                                                      module['laser'] if laser_rows else None,
+                                                      None, metadata, enabled_rules)
+        except Exception as e:
+            # El stock que llegó a consumir el módulo ya se restituyó (ver run_streaming_analysis)
+            report(f"{label}: {str(e)}; se omite.", 'error')
+            summary_modules.append({'module': module, 'status': 'error', 'error': str(e)})
+            continue
+        if not results:
+            report(f"{label}: sin items, se omite.", 'error')
+            summary_modules.append({'module': module, 'status': 'error', 'error': 'Sin items'})
+            continue
+        entry = analyzer.history[-1]
+
+        file_name = f"{i:03d}_{_slug(module['module'])}.{file_format}"
+        write_export(os.path.join(output_dir, file_name), file_format, 'Resultados',
+                     MODULE_HEADERS + exports.RESULT_HEADERS, iter_module_rows(module, results))
+        all_results.extend((module, res) for res in results)
+
+        stats = entry['stats']
+        report(f"{label}: {stats.get('total', 0)} items | A {stats.get('count_a', 0)} | "
+               f"C {stats.get('count_c', 0)} | BO {stats.get('count_bo', 0)} -> {file_name}", 'success')
+        summary_modules.append({
+            'module': module,
+            'status': 'done',
+            'export': file_name,
+            'stats': stats,
+            'rule_hits': entry['rule_hits'],
+            'timings': entry['timings']
+        })
+
+    # Consolidados: todos los resultados en orden y el resumen de inventario del turno
+    results_name = f"consolidado_resultados.{file_format}"
+    write_export(os.path.join(output_dir, results_name), file_format, 'Resultados',
+                 MODULE_HEADERS + exports.RESULT_HEADERS,
+                 (row for module, res in all_results for row in iter_module_rows(module, [res])))
+    inventory_name = f"consolidado_inventario.{file_format}"
+    consolidated = ResultSummary(res for _, res in all_results)
+    write_export(os.path.join(output_dir, inventory_name), file_format, 'Resumen Inventario',
+                 exports.INVENTORY_HEADERS, exports.iter_inventory_rows(consolidated.inventory_summary()))
+
+    # Tiempo total por etapa (sumando módulos)
+    stage_totals = {}
+    for module_summary in summary_modules:
+        for timing in module_summary.get('timings', []):
+            totals = stage_totals.setdefault(timing['stage'], {'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0})
+            totals['wall_s'] = round(totals['wall_s'] + timing['wall_s'], 6)
+            totals['cpu_s'] = round(totals['cpu_s'] + timing['cpu_s'], 6)
+            totals['rows'] += timing['rows'] or 0
+
+    summary = {
+        'inventory': inventory_path,
+        'modules': summary_modules,
+        'stats': consolidated.stats(),
+        'exports': {'results': results_name, 'inventory': inventory_name},
+        'parse_wall_s': round(parse_wall, 6),
+        'total_wall_s': round(time.perf_counter() - started, 6),
+        'stage_totals': stage_totals
+    }
+    with open(os.path.join(output_dir, 'resumen.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False, default=str)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Análisis por lotes: varios pares Punch/Laser contra un mismo inventario, sin interfaz.")
+    parser.add_argument('manifest', help="Manifiesto CSV/JSON (punch, laser, project, model, module) o directorio de PDFs")
+    parser.add_argument('--inventory', required=True, help="Excel de inventario")
+    parser.add_argument('--output', default='batch_output', help="Directorio de las exportaciones")
+    parser.add_argument('--format', choices=('xlsx', 'csv'), default='xlsx', dest='file_format')
+    parser.add_argument('--workers', type=int, default=None, help="Procesos para extraer PDFs (por defecto todos los núcleos)")
+    parser.add_argument('--mode', choices=ANALYSIS_MODES, default=None, help="Motor de clasificación")
+    parser.add_argument('--rules', default=None, help="JSON con las reglas de negocio (por defecto las de rules.py)")
+    parser.add_argument('--disable-rule', action='append', default=[],
+                        help="Desactiva una regla por nombre (se puede repetir)")
+    parser.add_argument('--project', default='', help="Proyecto por defecto de los módulos")
+    parser.add_argument('--model', default='', help="Modelo por defecto de los módulos")
+    parser.add_argument('--cache-dir', default=None, help="Directorio de cachés de PDF e inventario")
+    parser.add_argument('--no-cache', action='store_true', help="No usar las cachés en disco")
+    args = parser.parse_args(argv)
+
+    modules = read_manifest(args.manifest, args.project, args.model)
+    if not modules:
+        parser.error(f"No se encontraron módulos en {args.manifest}")
+    try:
+        rules = RuleSet.from_file(args.rules) if args.rules else DEFAULT_RULE_SET
+    except (OSError, ValueError) as e:
+        parser.error(f"No se pudieron cargar las reglas: {str(e)}")
+    unknown = set(args.disable_rule) - set(rules.defaults())
+    if unknown:
+        parser.error(f"Reglas desconocidas: {', '.join(sorted(unknown))}")
+    enabled_rules = {rule: active and rule not in args.disable_rule for rule, active in rules.defaults().items()}
+
+    def report(message, msg_type='info'):
+        print(message, file=sys.stderr if msg_type == 'error' else sys.stdout, flush=True)
+
+    summary = run_batch(modules, args.inventory, args.output, args.workers, args.mode, enabled_rules,
+                        args.file_format, args.cache_dir, not args.no_cache, report, rules)
+
+    print(f"\nTotal: {summary['stats'].get('total', 0)} items en "
+          f"{sum(1 for m in summary['modules'] if m['status'] == 'done')}/{len(modules)} módulos, "
+          f"{summary['total_wall_s']:.2f} s (extracción {summary['parse_wall_s']:.2f} s)")
+    for stage, values in summary['stage_totals'].items():
+        print(f"  {stage:<32} {values['wall_s']:>10.4f} s  (cpu {values['cpu_s']:.4f} s, filas {values['rows']})")
+    print(f"Exportaciones y resumen.json en {args.output}")
+    return 0 if all(m['status'] == 'done' for m in summary['modules']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
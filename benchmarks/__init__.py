@@ -0,0 +1,5 @@
+"""
+Benchmarks reproducibles del análisis de stock.
+Genera PDFs Punch/Laser e inventarios sintéticos y mide cada etapa por separado:
+    python -m benchmarks.run --sizes small,medium --output benchmark_results.json
+"""
@@ -0,0 +1,119 @@
+import random
+
+import pandas as pd
+
+# Encabezados que extract_pdf_items reconoce (Part / Qté ... Produire / material / thickness)
+REPORT_HEADERS = ['Part #', 'Qté à Produire', 'Material', 'Thickness']
+
+MATERIALS = ['AL 5052', 'GALV G90', 'SS 304', 'CRS']
+GAUGES = ['10', '12', '14', '16', '18', '20']
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 36
+ROW_HEIGHT = 14
+COLUMN_WIDTHS = [140, 110, 110, 90]
+FONT_SIZE = 8
+
+
+def make_part_numbers(count, start=10000):
+    """Part numbers numéricos consecutivos, como los del ERP."""
+    return [str(start + i) for i in range(count)]
+
+
+def _pdf_text(value):
+    """Texto literal PDF (WinAnsi/latin-1) con paréntesis y barras escapados."""
+    text = str(value).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return text.encode('latin-1', errors='replace')
+
+
+def _page_stream(rows):
+    """Contenido de una página: una celda con borde por valor y su texto."""
+    ops = [b'0.5 w']
+    y = PAGE_HEIGHT - MARGIN - ROW_HEIGHT
+    for row in rows:
+        x = MARGIN
+        for width, value in zip(COLUMN_WIDTHS, row):
+            ops.append(b'%d %d %d %d re S' % (x, y, width, ROW_HEIGHT))
+            ops.append(b'BT /F1 %d Tf %d %d Td (' % (FONT_SIZE, x + 3, y + 4) + _pdf_text(value) + b') Tj ET')
+            x += width
+        y -= ROW_HEIGHT
+    return b'\n'.join(ops)
+
+
+def write_table_pdf(path, rows, rows_per_page=50):
+    """
+    Escribe un PDF con una tabla de celdas delimitadas por líneas, el formato que
+    pdfplumber.extract_table() detecta. La primera fila (encabezado) va solo en la primera página.
+    """
+    pages = [rows[i:i + rows_per_page] for i in range(0, len(rows), rows_per_page)] or [[]]
+    font_id = 3
+    first_page_id = 4
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        font_id: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    }
+    kids = []
+    for n, page_rows in enumerate(pages):
+        page_id = first_page_id + 2 * n
+        content_id = page_id + 1
+        stream = _page_stream(page_rows)
+        objects[page_id] = (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+            % (PAGE_WIDTH, PAGE_HEIGHT, font_id, content_id)
+        )
+        objects[content_id] = b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream'
+        kids.append(b'%d 0 R' % page_id)
+    objects[2] = b'<< /Type /Pages /Kids [' + b' '.join(kids) + b'] /Count %d >>' % len(kids)
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b'%d 0 obj\n' % obj_id + objects[obj_id] + b'\nendobj\n'
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for obj_id in range(1, size):
+        out += b'%010d 00000 n \n' % offsets[obj_id]
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref_offset)
+
+    with open(path, 'wb') as f:
+        f.write(out)
+    return len(pages)
+
+
+def write_report_pdf(path, item_count, part_numbers, seed=0, rows_per_page=50):
+    """
+    Reporte Punch/Laser sintético con item_count líneas tomadas de part_numbers.
+    Devuelve el número de páginas.
+    """
+    rnd = random.Random(seed)
+    rows = [REPORT_HEADERS]
+    for _ in range(item_count):
+        rows.append([
+            rnd.choice(part_numbers),
+            str(rnd.randint(1, 8)),
+            rnd.choice(MATERIALS),
+            rnd.choice(GAUGES)
+        ])
+    return write_table_pdf(path, rows, rows_per_page)
+
+
+def write_inventory_xlsx(path, part_numbers, seed=0):
+    """
+    Inventario sintético con partNumber / stopaQuantity / externalQuantity (+ materialName, gauge).
+    La mezcla de cantidades cubre todas las clasificaciones (A, C, M por stock externo bajo, BO).
+    """
+    rnd = random.Random(seed)
+    stopa = [rnd.choice([0, 0, 0, 1, 2, 5, 10, 25, 100]) for _ in part_numbers]
+    external = [rnd.choice([0, 0, 1, 2, 5, 20]) for _ in part_numbers]
+    df = pd.DataFrame({
+        'partNumber': [int(pn) for pn in part_numbers],
+        'stopaQuantity': stopa,
+        'externalQuantity': external,
+        'materialName': [rnd.choice(MATERIALS) for _ in part_numbers],
+        'gauge': [rnd.choice(GAUGES) for _ in part_numbers]
+    })
+    df.to_excel(path, index=False)
+    return len(df)
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock_analyzer import StockAnalyzer, PDF_STRATEGIES  # noqa: E402
+from benchmarks.generators import make_part_numbers, write_report_pdf, write_inventory_xlsx  # noqa: E402
+
+# Tamaños predefinidos: (líneas Punch, líneas Laser, filas de inventario)
+SIZES = {
+    'small': (200, 200, 2000),
+    'medium': (2000, 2000, 10000),
+    'large': (10000, 10000, 40000),
+}
+
+
+def parse_size(spec):
+    """'small' / 'medium' / 'large' o 'punch:laser:inventario' (p. ej. '5000:3000:40000')."""
+    if spec in SIZES:
+        return spec, SIZES[spec]
+    punch, laser, inventory = (int(v) for v in spec.split(':'))
+    return spec, (punch, laser, inventory)
+
+
+def timed(stages, name, fn, rows=None, repeat=1, setup=None):
+    """
+    Ejecuta fn repeat veces y guarda el mejor tiempo (wall y CPU) de la etapa.
+    :param setup: Función opcional que se ejecuta antes de cada repetición, fuera de la medición.
+    """
+    best_wall = best_cpu = None
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    stages[name] = {
+        'wall_s': round(best_wall, 6),
+        'cpu_s': round(best_cpu, 6),
+        'rows': rows(result) if callable(rows) else rows
+    }
+    return result
+
+
+def fresh_inventory(analyzer, inventory_data):
+    """Vuelve a partir del inventario sin consumos."""
+    analyzer.df_inventory_working = None
+    analyzer.inventory_index = None
+    analyzer.initialize_inventory(inventory_data)
+
+
+def time_exports(stages, analyzer, repeat):
+    """Mide la ruta /export/<tipo> de la app web con el analizador ya cargado."""
+    import app as web
+
+    # Ejecución propia para que las exportaciones no se sirvan desde EXPORT_CACHE
+    analyzer.run_id = uuid.uuid4().hex
+    web.STATE.save('benchmark', analyzer)
+    client = web.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+        sess['user'] = 'benchmark'
+    exported_rows = {
+        'punch': sum(1 for r in analyzer.last_results if r['origen'] == 'Punch'),
+        'laser': sum(1 for r in analyzer.last_results if r['origen'] == 'Laser'),
+        'inventory': len(analyzer.get_inventory_summary())
+    }
+    for export_type in ('punch', 'laser', 'inventory'):
+        timed(stages, f'export_results[{export_type}]',
+              lambda: client.get(f'/export/{export_type}').get_data(),
+              rows=exported_rows[export_type], repeat=repeat,
+              setup=lambda: web.EXPORT_CACHE.invalidate(analyzer.run_id))
+    web.EXPORT_CACHE.invalidate(analyzer.run_id)
+    web.STATE.discard('benchmark')
+
+
+def run_case(name, size, workdir, repeat=1, pdf_workers=1, seed=0, pdf_strategy='auto'):
+    punch_count, laser_count, inventory_count = size
+    part_numbers = make_part_numbers(inventory_count)
+    # Los reportes usan una fracción del catálogo para que haya demanda repetida por pieza
+    used_parts = part_numbers[:max(1, inventory_count // 4)]
+
+    paths = {
+        'punch': os.path.join(workdir, f'{name}_punch.pdf'),
+        'laser': os.path.join(workdir, f'{name}_laser.pdf'),
+        'inventory': os.path.join(workdir, f'{name}_inventory.xlsx'),
+    }
+    pages = {
+        'punch': write_report_pdf(paths['punch'], punch_count, used_parts, seed=seed + 1),
+        'laser': write_report_pdf(paths['laser'], laser_count, used_parts, seed=seed + 2),
+    }
+    write_inventory_xlsx(paths['inventory'], part_numbers, seed=seed)
+
+    analyzer = StockAnalyzer(log_callback=lambda message, msg_type: None)
+    analyzer.pdf_workers = pdf_workers
+    analyzer.pdf_strategy = pdf_strategy
+    stages = {}
+
+    punch_data = timed(stages, 'load_pdf_data[punch]', lambda: analyzer.load_pdf_data(paths['punch'], 'Punch'),
+                       rows=lambda d: len(d['dataframe']), repeat=repeat)
+    laser_data = timed(stages, 'load_pdf_data[laser]', lambda: analyzer.load_pdf_data(paths['laser'], 'Laser'),
+                       rows=lambda d: len(d['dataframe']), repeat=repeat)
+    inventory_data = timed(stages, 'load_inventory_excel', lambda: analyzer.load_inventory_excel(paths['inventory']),
+                           rows=lambda d: d['rows'], repeat=repeat)
+    timed(stages, 'initialize_inventory', lambda: fresh_inventory(analyzer, inventory_data),
+          rows=inventory_count, repeat=repeat)
+
+    def extract():
+        return [('Punch', analyzer.extract_pdf_items(punch_data, 'Punch')),
+                ('Laser', analyzer.extract_pdf_items(laser_data, 'Laser'))]
+    sourced_items = timed(stages, 'extract_pdf_items', extract,
+                          rows=lambda s: sum(len(items) for _, items in s), repeat=repeat)
+    item_count = sum(len(items) for _, items in sourced_items)
+
+    results = None
+    for mode in ('sequential', 'batch'):
+        results = timed(stages, f'analyze[{mode}]', lambda: analyzer._analyze_items(sourced_items, mode=mode),
+                        rows=len, repeat=repeat, setup=lambda: fresh_inventory(analyzer, inventory_data))
+    # Flujo de /analyze y batch_cli (páginas -> items -> resultados por bloques), comparable con
+    # load_pdf_data + extract_pdf_items + analyze[batch]
+    timed(stages, 'streaming_analysis', lambda: analyzer.run_streaming_analysis(paths['punch'], paths['laser']),
+          rows=len, repeat=repeat, setup=lambda: fresh_inventory(analyzer, inventory_data))
+    analyzer.last_results = results
+
+    timed(stages, 'get_summary_stats', analyzer.get_summary_stats, rows=item_count, repeat=repeat)
+    timed(stages, 'get_inventory_summary', analyzer.get_inventory_summary, rows=len, repeat=repeat)
+    time_exports(stages, analyzer, repeat)
+
+    return {
+        'name': name,
+        'punch_items': punch_count,
+        'laser_items': laser_count,
+        'inventory_rows': inventory_count,
+        'pages': pages,
+        'stages': stages
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del análisis de stock.")
+    parser.add_argument('--sizes', default='small,medium',
+                        help="Lista separada por comas: small, medium, large o punch:laser:inventario")
+    parser.add_argument('--repeat', type=int, default=1, help="Repeticiones por etapa (se guarda el mejor tiempo)")
+    parser.add_argument('--pdf-workers', type=int, default=1, help="Procesos para extraer PDFs (1 = serie)")
+    parser.add_argument('--pdf-strategy', choices=PDF_STRATEGIES, default='auto',
+                        help="auto: capa de texto con respaldo a extract_table; table: siempre extract_table")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help="Directorio para los archivos generados (por defecto temporal)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Archivo JSON de resultados")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='xnrgy_bench_')
+    os.makedirs(workdir, exist_ok=True)
+
+    cases = []
+    for spec in args.sizes.split(','):
+        name, size = parse_size(spec.strip())
+        case = run_case(name.replace(':', 'x'), size, workdir, args.repeat, args.pdf_workers, args.seed, args.pdf_strategy)
+        cases.append(case)
+        print(f"{case['name']}: {case['punch_items']}+{case['laser_items']} items, "
+              f"{case['inventory_rows']} filas de inventario")
+        for stage, values in case['stages'].items():
+            print(f"  {stage:<32} {values['wall_s']:>10.4f} s  (cpu {values['cpu_s']:.4f} s, filas {values['rows']})")
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'pdf_workers': args.pdf_workers,
+        'pdf_strategy': args.pdf_strategy,
+        'cases': cases
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == '__main__':
+    main()
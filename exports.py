@@ -0,0 +1,128 @@
+import csv
+import io
+
+from openpyxl import Workbook
+
+# Columnas de las exportaciones (mismos encabezados que las tablas de la interfaz web)
+RESULT_HEADERS = ['Origen', 'Part #', 'Qté Prod.', 'Stock Int.', 'Stock Ext.', 'Clasif.', 'Razón', 'Faltante Auto.']
+INVENTORY_COLUMNS = [
+    ('part_number', 'Part #'),
+    ('materiel', 'Matériel'),
+    ('epaisseur', 'Épaisseur'),
+    ('total_required', 'Total a Producir'),
+    ('initial_stock', 'Stock Total (Disp.)'),
+    ('missing', 'Faltante (Deficit)'),
+]
+INVENTORY_HEADERS = [header for _, header in INVENTORY_COLUMNS]
+
+# Exportación detallada del escritorio: columnas prioritarias y luego las del PDF de origen
+DETAILED_KEY_COLUMNS = [
+    ('Origen', 'origen'),
+    ('Part #', 'part_number'),
+    ('Qté à Produire', 'qte_a_produire'),
+    ('Análisis', 'clasificacion'),
+    ('Razón', 'razon'),
+    ('Stock Interno', 'stopa_quantity'),
+    ('Stock Externo', 'external_quantity'),
+]
+
+# Filas por bloque en las exportaciones CSV/TSV
+CSV_CHUNK_ROWS = 1000
+
+
+def iter_result_rows(results, origin):
+    """Filas de resultados de un origen ('Punch' o 'Laser'), en el orden de RESULT_HEADERS."""
+    for r in results:
+        if r['origen'] != origin:
+            continue
+        yield [
+            r['origen'],
+            r['part_number'],
+            r['qte_a_produire'],
+            r['stopa_quantity'],
+            r['external_quantity'],
+            r['clasificacion'],
+            r['razon'],
+            r.get('deficit_internal', 0) if r.get('deficit_internal') else ''
+        ]
+
+
+def iter_inventory_rows(inventory_summary):
+    """Filas del resumen de inventario, en el orden de INVENTORY_HEADERS."""
+    for item in inventory_summary:
+        yield [item[key] for key, _ in INVENTORY_COLUMNS]
+
+
+def detailed_headers(results):
+    """
+    Encabezados de la exportación detallada: DETAILED_KEY_COLUMNS y después las columnas de
+    las tablas de origen (full_row) en orden de aparición. Cada tabla se inspecciona una sola vez.
+    """
+    key_headers = [header for header, _ in DETAILED_KEY_COLUMNS]
+    headers = list(key_headers)
+    seen = set(headers)
+    seen_tables = set()
+    for r in results:
+        table = getattr(r, 'source_table', None)
+        if table is not None:
+            if id(table) in seen_tables:
+                continue
+            seen_tables.add(id(table))
+            columns = table.columns
+        else:
+            columns = r.get('full_row', {}).keys()
+        for column in columns:
+            if column not in seen:
+                seen.add(column)
+                headers.append(column)
+    return headers
+
+
+def iter_detailed_rows(results, headers):
+    """Filas de la exportación detallada: campos del resultado más la fila del PDF de origen."""
+    extra = headers[len(DETAILED_KEY_COLUMNS):]
+    for r in results:
+        full_row = r.get('full_row', {})
+        yield [r.get(key) for _, key in DETAILED_KEY_COLUMNS] + [full_row.get(column) for column in extra]
+
+
+def _cell(value):
+    # openpyxl no acepta NaN de pandas como celda vacía
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+
+def write_xlsx(target, sheet_name, headers, rows):
+    """
+    Escribe un libro con openpyxl en modo write-only: las filas se vuelcan una a una sin
+    construir el libro en memoria. target es una ruta o un archivo binario.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name[:31])
+    sheet.append(headers)
+    for row in rows:
+        sheet.append([_cell(value) for value in row])
+    workbook.save(target)
+
+
+def iter_delimited(headers, rows, delimiter=',', chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Genera el CSV/TSV por bloques de chunk_rows filas (UTF-8 con BOM para que Excel
+    reconozca los acentos), para enviarlo como respuesta por partes.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    pending = 0
+    for row in rows:
+        writer.writerow(['' if _cell(value) is None else value for value in row])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
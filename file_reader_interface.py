@@ -1,9 +1,101 @@
+import queue
+import threading
 import tkinter as tk
+from datetime import datetime
 from tkinter import filedialog, ttk
-import pandas as pd
+import exports
 from pathlib import Path
 from stock_analyzer import StockAnalyzer
 
+# Cada cuántos ms el hilo de Tk vacía la cola de eventos del hilo de trabajo
+QUEUE_POLL_MS = 50
+# Eventos procesados como máximo por ciclo (el resto espera al siguiente y la ventana sigue respondiendo)
+QUEUE_BATCH = 500
+# Líneas que conserva el registro de procesos (las más antiguas se descartan)
+LOG_MAX_LINES = 2000
+# Filas de resultados por página en las tablas
+RESULTS_PAGE_SIZE = 200
+
+
+class ResultsTable:
+    """
+    Tabla paginada de resultados sobre un ttk.Treeview: el widget solo contiene las filas de la
+    página visible (RESULTS_PAGE_SIZE) y cambiar de página reemplaza esas filas.
+    """
+
+    COLUMNS = (
+        ("part_number", "Part #", 90),
+        ("qte", "Qte", 50),
+        ("stopa", "StkInt", 60),
+        ("external", "StkExt", 60),
+        ("clasif", "Clasif", 50),
+        ("razon", "Razón", 220)
+    )
+
+    def __init__(self, parent, height=6):
+        self.results = []
+        self.page = 0
+
+        table_frame = tk.Frame(parent, bg="#f0f0f0")
+        table_frame.pack(fill="both", expand=True)
+
+        scrollbar_y = ttk.Scrollbar(table_frame, orient="vertical")
+        scrollbar_y.pack(side="right", fill="y")
+
+        self.tree = ttk.Treeview(
+            table_frame,
+            columns=[name for name, _, _ in self.COLUMNS],
+            show="headings",
+            height=height,
+            yscrollcommand=scrollbar_y.set
+        )
+        for name, title, width in self.COLUMNS:
+            self.tree.heading(name, text=title)
+            self.tree.column(name, width=width, stretch=(name == "razon"))
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar_y.config(command=self.tree.yview)
+
+        nav_frame = tk.Frame(parent, bg="#f0f0f0")
+        nav_frame.pack(fill="x", pady=(3, 0))
+        self.prev_btn = tk.Button(nav_frame, text="◀", command=lambda: self.show_page(self.page - 1), state="disabled")
+        self.prev_btn.pack(side="left")
+        self.page_label = tk.Label(nav_frame, text="No resultados.", font=("Arial", 9), bg="#f0f0f0", fg="#666666")
+        self.page_label.pack(side="left", padx=10)
+        self.next_btn = tk.Button(nav_frame, text="▶", command=lambda: self.show_page(self.page + 1), state="disabled")
+        self.next_btn.pack(side="left")
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.results) // RESULTS_PAGE_SIZE))
+
+    def set_results(self, results):
+        self.results = results
+        self.show_page(0)
+
+    def show_page(self, page):
+        self.page = min(max(page, 0), self.page_count - 1)
+        self.tree.delete(*self.tree.get_children())
+        start = self.page * RESULTS_PAGE_SIZE
+        for r in self.results[start:start + RESULTS_PAGE_SIZE]:
+            self.tree.insert("", tk.END, values=(
+                r['part_number'],
+                r['qte_a_produire'],
+                int(r['stopa_quantity']),
+                int(r['external_quantity']),
+                r['clasificacion'] or "",
+                r['razon']
+            ))
+        self.tree.yview_moveto(0)
+
+        if self.results:
+            end = min(start + RESULTS_PAGE_SIZE, len(self.results))
+            self.page_label.config(text=f"Página {self.page + 1} de {self.page_count} (filas {start + 1}-{end} de {len(self.results)})")
+        else:
+            self.page_label.config(text="No resultados.")
+        self.prev_btn.config(state="normal" if self.page > 0 else "disabled")
+        self.next_btn.config(state="normal" if self.page < self.page_count - 1 else "disabled")
+
+
 class FileReaderInterface:
     def __init__(self, root):
         self.root = root
@@ -18,8 +110,14 @@ class FileReaderInterface:
         self.punch_pdf_path = None
         self.laser_pdf_path = None
         self.inventory_excel_path = None
+
+        # Las cargas, el análisis y la exportación corren en un hilo de trabajo (uno a la vez);
+        # sus logs y su resultado llegan por esta cola, que el hilo de Tk vacía con root.after
+        self.events = queue.Queue()
+        self.busy = False
         
         self.create_widgets()
+        self.root.after(QUEUE_POLL_MS, self.process_events)
     
     def log_message_adapter(self, message, msg_type="info"):
         """Adaptador para que StockAnalyzer use el sistema de logs de la GUI"""
@@ -204,29 +302,7 @@ class FileReaderInterface:
         )
         punch_label.pack(anchor="w", pady=(0, 5))
         
-        punch_listbox_frame = tk.Frame(punch_results_frame, bg="#f0f0f0")
-        punch_listbox_frame.pack(fill="both", expand=True)
-        
-        punch_scrollbar_y = tk.Scrollbar(punch_listbox_frame, orient="vertical")
-        punch_scrollbar_y.pack(side="right", fill="y")
-        
-        punch_scrollbar_x = tk.Scrollbar(punch_listbox_frame, orient="horizontal")
-        punch_scrollbar_x.pack(side="bottom", fill="x")
-        
-        self.punch_results_listbox = tk.Listbox(
-            punch_listbox_frame,
-            font=("Consolas", 9),
-            bg="#ffffff",
-            fg="#333333",
-            selectbackground="#e3f2fd",
-            yscrollcommand=punch_scrollbar_y.set,
-            xscrollcommand=punch_scrollbar_x.set,
-            height=6
-        )
-        self.punch_results_listbox.pack(side="left", fill="both", expand=True)
-        
-        punch_scrollbar_y.config(command=self.punch_results_listbox.yview)
-        punch_scrollbar_x.config(command=self.punch_results_listbox.xview)
+        self.punch_results_table = ResultsTable(punch_results_frame)
         
         # ========== TABLA RESULTADOS LASER ==========
         laser_results_frame = tk.Frame(main_frame, bg="#f0f0f0")
@@ -243,29 +319,7 @@ class FileReaderInterface:
         )
         laser_label.pack(anchor="w", pady=(0, 5))
         
-        laser_listbox_frame = tk.Frame(laser_results_frame, bg="#f0f0f0")
-        laser_listbox_frame.pack(fill="both", expand=True)
-        
-        laser_scrollbar_y = tk.Scrollbar(laser_listbox_frame, orient="vertical")
-        laser_scrollbar_y.pack(side="right", fill="y")
-        
-        laser_scrollbar_x = tk.Scrollbar(laser_listbox_frame, orient="horizontal")
-        laser_scrollbar_x.pack(side="bottom", fill="x")
-        
-        self.laser_results_listbox = tk.Listbox(
-            laser_listbox_frame,
-            font=("Consolas", 9),
-            bg="#ffffff",
-            fg="#333333",
-            selectbackground="#e3f2fd",
-            yscrollcommand=laser_scrollbar_y.set,
-            xscrollcommand=laser_scrollbar_x.set,
-            height=6
-        )
-        self.laser_results_listbox.pack(side="left", fill="both", expand=True)
-        
-        laser_scrollbar_y.config(command=self.laser_results_listbox.yview)
-        laser_scrollbar_x.config(command=self.laser_results_listbox.xview)
+        self.laser_results_table = ResultsTable(laser_results_frame)
     
     def create_file_input(self, parent, row, label_text, browse_command, 
                           entry_var_name, browse_btn_name, status_label_name, enabled):
@@ -363,91 +417,118 @@ class FileReaderInterface:
     
     def load_punch_pdf(self):
         """Carga el PDF de Punch"""
+        if not self.check_idle():
+            return
         file_path = filedialog.askopenfilename(
             title="Seleccionar PDF para Punch",
             filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")]
         )
         
         if file_path:
-            # Usar Analyzer
-            self.analyzer.punch_data = self.analyzer.load_pdf_data(file_path, "Punch")
+            # Usar Analyzer (en el hilo de trabajo)
+            self.punch_status_label.config(text="⏳ Leyendo archivo...", fg="#666666")
+            self.run_task(
+                lambda: self.analyzer.load_pdf_data(file_path, "Punch"),
+                lambda pdf_data: self.on_punch_loaded(file_path, pdf_data)
+            )
+
+    def on_punch_loaded(self, file_path, pdf_data):
+        self.analyzer.punch_data = pdf_data
+
+        if self.analyzer.punch_data:
+            # Update UI
+            self.punch_pdf_path = file_path
+            self.punch_entry.configure(state="normal")
+            self.punch_entry.delete(0, tk.END)
+            self.punch_entry.insert(0, Path(file_path).name)
+            self.punch_entry.configure(state="readonly")
+            
+            rows = len(self.analyzer.punch_data['dataframe'])
+            self.punch_status_label.config(
+                text=f"✓ Carga exitosa ({rows} filas)",
+                fg="#4CAF50"
+            )
             
-            if self.analyzer.punch_data:
-                # Update UI
-                self.punch_pdf_path = file_path
-                self.punch_entry.configure(state="normal")
-                self.punch_entry.delete(0, tk.END)
-                self.punch_entry.insert(0, Path(file_path).name)
-                self.punch_entry.configure(state="readonly")
-                
-                rows = len(self.analyzer.punch_data['dataframe'])
-                self.punch_status_label.config(
-                    text=f"✓ Carga exitosa ({rows} filas)",
-                    fg="#4CAF50"
-                )
-                
-                self.show_pdf_preview(self.analyzer.punch_data, self.punch_preview)
-                self.enable_laser_input()
-            else:
-                 self.punch_status_label.config(text="✗ Error al leer archivo", fg="#f44336")
+            self.show_pdf_preview(self.analyzer.punch_data, self.punch_preview)
+            self.enable_laser_input()
+        else:
+            self.punch_status_label.config(text="✗ Error al leer archivo", fg="#f44336")
 
     def load_laser_pdf(self):
         """Carga el PDF de Laser"""
+        if not self.check_idle():
+            return
         file_path = filedialog.askopenfilename(
             title="Seleccionar PDF para Laser",
             filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")]
         )
         
         if file_path:
-            # Usar Analyzer
-            self.analyzer.laser_data = self.analyzer.load_pdf_data(file_path, "Laser")
+            # Usar Analyzer (en el hilo de trabajo)
+            self.laser_status_label.config(text="⏳ Leyendo archivo...", fg="#666666")
+            self.run_task(
+                lambda: self.analyzer.load_pdf_data(file_path, "Laser"),
+                lambda pdf_data: self.on_laser_loaded(file_path, pdf_data)
+            )
+
+    def on_laser_loaded(self, file_path, pdf_data):
+        self.analyzer.laser_data = pdf_data
+
+        if self.analyzer.laser_data:
+            # Update UI
+            self.laser_pdf_path = file_path
+            self.laser_entry.configure(state="normal")
+            self.laser_entry.delete(0, tk.END)
+            self.laser_entry.insert(0, Path(file_path).name)
+            self.laser_entry.configure(state="readonly")
+            
+            rows = len(self.analyzer.laser_data['dataframe'])
+            self.laser_status_label.config(
+                text=f"✓ Carga exitosa ({rows} filas)",
+                fg="#4CAF50"
+            )
             
-            if self.analyzer.laser_data:
-                # Update UI
-                self.laser_pdf_path = file_path
-                self.laser_entry.configure(state="normal")
-                self.laser_entry.delete(0, tk.END)
-                self.laser_entry.insert(0, Path(file_path).name)
-                self.laser_entry.configure(state="readonly")
-                
-                rows = len(self.analyzer.laser_data['dataframe'])
-                self.laser_status_label.config(
-                    text=f"✓ Carga exitosa ({rows} filas)",
-                    fg="#4CAF50"
-                )
-                
-                self.show_pdf_preview(self.analyzer.laser_data, self.laser_preview)
-                self.enable_inventory_input()
-            else:
-                 self.laser_status_label.config(text="✗ Error al leer archivo", fg="#f44336")
+            self.show_pdf_preview(self.analyzer.laser_data, self.laser_preview)
+            self.enable_inventory_input()
+        else:
+            self.laser_status_label.config(text="✗ Error al leer archivo", fg="#f44336")
 
     def load_inventory_excel(self):
         """Carga el Excel de Inventario"""
+        if not self.check_idle():
+            return
         file_path = filedialog.askopenfilename(
             title="Seleccionar Excel para Inventario",
             filetypes=[("Excel files", "*.xlsx *.xls"), ("All files", "*.*")]
         )
         
         if file_path:
-            # Usar Analyzer
-            self.analyzer.inventory_data = self.analyzer.load_inventory_excel(file_path)
+            # Usar Analyzer (en el hilo de trabajo)
+            self.inventory_status_label.config(text="⏳ Leyendo archivo...", fg="#666666")
+            self.run_task(
+                lambda: self.analyzer.load_inventory_excel(file_path),
+                lambda inventory_data: self.on_inventory_loaded(file_path, inventory_data)
+            )
+
+    def on_inventory_loaded(self, file_path, inventory_data):
+        self.analyzer.inventory_data = inventory_data
+
+        if self.analyzer.inventory_data:
+            self.inventory_excel_path = file_path
+            self.inventory_entry.configure(state="normal")
+            self.inventory_entry.delete(0, tk.END)
+            self.inventory_entry.insert(0, Path(file_path).name)
+            self.inventory_entry.configure(state="readonly")
+            
+            rows = self.analyzer.inventory_data['rows']
+            self.inventory_status_label.config(
+                text=f"✓ Carga exitosa ({rows} filas)",
+                fg="#4CAF50"
+            )
             
-            if self.analyzer.inventory_data:
-                self.inventory_excel_path = file_path
-                self.inventory_entry.configure(state="normal")
-                self.inventory_entry.delete(0, tk.END)
-                self.inventory_entry.insert(0, Path(file_path).name)
-                self.inventory_entry.configure(state="readonly")
-                
-                rows = self.analyzer.inventory_data['rows']
-                self.inventory_status_label.config(
-                    text=f"✓ Carga exitosa ({rows} filas)",
-                    fg="#4CAF50"
-                )
-                
-                self.show_excel_preview(self.analyzer.inventory_data, self.inventory_preview)
-            else:
-                self.inventory_status_label.config(text="✗ Error al leer archivo", fg="#f44336")
+            self.show_excel_preview(self.analyzer.inventory_data, self.inventory_preview)
+        else:
+            self.inventory_status_label.config(text="✗ Error al leer archivo", fg="#f44336")
     
     def show_pdf_preview(self, pdf_data, preview_listbox):
         """Muestra preview de datos extraídos del PDF"""
@@ -475,8 +556,10 @@ class FileReaderInterface:
             preview_listbox.insert(tk.END, f"Error preview: {e}")
     
     def log_message(self, message, msg_type="info"):
-        """Agrega un mensaje al log con timestamp"""
-        from datetime import datetime
+        """
+        Agrega un mensaje al log con timestamp. Se puede llamar desde cualquier hilo: la línea
+        pasa por la cola de eventos y la inserta el hilo de Tk en el siguiente ciclo.
+        """
         timestamp = datetime.now().strftime("%H:%M:%S")
         
         if msg_type == "error":
@@ -491,12 +574,79 @@ class FileReaderInterface:
             prefix = "ℹ INFO"
         
         log_entry = f"[{timestamp}] {prefix}: {message}"
-        self.log_listbox.insert(tk.END, log_entry)
+        self.events.put(("log", log_entry))
+
+    def process_events(self):
+        """Vacía la cola de eventos (hilo de Tk): las líneas de log se insertan en bloque."""
+        lines = []
+        try:
+            for _ in range(QUEUE_BATCH):
+                event = self.events.get_nowait()
+                if event[0] == "log":
+                    lines.append(event[1])
+                else:
+                    # Fin de la tarea: primero sus logs pendientes, luego el callback
+                    self.append_log(lines)
+                    lines = []
+                    self.finish_task(*event[1:])
+        except queue.Empty:
+            pass
+        finally:
+            try:
+                self.append_log(lines)
+            finally:
+                # Pase lo que pase en este ciclo, la cola se sigue vaciando
+                self.root.after(QUEUE_POLL_MS, self.process_events)
+
+    def append_log(self, lines):
+        if not lines:
+            return
+        self.log_listbox.insert(tk.END, *lines)
+        overflow = self.log_listbox.size() - LOG_MAX_LINES
+        if overflow > 0:
+            self.log_listbox.delete(0, overflow - 1)
         self.log_listbox.see(tk.END)
-        self.root.update_idletasks()
+
+    def check_idle(self):
+        """True si no hay una tarea en curso (si la hay, lo indica en el log)."""
+        if self.busy:
+            self.log_message("Hay una tarea en curso; espere a que termine.", "warning")
+        return not self.busy
+
+    def run_task(self, task, on_done=None):
+        """
+        Ejecuta task() en un hilo de trabajo. Al terminar, on_done(resultado) se llama en el hilo
+        de Tk; una excepción se registra en el log.
+        """
+        self.set_busy(True)
+
+        def work():
+            try:
+                self.events.put(("done", on_done, task(), None))
+            except Exception as e:
+                self.events.put(("done", on_done, None, e))
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def finish_task(self, on_done, result, error):
+        self.set_busy(False)
+        if error is not None:
+            self.log_message(f"Error inesperado: {error}", "error")
+        elif on_done:
+            try:
+                on_done(result)
+            except Exception as e:
+                self.log_message(f"Error mostrando el resultado: {e}", "error")
+
+    def set_busy(self, busy):
+        self.busy = busy
+        self.analysis_btn.config(state="disabled" if busy else "normal")
+        self.root.config(cursor="watch" if busy else "")
     
     def run_analysis(self):
         """Ejecuta el análisis de programación"""
+        if not self.check_idle():
+            return
         self.log_listbox.delete(0, tk.END)
         self.log_message("Iniciando análisis...", "process")
         
@@ -504,13 +654,16 @@ class FileReaderInterface:
             self.log_message("Faltan archivos por cargar.", "error")
             return
 
-        # EJECUTAR ANÁLISIS EN EL ANALYZER
-        results = self.analyzer.run_full_analysis(
-            self.analyzer.punch_data,
-            self.analyzer.laser_data,
-            self.analyzer.inventory_data
+        # EJECUTAR ANÁLISIS EN EL ANALYZER (hilo de trabajo)
+        punch_data = self.analyzer.punch_data
+        laser_data = self.analyzer.laser_data
+        inventory_data = self.analyzer.inventory_data
+        self.run_task(
+            lambda: self.analyzer.run_full_analysis(punch_data, laser_data, inventory_data),
+            self.on_analysis_done
         )
-        
+
+    def on_analysis_done(self, results):
         # Display Stats
         stats = self.analyzer.get_summary_stats()
         self.log_message(f"Total: {stats.get('total')}, A: {stats.get('count_a')}, C: {stats.get('count_c')}", "success")
@@ -519,34 +672,13 @@ class FileReaderInterface:
         if results:
             self.export_btn.config(state="normal", bg="#4CAF50", cursor="hand2")
         
-        # Mostrar tablas
-        punch_results = [r for r in results if r['origen'] == 'Punch']
-        laser_results = [r for r in results if r['origen'] == 'Laser']
-        
-        self.punch_results_listbox.delete(0, tk.END)
-        self.display_results_table(punch_results, self.punch_results_listbox)
-        
-        self.laser_results_listbox.delete(0, tk.END)
-        self.display_results_table(laser_results, self.laser_results_listbox)
-
-    def display_results_table(self, results, listbox):
-        """Muestra los resultados en formato de tabla en el listbox dado"""
-        if not results:
-            listbox.insert(tk.END, "No resultados.")
-            return
-
-        headers = ["Part #", "Qte", "StkInt", "StkExt", "Clasif"]
-        # Formato simple para UI
-        listbox.insert(tk.END, " | ".join(headers))
-        listbox.insert(tk.END, "-" * 50)
-        
-        for r in results:
-            line = f"{r['part_number']} | {r['qte_a_produire']} | {int(r['stopa_quantity'])} | {int(r['external_quantity'])} | {r['clasificacion']}"
-            listbox.insert(tk.END, line)
+        # Mostrar tablas (paginadas)
+        self.punch_results_table.set_results([r for r in results if r['origen'] == 'Punch'])
+        self.laser_results_table.set_results([r for r in results if r['origen'] == 'Laser'])
 
     def export_results(self):
         """Exporta los resultados a un archivo Excel"""
-        if not self.analyzer.last_results:
+        if not self.analyzer.last_results or not self.check_idle():
             return
             
         file_path = filedialog.asksaveasfilename(
@@ -557,35 +689,18 @@ class FileReaderInterface:
         )
         
         if file_path:
-            try:
-                # Reconstruir dataframe para exportar (lógica similar a la original pero simplificada)
-                export_data = []
-                for res in self.analyzer.last_results:
-                    row = res.get('full_row', {}).copy()
-                    row.update({
-                        'Origen': res.get('origen'),
-                        'Part #': res.get('part_number'),
-                        'Qté à Produire': res.get('qte_a_produire'),
-                        'Stock Interno': res.get('stopa_quantity'),
-                        'Stock Externo': res.get('external_quantity'),
-                        'Análisis': res.get('clasificacion'),
-                        'Razón': res.get('razon')
-                    })
-                    export_data.append(row)
-                
-                df_export = pd.DataFrame(export_data)
-                
-                # Columnas prioritarias
-                cols = df_export.columns.tolist()
-                key_cols = ['Origen', 'Part #', 'Qté à Produire', 'Análisis', 'Razón', 'Stock Interno', 'Stock Externo']
-                key_cols = [c for c in key_cols if c in cols]
-                other_cols = [c for c in cols if c not in key_cols]
-                df_export = df_export[key_cols + other_cols]
-                
-                df_export.to_excel(file_path, index=False)
-                self.log_message(f"Exportado a {file_path}", "success")
-            except Exception as e:
-                self.log_message(f"Error exportando: {e}", "error")
+            results = self.analyzer.last_results
+
+            def export():
+                try:
+                    # Libro write-only generado fila a fila: columnas prioritarias y luego las del PDF
+                    headers = exports.detailed_headers(results)
+                    exports.write_xlsx(file_path, 'Resultados', headers, exports.iter_detailed_rows(results, headers))
+                    self.log_message(f"Exportado a {file_path}", "success")
+                except Exception as e:
+                    self.log_message(f"Error exportando: {e}", "error")
+
+            self.run_task(export)
 
     def enable_laser_input(self):
         self.laser_browse_btn.config(state="normal", bg="#4CAF50", cursor="hand2")
@@ -0,0 +1,399 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Segundos máximos entre escrituras del progreso de un trabajo en el almacén compartido
+JOB_SYNC_INTERVAL = 0.5
+
+# Identificador del proceso que ejecuta los trabajos (para detectar workers terminados)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueueFull(Exception):
+    """No se admite el trabajo: cola llena o límite de trabajos simultáneos del usuario alcanzado."""
+
+
+class Job:
+    """
+    Trabajo en segundo plano de un usuario.
+    Guarda estado, progreso por etapas y los mensajes de log (log_callback del analizador).
+    """
+
+    def __init__(self, user, total_steps=1, max_messages=500):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.status = 'queued'  # queued -> running -> done | error
+        self.total_steps = max(total_steps, 1)
+        self.step_count = 0
+        self._in_step = False
+        self.stage = 'En cola'
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Mensajes numerados para que el cliente pida solo los nuevos (?since=n)
+        self.messages = deque(maxlen=max_messages)
+        self.message_count = 0
+        self._lock = threading.Lock()
+        # Almacén compartido (SQLiteJobStore) en el que se publica el progreso, si lo hay
+        self.store = None
+        self.synced_seq = 0
+        self._synced_at = 0.0
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def progress(self):
+        if self.status == 'done':
+            return 1.0
+        return min(self.step_count / self.total_steps, 1.0)
+
+    def log(self, message, msg_type="info"):
+        """Compatible con log_callback de StockAnalyzer."""
+        with self._lock:
+            self.message_count += 1
+            self.messages.append({
+                'seq': self.message_count,
+                'time': time.strftime("%H:%M:%S"),
+                'type': msg_type,
+                'message': message
+            })
+        self.sync()
+
+    def step(self, stage):
+        """Marca el inicio de una nueva etapa del trabajo."""
+        with self._lock:
+            # Cada nueva etapa da por terminada la anterior
+            if self._in_step:
+                self.step_count = min(self.step_count + 1, self.total_steps)
+            self._in_step = True
+            self.stage = stage
+        self.sync(force=True)
+
+    def sync(self, force=False):
+        """Publica estado y mensajes nuevos en el almacén compartido (como mucho cada JOB_SYNC_INTERVAL)."""
+        if self.store is None or (not force and time.monotonic() - self._synced_at < JOB_SYNC_INTERVAL):
+            return
+        self._synced_at = time.monotonic()
+        self.store.update(self)
+
+    def new_messages(self):
+        """Mensajes aún no publicados en el almacén."""
+        with self._lock:
+            return [m for m in self.messages if m['seq'] > self.synced_seq]
+
+    def to_dict(self, since=0):
+        with self._lock:
+            messages = [m for m in self.messages if m['seq'] > since]
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'messages': messages,
+            'last_seq': self.message_count
+        }
+
+
+def _json_default(value):
+    # Escalares NumPy en las estadísticas del resultado
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class SQLiteJobStore:
+    """
+    Trabajos en una base SQLite compartida por todos los workers (misma base que SQLiteStateStore):
+    estado, progreso y mensajes de cada trabajo, de modo que /jobs/<id> responde desde cualquier
+    worker y los límites de JobManager (por usuario y de cola) son globales.
+    Un trabajo activo cuyo worker (mismo host) ya no existe se marca como 'error'.
+    """
+
+    JOB_FIELDS = ('id', 'user', 'status', 'stage', 'total_steps', 'step_count', 'error', 'result',
+                  'created_at', 'started_at', 'finished_at', 'message_count', 'worker')
+
+    def __init__(self, path, max_messages=500):
+        self.path = path
+        self.max_messages = max_messages
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    total_steps INTEGER NOT NULL,
+                    step_count INTEGER NOT NULL,
+                    error TEXT,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    message_count INTEGER NOT NULL,
+                    worker TEXT NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, created_at)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS job_messages (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    time TEXT,
+                    type TEXT,
+                    message TEXT,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        """Transacción exclusiva (submit: comprobar límites e insertar sin carreras entre workers)."""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def reap(self, db):
+        """Marca como 'error' los trabajos activos de workers de este host que ya terminaron."""
+        host = WORKER_ID.rsplit(':', 1)[0]
+        for job_id, worker in db.execute("SELECT id, worker FROM jobs WHERE status IN ('queued', 'running')").fetchall():
+            worker_host, _, pid = worker.rpartition(':')
+            if worker_host != host or _process_alive(int(pid)):
+                continue
+            db.execute(
+                "UPDATE jobs SET status = 'error', error = ?, finished_at = ? WHERE id = ?",
+                ("El worker que ejecutaba el trabajo terminó.", time.time(), job_id)
+            )
+
+    def active_counts(self, db, user):
+        """(trabajos activos del usuario, trabajos en cola) en todos los workers."""
+        self.reap(db)
+        return db.execute(
+            "SELECT COALESCE(SUM(user = ?), 0), COALESCE(SUM(status = 'queued'), 0) "
+            "FROM jobs WHERE status IN ('queued', 'running')", (user,)
+        ).fetchone()
+
+    def insert(self, db, job):
+        db.execute(
+            f"INSERT INTO jobs ({', '.join(self.JOB_FIELDS)}) VALUES ({', '.join('?' * len(self.JOB_FIELDS))})",
+            self._row(job)
+        )
+
+    def prune(self, db, keep_finished):
+        """Conserva solo los keep_finished trabajos terminados más recientes."""
+        old = [row[0] for row in db.execute(
+            "SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+            (keep_finished,)
+        )]
+        for job_id in old:
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            db.execute("DELETE FROM job_messages WHERE job_id = ?", (job_id,))
+
+    def _row(self, job):
+        values = {field: getattr(job, field) for field in self.JOB_FIELDS if field not in ('result', 'worker')}
+        values['result'] = json.dumps(job.result, default=_json_default) if job.result is not None else None
+        values['worker'] = WORKER_ID
+        return tuple(values[field] for field in self.JOB_FIELDS)
+
+    def update(self, job):
+        """Publica el estado del trabajo y sus mensajes nuevos."""
+        messages = job.new_messages()
+        row = self._row(job)
+        with self.transaction() as db:
+            db.execute(
+                f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in self.JOB_FIELDS[1:])} WHERE id = ?",
+                row[1:] + (row[0],)
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO job_messages (job_id, seq, time, type, message) VALUES (?, ?, ?, ?, ?)",
+                [(job.id, m['seq'], m['time'], m['type'], m['message']) for m in messages]
+            )
+            if messages:
+                db.execute("DELETE FROM job_messages WHERE job_id = ? AND seq <= ?",
+                           (job.id, messages[-1]['seq'] - self.max_messages))
+        if messages:
+            job.synced_seq = messages[-1]['seq']
+
+    def load(self, job_id=None, user=None):
+        """Trabajo por id, o el último del usuario; como Job de solo lectura (None si no existe)."""
+        with self._connect() as db:
+            self.reap(db)
+            if job_id is not None:
+                row = db.execute(f"SELECT {', '.join(self.JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            else:
+                row = db.execute(
+                    f"SELECT {', '.join(self.JOB_FIELDS)} FROM jobs WHERE user = ? ORDER BY created_at DESC LIMIT 1",
+                    (user,)
+                ).fetchone()
+            if row is None:
+                return None
+            messages = db.execute(
+                "SELECT seq, time, type, message FROM job_messages WHERE job_id = ? ORDER BY seq", (row[0],)
+            ).fetchall()
+
+        values = dict(zip(self.JOB_FIELDS, row))
+        job = Job(values['user'], values['total_steps'], max_messages=self.max_messages)
+        for field in ('id', 'status', 'stage', 'step_count', 'error', 'created_at', 'started_at', 'finished_at', 'message_count'):
+            setattr(job, field, values[field])
+        job.result = json.loads(values['result']) if values['result'] is not None else None
+        job.messages.extend({'seq': seq, 'time': t, 'type': msg_type, 'message': message}
+                            for seq, t, msg_type, message in messages)
+        return job
+
+    def has_active(self, user):
+        with self._connect() as db:
+            return self.active_counts(db, user)[0] > 0
+
+    def status_counts(self):
+        with self._connect() as db:
+            self.reap(db)
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobManager:
+    """
+    Ejecuta trabajos en un pool de hilos local.
+    :param max_workers: Trabajos ejecutándose a la vez.
+    :param max_queued: Trabajos en espera admitidos (cola acotada); al superarlo submit() lanza JobQueueFull.
+    :param per_user_limit: Trabajos activos (en cola o ejecutándose) por usuario.
+    :param keep_finished: Trabajos terminados que se conservan para consultar su estado.
+    :param store: SQLiteJobStore compartido entre workers; sin él, los trabajos y los límites son del proceso.
+    """
+
+    def __init__(self, max_workers=2, max_queued=16, per_user_limit=1, keep_finished=100, store=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.per_user_limit = per_user_limit
+        self.keep_finished = keep_finished
+        self.store = store
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+
+    def submit(self, user, fn, *args, total_steps=1, **kwargs):
+        """
+        Encola fn(job, *args, **kwargs) y devuelve el Job de inmediato.
+        El valor devuelto por fn queda en job.result; una excepción deja el trabajo en 'error'.
+        """
+        with self._lock:
+            if self.store is not None:
+                job = self._submit_shared(user, total_steps)
+            else:
+                active = [job for job in self.jobs.values() if job.active]
+                self._check_limits(sum(1 for job in active if job.user == user),
+                                   sum(1 for job in active if job.status == 'queued'))
+                job = Job(user, total_steps)
+            self.jobs[job.id] = job
+            self._prune()
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _submit_shared(self, user, total_steps):
+        with self.store.transaction() as db:
+            self._check_limits(*self.store.active_counts(db, user))
+            job = Job(user, total_steps, max_messages=self.store.max_messages)
+            job.store = self.store
+            self.store.insert(db, job)
+            self.store.prune(db, self.keep_finished)
+        return job
+
+    def _check_limits(self, user_active, queued):
+        if user_active >= self.per_user_limit:
+            raise JobQueueFull("Ya hay un análisis en curso para este usuario.")
+        if queued >= self.max_queued:
+            raise JobQueueFull("Demasiados análisis en cola, intente más tarde.")
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        job.stage = 'Iniciando'
+        job.sync(force=True)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+            job.stage = 'Completado'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'error'
+            job.log(f"Error crítico: {str(e)}", "error")
+        finally:
+            job.finished_at = time.time()
+            job.sync(force=True)
+
+    def _prune(self):
+        finished = sorted((job for job in self.jobs.values() if not job.active), key=lambda job: job.created_at)
+        for job in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id, user=None):
+        """Devuelve el trabajo (solo si pertenece a user, cuando se indica) o None."""
+        job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            # Trabajo de otro worker
+            job = self.store.load(job_id)
+        if job is None or (user is not None and job.user != user):
+            return None
+        return job
+
+    def latest(self, user):
+        """Último trabajo enviado por el usuario, o None."""
+        if self.store is not None:
+            job = self.store.load(user=user)
+            return self.jobs.get(job.id, job) if job is not None else None
+        jobs = [job for job in self.jobs.values() if job.user == user]
+        return max(jobs, key=lambda job: job.created_at) if jobs else None
+
+    def has_active(self, user):
+        if self.store is not None:
+            return self.store.has_active(user)
+        return any(job.active and job.user == user for job in list(self.jobs.values()))
+
+    def status_counts(self):
+        """Trabajos por estado (de todos los workers si hay almacén compartido)."""
+        if self.store is not None:
+            return self.store.status_counts()
+        counts = {}
+        for job in list(self.jobs.values()):
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
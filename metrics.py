@@ -0,0 +1,108 @@
+import threading
+
+# Límites (segundos) de los histogramas de duración
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Registro mínimo de métricas en formato de texto de Prometheus (sin dependencias).
+    Contadores e histogramas se actualizan con inc()/observe(); los gauges se calculan
+    al exportar mediante funciones registradas con gauge().
+    """
+
+    def __init__(self, prefix='xnrgy_'):
+        self.prefix = prefix
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def _declare(self, name, metric_type, help_text):
+        name = self.prefix + name
+        self._types.setdefault(name, metric_type)
+        if help_text:
+            self._help.setdefault(name, help_text)
+        return name
+
+    def inc(self, name, value=1, help_text='', **labels):
+        name = self._declare(name, 'counter', help_text)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, help_text='', buckets=DEFAULT_BUCKETS, **labels):
+        name = self._declare(name, 'histogram', help_text)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def gauge(self, name, fn, help_text='', metric_type='gauge'):
+        """
+        Registra un valor calculado al exportar (gauge, o counter si la fuente ya es acumulativa).
+        fn() devuelve un número, o un dict {(('etiqueta', 'valor'), ...): número} para series con etiquetas.
+        """
+        name = self._declare(name, metric_type, help_text)
+        self._gauges[name] = fn
+
+    def render(self):
+        """Texto de exposición de Prometheus (text/plain; version=0.0.4)."""
+        samples = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (name, labels), hist in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(hist['buckets'], hist['counts']):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(float(bound))),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+
+        for name, fn in list(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            series = value.items() if isinstance(value, dict) else [((), value)]
+            samples[name] = [f"{name}{_format_labels(labels)} {_format_value(v)}" for labels, v in series]
+
+        out = []
+        for name in sorted(samples):
+            if name in self._help:
+                out.append(f"# HELP {name} {self._help[name]}")
+            out.append(f"# TYPE {name} {self._types[name]}")
+            out.extend(samples[name])
+        return '\n'.join(out) + '\n'
+
+    def observe_stage(self, stage, wall, cpu, rows=None):
+        """stage_callback de StockAnalyzer: duración, CPU y filas por etapa."""
+        self.observe('stage_duration_seconds', wall, 'Duración (tiempo real) de cada etapa del análisis.', stage=stage)
+        self.inc('stage_cpu_seconds_total', cpu, 'Tiempo de CPU acumulado por etapa.', stage=stage)
+        if rows:
+            self.inc('stage_rows_total', rows, 'Filas procesadas por etapa.', stage=stage)
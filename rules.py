@@ -0,0 +1,145 @@
+import json
+
+# Part numbers con clasificación manual forzada (regla rule_special_parts)
+SPECIAL_PARTS = ['10089', '10093', '10098', '10016']
+
+# Tipos de regla:
+#   'part': lista de part numbers con clasificación fija; no consumen stock.
+#   'external_low': sin stock interno y stock externo entre min y max (y suficiente) -> consume externo.
+RULE_TYPES = ('part', 'external_low')
+
+# Clasificaciones que puede asignar una regla (ver stock_analyzer.CLASSIFICATIONS)
+RULE_CLASSIFICATIONS = ('A', 'C', 'M', 'S', 'BO')
+
+# Reglas de negocio por defecto, en orden de prioridad (si un part number está en dos reglas gana la primera)
+DEFAULT_RULE_DEFINITIONS = [
+    {
+        'name': 'rule_10034',
+        'type': 'part',
+        'label': "Regla Part # 10034 (Clasificación 'S')",
+        'parts': ['10034'],
+        'classification': 'S',
+        'reason': 'Part # especial {part_number}'
+    },
+    {
+        'name': 'rule_special_parts',
+        'type': 'part',
+        'label': f"Regla Partes Especiales ({', '.join(SPECIAL_PARTS)} -> 'M')",
+        'parts': SPECIAL_PARTS,
+        'classification': 'M',
+        'reason': 'Part # especial {part_number}'
+    },
+    {
+        'name': 'rule_external_low',
+        'type': 'external_low',
+        'label': "Regla Stock Externo Bajo (1-2 unidades -> 'M')",
+        'min': 1,
+        'max': 2,
+        'classification': 'M',
+        'reason': 'Stock externo bajo ({external_quantity})'
+    }
+]
+
+
+class Rule:
+    """Regla de negocio declarada (una entrada de DEFAULT_RULE_DEFINITIONS o del archivo de reglas)."""
+
+    def __init__(self, name, type, classification, reason, label=None, enabled=True, parts=(), min=None, max=None):
+        if type not in RULE_TYPES:
+            raise ValueError(f"Regla {name}: tipo desconocido {type!r} (use uno de {RULE_TYPES})")
+        if classification not in RULE_CLASSIFICATIONS:
+            raise ValueError(f"Regla {name}: clasificación desconocida {classification!r}")
+        self.name = name
+        self.type = type
+        self.classification = classification
+        self.reason = reason
+        self.label = label or name
+        self.enabled = bool(enabled)
+        self.parts = [str(part).strip() for part in parts]
+        self.min = min
+        self.max = max
+        if type == 'part' and not self.parts:
+            raise ValueError(f"Regla {name}: 'parts' no puede estar vacío")
+        if type == 'external_low' and (min is None or max is None or min > max):
+            raise ValueError(f"Regla {name}: 'min' y 'max' son obligatorios (min <= max)")
+
+    def matches(self, stopa_qty, external_qty, qte_a_produire):
+        """Condición de la regla de stock externo bajo para un item."""
+        return stopa_qty <= 0 and self.min <= external_qty <= self.max and external_qty >= qte_a_produire
+
+
+class RuleSet:
+    """
+    Conjunto de reglas declaradas. Se compila al inicio de cada análisis (compile) con las reglas
+    activas de esa ejecución.
+    """
+
+    def __init__(self, definitions=None):
+        self.rules = []
+        # Una lista vacía (p. ej. RULES_FILE sin reglas) es un conjunto vacío, no las reglas por defecto
+        for definition in DEFAULT_RULE_DEFINITIONS if definitions is None else definitions:
+            try:
+                self.rules.append(Rule(**definition))
+            except TypeError as e:
+                raise ValueError(f"Definición de regla inválida {definition!r}: {str(e)}")
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Hay reglas con el mismo nombre")
+        if sum(1 for rule in self.rules if rule.type == 'external_low') > 1:
+            raise ValueError("Solo se admite una regla de tipo 'external_low'")
+
+    @classmethod
+    def from_file(cls, path):
+        """Reglas desde un JSON: lista de definiciones o {"rules": [...]} (mismas claves que DEFAULT_RULE_DEFINITIONS)."""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('rules', [])
+        return cls(data)
+
+    def defaults(self):
+        """Diccionario {regla: activa por defecto}."""
+        return {rule.name: rule.enabled for rule in self.rules}
+
+    def compile(self, enabled_rules=None):
+        """
+        Reglas de una ejecución.
+        :param enabled_rules: Diccionario {regla: activa}; las reglas que no aparecen usan su valor por defecto.
+        """
+        enabled_rules = enabled_rules or {}
+        enabled = {rule.name: bool(enabled_rules.get(rule.name, rule.enabled)) for rule in self.rules}
+        parts = {}
+        external_low = None
+        for rule in self.rules:
+            if not enabled[rule.name]:
+                continue
+            if rule.type == 'part':
+                for part in rule.parts:
+                    # La razón se formatea una vez por part number, no por item
+                    parts.setdefault(part, (rule.name, rule.classification, rule.reason.format(part_number=part)))
+            else:
+                external_low = rule
+        return CompiledRules(parts, external_low, enabled)
+
+
+class CompiledRules:
+    """
+    Reglas activas de una ejecución, listas para clasificar:
+    - parts: diccionario part number -> (regla, clasificación, razón); una búsqueda por item sin
+      importar cuántas piezas especiales haya.
+    - external_low: regla de stock externo bajo (o None si está desactivada).
+    - hits: items clasificados por cada regla activa en la ejecución.
+    """
+
+    def __init__(self, parts, external_low, enabled):
+        self.parts = parts
+        self.external_low = external_low
+        self.enabled = enabled
+        self.hits = {name: 0 for name, active in enabled.items() if active}
+
+    def match_part(self, part_number):
+        """(regla, clasificación, razón) de la regla por pieza que aplica, o None."""
+        return self.parts.get(part_number)
+
+    def external_low_reason(self, external_qty):
+        return self.external_low.reason.format(external_quantity=external_qty)
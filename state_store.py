@@ -0,0 +1,436 @@
+import atexit
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from stock_analyzer import STATE_INVENTORY_COLUMNS
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo bloqueo entre hilos del mismo proceso
+    fcntl = None
+
+
+class StateLocked(Exception):
+    """Otro hilo o proceso tiene el estado del usuario bloqueado (p. ej. un análisis en curso)."""
+
+
+class MemoryStateStore:
+    """
+    Estado de los analizadores en memoria del proceso (un solo worker).
+    Registra el último acceso de cada usuario y, con un presupuesto de memoria o un tiempo de
+    inactividad, saca de memoria las sesiones inactivas o usadas hace más tiempo (LRU). Una sesión
+    desalojada se vuelca a una base SQLite compacta (spill_path) y se restaura en el siguiente get().
+    :param factory: Función sin argumentos que crea un StockAnalyzer nuevo.
+    :param max_bytes: Memoria total estimada para los analizadores (None = sin límite).
+    :param idle_seconds: Inactividad tras la cual una sesión sale de memoria (None = nunca).
+    :param spill_path: Base SQLite para las sesiones desalojadas (por defecto, un directorio temporal
+        propio que close() borra; se llama también al salir del proceso).
+    """
+
+    def __init__(self, factory, max_bytes=None, idle_seconds=None, spill_path=None):
+        self.factory = factory
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_path = spill_path
+        self.analyzers = {}
+        # Último acceso (time.monotonic) y memoria estimada de cada analizador en memoria
+        self.last_access = {}
+        self.sizes = {}
+        self.evictions = 0
+        self._spill = None
+        self._spill_dir = None
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def __len__(self):
+        spilled = len(self._spill) if self._spill is not None else 0
+        return len(self.analyzers) + spilled
+
+    def __contains__(self, user):
+        return user in self.analyzers or (self._spill is not None and user in self._spill)
+
+    def _spill_store(self):
+        if self._spill is None:
+            path = self.spill_path
+            if path is None:
+                # La base y sus archivos (-wal, -shm, locks) van en un directorio que close() elimina
+                self._spill_dir = tempfile.mkdtemp(prefix='xnrgy_spill_')
+                path = os.path.join(self._spill_dir, 'spill.db')
+                atexit.register(self.close)
+            self._spill = SQLiteStateStore(self.factory, path)
+        return self._spill
+
+    def close(self):
+        """Descarta las sesiones desalojadas y borra la base temporal del spill (no toca spill_path)."""
+        self._spill = None
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def get(self, user):
+        """Analizador del usuario: el de memoria, el desalojado al spill o uno nuevo si no tiene estado."""
+        # Comprobar, restaurar y publicar bajo el lock del store: dos get() simultáneos de una sesión
+        # desalojada devuelven el mismo analizador restaurado (y nunca uno vacío)
+        with self._guard:
+            analyzer = self.analyzers.get(user)
+            restored = analyzer is None and self._spill is not None and user in self._spill
+            if analyzer is None:
+                analyzer = self.analyzers[user] = self._spill.get(user) if restored else self.factory()
+                self.sizes[user] = analyzer.memory_usage()
+        if restored:
+            # La fila del spill se borra solo cuando el analizador restaurado ya está en memoria
+            self._spill.discard(user)
+        self._touch(user)
+        return analyzer
+
+    def save(self, user, analyzer):
+        """Publica el estado del analizador tras modificarlo (debe llamarse con lock(user))."""
+        self.analyzers[user] = analyzer
+        self.sizes[user] = analyzer.memory_usage()
+        self._touch(user)
+
+    def discard(self, user):
+        """Elimina el estado del usuario (espera a que termine un análisis en curso, ver lock)."""
+        with self.lock(user):
+            self._forget(user)
+            if self._spill is not None:
+                self._spill.discard(user)
+
+    def _forget(self, user):
+        self.analyzers.pop(user, None)
+        self.last_access.pop(user, None)
+        self.sizes.pop(user, None)
+
+    def memory_bytes(self):
+        return sum(list(self.sizes.values()))
+
+    def _touch(self, user):
+        self.last_access[user] = time.monotonic()
+        self.evict(keep=user)
+
+    def evict(self, keep=None):
+        """
+        Desaloja las sesiones inactivas más de idle_seconds y, si la memoria estimada supera
+        max_bytes, las usadas hace más tiempo. Las sesiones bloqueadas (análisis en curso) y keep
+        no se tocan. Devuelve los usuarios desalojados.
+        """
+        if self.max_bytes is None and self.idle_seconds is None:
+            return []
+        now = time.monotonic()
+        total = self.memory_bytes()
+        evicted = []
+        for user, last_access in sorted(list(self.last_access.items()), key=lambda entry: entry[1]):
+            idle = self.idle_seconds is not None and now - last_access > self.idle_seconds
+            over = self.max_bytes is not None and total > self.max_bytes
+            if not (idle or over):
+                break
+            if user == keep:
+                continue
+            size = self.sizes.get(user, 0)
+            if self._evict_user(user):
+                total -= size
+                evicted.append(user)
+        return evicted
+
+    def _evict_user(self, user):
+        thread_lock = self._thread_lock(user)
+        if not thread_lock.acquire(blocking=False):
+            return False
+        try:
+            analyzer = self.analyzers.get(user)
+            if analyzer is not None:
+                self._spill_store().save(user, analyzer)
+                # El spill solo guarda; no conserva su propia copia en memoria
+                self._spill._forget(user)
+            self._forget(user)
+            self.evictions += 1
+            return True
+        finally:
+            thread_lock.release()
+
+    def _thread_lock(self, user):
+        with self._guard:
+            return self._locks.setdefault(user, threading.Lock())
+
+    @contextmanager
+    def lock(self, user, timeout=None):
+        """
+        Bloqueo exclusivo del estado del usuario mientras se lee, modifica y guarda.
+        :param timeout: Segundos de espera (None = esperar siempre); al agotarse lanza StateLocked.
+        """
+        thread_lock = self._thread_lock(user)
+        if not thread_lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise StateLocked(user)
+        try:
+            yield
+        finally:
+            thread_lock.release()
+
+
+def _json_default(value):
+    # Escalares NumPy (cantidades, códigos) y cualquier otro tipo raro del Excel
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def _pack_json(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, default=_json_default).encode('utf-8'))
+
+
+def _unpack_json(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def _pack_inventory(frame):
+    """Columnas fijas del inventario de trabajo (todas las de STATE_INVENTORY_COLUMNS salvo las cantidades)."""
+    fixed = [c for c in STATE_INVENTORY_COLUMNS if c in frame.columns and c not in ('stopaQuantity', 'externalQuantity')]
+    return _pack_json({c: frame[c].astype(object).tolist() for c in fixed})
+
+
+def _pack_arrays(*arrays):
+    buffer = io.BytesIO()
+    for array in arrays:
+        np.save(buffer, np.asarray(array), allow_pickle=False)
+    return zlib.compress(buffer.getvalue())
+
+
+def _unpack_arrays(blob, count):
+    buffer = io.BytesIO(zlib.decompress(blob))
+    return [np.load(buffer, allow_pickle=False) for _ in range(count)]
+
+
+def _pack_ledger(runs):
+    # run_ids en un encabezado JSON y los deltas de cada ejecución como arreglos NumPy
+    run_ids = _pack_json([run_id for run_id, _ in runs])
+    arrays = _pack_arrays(*(array for _, deltas in runs for column in ('stopa', 'external') for array in deltas[column]))
+    return len(run_ids).to_bytes(4, 'big') + run_ids + arrays
+
+
+def _unpack_ledger(blob):
+    if not blob:
+        return []
+    size = int.from_bytes(blob[:4], 'big')
+    run_ids = _unpack_json(blob[4:4 + size])
+    arrays = _unpack_arrays(blob[4 + size:], 4 * len(run_ids))
+    return [
+        (run_id, {'stopa': (arrays[4 * i], arrays[4 * i + 1]), 'external': (arrays[4 * i + 2], arrays[4 * i + 3])})
+        for i, run_id in enumerate(run_ids)
+    ]
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """
+    Estado de los analizadores en una base SQLite compartida por todos los workers.
+    Por usuario se guarda: columnas fijas del inventario de trabajo (solo cuando cambia el
+    inventario), cantidades stopa/externa y consumos por ejecución como arreglos NumPy, últimos
+    resultados en columnas, historial y run_id; todo comprimido.
+    Cada proceso conserva los analizadores ya cargados y solo vuelve a leer la base cuando otro
+    worker guardó una versión más nueva; desalojar una sesión (max_bytes / idle_seconds) solo
+    descarta esa copia local. lock() combina un lock de hilo con flock() sobre un archivo por
+    usuario, de modo que bloquea también entre procesos.
+    """
+
+    def __init__(self, factory, path=None, max_bytes=None, idle_seconds=None):
+        super().__init__(factory, max_bytes, idle_seconds)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'xnrgy_state', 'state.db')
+        self.lock_dir = os.path.join(os.path.dirname(os.path.abspath(self.path)), 'locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        # user -> (versión, versión del inventario, DataFrame de inventario guardado)
+        self._versions = {}
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS analyzer_state (
+                    user TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    inventory_version INTEGER NOT NULL,
+                    inventory BLOB,
+                    quantities BLOB,
+                    ledger BLOB,
+                    results BLOB,
+                    history BLOB,
+                    run_id TEXT,
+                    updated_at REAL
+                )
+            """)
+            # Bases creadas antes de que existiera el ledger
+            columns = [row[1] for row in db.execute("PRAGMA table_info(analyzer_state)")]
+            if 'ledger' not in columns:
+                db.execute("ALTER TABLE analyzer_state ADD COLUMN ledger BLOB")
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM analyzer_state").fetchone()[0]
+
+    def __contains__(self, user):
+        with self._connect() as db:
+            return db.execute("SELECT 1 FROM analyzer_state WHERE user = ?", (user,)).fetchone() is not None
+
+    @contextmanager
+    def _connect(self):
+        # Conexión corta por operación (autocommit); save() abre su propia transacción
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get(self, user):
+        with self._connect() as db:
+            row = db.execute("SELECT version, inventory_version FROM analyzer_state WHERE user = ?", (user,)).fetchone()
+            if row is None:
+                if user in self._versions:
+                    # Otro worker eliminó el estado (logout)
+                    self._forget(user)
+                return super().get(user)
+
+            version, inventory_version = row
+            local = self._versions.get(user)
+            if user in self.analyzers and local and local[0] == version:
+                self._touch(user)
+                return self.analyzers[user]
+
+            # Las columnas fijas del inventario solo se leen si cambiaron desde la última carga
+            reuse_inventory = local is not None and local[1] == inventory_version and local[2] is not None
+            quantities, ledger, results, history, run_id, inventory = db.execute(
+                f"SELECT quantities, ledger, results, history, run_id, {'NULL' if reuse_inventory else 'inventory'} "
+                "FROM analyzer_state WHERE user = ?", (user,)
+            ).fetchone()
+
+        frame = None
+        if quantities is not None:
+            if reuse_inventory:
+                base = local[2]
+            else:
+                base = pd.DataFrame(_unpack_json(inventory))
+            stopa, external = _unpack_arrays(quantities, 2)
+            frame = base.copy()
+            frame['stopaQuantity'] = stopa
+            frame['externalQuantity'] = external
+
+        # Analizador nuevo: el que está en memoria puede estar en uso por un análisis de otro hilo
+        # (get() no exige lock(user)) y no se modifica
+        analyzer = self.factory()
+        analyzer.set_state({
+            'inventory': frame,
+            'ledger': _unpack_ledger(ledger),
+            'results': _unpack_json(results),
+            'history': _unpack_json(history),
+            'run_id': run_id
+        })
+        with self._guard:
+            current = self._versions.get(user)
+            if user in self.analyzers and current and current[0] >= version:
+                # Otro hilo ya cargó esta versión (o una más nueva) mientras tanto
+                analyzer = self.analyzers[user]
+            else:
+                self.analyzers[user] = analyzer
+                self._versions[user] = (version, inventory_version, frame)
+                self.sizes[user] = analyzer.memory_usage()
+        self._touch(user)
+        return analyzer
+
+    def save(self, user, analyzer):
+        state = analyzer.get_state()
+        frame = state['inventory']
+        local = self._versions.get(user)
+        # El mismo DataFrame de trabajo que se cargó/guardó: solo cambian las cantidades
+        inventory_changed = frame is not None and (local is None or local[2] is not frame)
+
+        inventory = quantities = None
+        if frame is not None:
+            quantities = _pack_arrays(frame['stopaQuantity'].to_numpy(), frame['externalQuantity'].to_numpy())
+            if inventory_changed:
+                inventory = _pack_inventory(frame)
+        ledger = _pack_ledger(state['ledger'])
+        results = _pack_json(state['results'])
+        history = _pack_json(state['history'])
+
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT version, inventory_version FROM analyzer_state WHERE user = ?", (user,)).fetchone()
+                version, inventory_version = (row[0] + 1, row[1]) if row else (1, 0)
+                if inventory_changed or frame is None or row is None:
+                    inventory_version += 1
+                    if frame is not None and inventory is None:
+                        # Fila eliminada por otro worker (logout) con el mismo inventario local:
+                        # sin las columnas fijas la fila sería ilegible para los demás
+                        inventory = _pack_inventory(frame)
+                    db.execute(
+                        "INSERT OR REPLACE INTO analyzer_state "
+                        "(user, version, inventory_version, inventory, quantities, ledger, results, history, run_id, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (user, version, inventory_version, inventory, quantities, ledger, results, history, state['run_id'], time.time())
+                    )
+                else:
+                    db.execute(
+                        "UPDATE analyzer_state SET version = ?, quantities = ?, ledger = ?, results = ?, history = ?, "
+                        "run_id = ?, updated_at = ? WHERE user = ?",
+                        (version, quantities, ledger, results, history, state['run_id'], time.time(), user)
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+        self._versions[user] = (version, inventory_version, frame)
+        super().save(user, analyzer)
+
+    def discard(self, user):
+        # Con el lock del usuario: un análisis en curso guarda antes y su estado no reaparece después
+        with self.lock(user):
+            with self._connect() as db:
+                db.execute("DELETE FROM analyzer_state WHERE user = ?", (user,))
+            self._forget(user)
+
+    def _forget(self, user):
+        super()._forget(user)
+        self._versions.pop(user, None)
+
+    def _evict_user(self, user):
+        # El estado ya está en la base: basta con soltar la copia local
+        thread_lock = self._thread_lock(user)
+        if not thread_lock.acquire(blocking=False):
+            return False
+        try:
+            self._forget(user)
+            self.evictions += 1
+            return True
+        finally:
+            thread_lock.release()
+
+    @contextmanager
+    def lock(self, user, timeout=None):
+        with super().lock(user, timeout):
+            if fcntl is None:
+                yield
+                return
+            name = hashlib.sha256(user.encode('utf-8')).hexdigest()[:32]
+            with open(os.path.join(self.lock_dir, f"{name}.lock"), 'w') as f:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while True:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | (fcntl.LOCK_NB if deadline is not None else 0))
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            raise StateLocked(user)
+                        time.sleep(0.05)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,77 +1,1090 @@
+import io
+import itertools
+import numpy as np
+import os
 import pandas as pd
 import pdfplumber
 import re
+import sys
+import time
+import uuid
+from PyPDF2 import PdfReader, __version__ as PYPDF2_VERSION
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from rules import RuleSet, CompiledRules
+
+# Modos de análisis: 'sequential' es la implementación de referencia item por item,
+# 'batch' clasifica todos los items a la vez con operaciones vectorizadas.
+ANALYSIS_MODES = ('sequential', 'batch')
+
+# Versión del parser de tablas PDF; forma parte de la clave de PdfTableCache.
+# Incrementar cuando cambie la forma en que se extraen las tablas.
+PDF_PARSER_VERSION = f"3-pdfplumber-{pdfplumber.__version__}-pypdf2-{PYPDF2_VERSION}"
+
+# Estrategias de extracción de tablas PDF: 'auto' intenta primero la capa de texto (PyPDF2) con el
+# layout conocido de los reportes y vuelve a extract_table si no encaja; 'table' usa siempre extract_table.
+PDF_STRATEGIES = ('auto', 'table')
+
+# Ruta rápida: fragmentos de texto cuya altura difiere menos que esto (en puntos) forman la misma fila
+TEXT_ROW_TOLERANCE = 2.0
+
+# Versión del formato de snapshot del inventario; forma parte de la clave de InventorySnapshotCache.
+INVENTORY_SNAPSHOT_VERSION = f"1-pandas-{pd.__version__}"
+
+# Extracción de tablas PDF: por debajo de este número de páginas no compensa levantar procesos
+PARALLEL_PDF_MIN_PAGES = 20
+
+# Pipeline en streaming: máximo de filas de tabla que se acumulan antes de clasificarlas
+PIPELINE_CHUNK_ROWS = 500
+# Pipeline en streaming con extract_table en paralelo: rangos de páginas por proceso (los rangos
+# cortos mantienen acotadas las páginas extraídas pendientes de clasificar)
+PIPELINE_RANGES_PER_WORKER = 4
+
+# Niveles de los tipos de mensaje de StockAnalyzer.log; los mensajes por debajo de log_level se descartan sin formatear
+LOG_LEVELS = {'debug': 10, 'info': 20, 'process': 20, 'success': 20, 'warning': 30, 'error': 40}
+
+# Logs dentro de un análisis: mensajes acumulados antes de entregarlos al callback y part numbers de ejemplo
+# por aviso repetido
+LOG_BATCH_SIZE = 200
+LOG_SAMPLE_SIZE = 10
+# Segundos máximos que un mensaje acumulado espera antes de entregarse (progreso de los jobs)
+LOG_FLUSH_INTERVAL = 0.5
+
+# Avisos repetidos que se agregan por ejecución: clave -> (mensaje de una aparición, mensaje agregado)
+REPEATED_MESSAGES = {
+    'missing_part': (
+        "Item {sample} no encontrado en inventario.",
+        "{count} items no encontrados en inventario ({distinct} part numbers distintos): {samples}"
+    )
+}
+
+# Columnas del inventario de trabajo que conserva el estado persistido (ver StockAnalyzer.get_state)
+STATE_INVENTORY_COLUMNS = ('partNumber', 'partNumber_normalized', 'materialName', 'gauge', 'stopaQuantity', 'externalQuantity')
+
+# Reglas de negocio por defecto (ver rules.py)
+DEFAULT_RULE_SET = RuleSet()
+
+
+def classify_stock(stopa_qty, external_qty, qte_a_produire, rules=None):
+    """
+    Regla de stock externo bajo + lógica estándar (A / C / BO).
+    :param rules: CompiledRules de la ejecución (regla de stock externo bajo y contadores); None = sin reglas.
+    Devuelve (clasificacion, razon, columna_a_consumir) donde la columna es 'stopa', 'external' o None.
+    """
+    # Regla de stock externo bajo (pero no BO absoluto, ese es standard):
+    # stopa <= 0 and (min <= ext <= max) and ext >= qte -> consume stock externo aunque sea manual.
+    low = rules.external_low if rules is not None else None
+    if low is not None and low.matches(stopa_qty, external_qty, qte_a_produire):
+        rules.hits[low.name] += 1
+        return low.classification, rules.external_low_reason(external_qty), 'external'
+
+    # Lógica Estándar (Fallback si no se aplicó regla o no cumplió condición)
+    if stopa_qty <= 0 and external_qty <= 0:
+        return 'BO', 'Sin stock disponible (BO)', None
+    elif stopa_qty > 0 and stopa_qty >= qte_a_produire:
+        return 'A', 'Stock interno suficiente', 'stopa'
+    elif stopa_qty == 0 and external_qty >= qte_a_produire:
+        return 'C', 'Stock externo suficiente', 'external'
+    return 'BO', 'Stock insuficiente', None
+
+
+def _extract_tables(pages):
+    """Concatena las filas de la tabla de cada página, en orden."""
+    rows = []
+    for page in pages:
+        table = page.extract_table()
+        if table:
+            rows.extend(table)
+    return rows
+
+
+def _extract_page_range(file_path, start, stop):
+    """Extrae las tablas de las páginas [start, stop). Se ejecuta en un proceso del pool (ruta o bytes)."""
+    with pdfplumber.open(_open_source(file_path)) as pdf:
+        return _extract_tables(pdf.pages[start:stop])
+
+
+def _iter_tables_serial(file_path, start=0):
+    """Tabla de cada página desde start, en orden, liberando cada página tras extraerla."""
+    with pdfplumber.open(_open_source(file_path)) as pdf:
+        for page in pdf.pages[start:]:
+            table = page.extract_table()
+            page.close()
+            yield table
+
+
+def _text_fragments(page):
+    """Fragmentos de texto (y, x, texto) de una página PyPDF2, en coordenadas de página."""
+    fragments = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        text = text.strip()
+        if text:
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+            fragments.append((y, x, text))
+
+    page.extract_text(visitor_text=visit)
+    return fragments
+
+
+def _group_lines(fragments, tolerance=TEXT_ROW_TOLERANCE):
+    """Agrupa los fragmentos en líneas (de arriba abajo), cada una ordenada de izquierda a derecha."""
+    lines = []
+    line_y = None
+    for y, x, text in sorted(fragments, key=lambda f: (-f[0], f[1])):
+        if line_y is None or line_y - y > tolerance:
+            lines.append([])
+            line_y = y
+        lines[-1].append((x, text))
+    for line in lines:
+        line.sort()
+    return lines
+
+
+class TextLayoutParser:
+    """
+    Ruta rápida de extracción: reconstruye las filas de la tabla a partir de la capa de texto,
+    usando la posición x de cada columna del encabezado como ancla.
+    Solo acepta el layout conocido de los reportes Punch/Laser: una línea por fila, encabezado con
+    columnas 'Part' y 'Qté/Qte ... Produire', un fragmento por celda alineado con su columna y,
+    en cada fila de datos, part number y cantidad numérica.
+    parse_page devuelve None si la página no encaja; el llamador vuelve entonces a extract_table.
+    """
+
+    def __init__(self, tolerance=TEXT_ROW_TOLERANCE):
+        self.tolerance = tolerance
+        self.headers = None
+        self.anchors = None
+        self.part_col = None
+        self.qte_col = None
+
+    def parse_page(self, page):
+        """Filas de la página en el formato de extract_table (la primera del documento es el encabezado)."""
+        lines = _group_lines(_text_fragments(page), self.tolerance)
+        rows = []
+        if self.headers is None:
+            if not lines:
+                return rows
+            # Lo que aparece antes del encabezado (títulos del reporte) queda fuera de la tabla
+            for pos, line in enumerate(lines):
+                if self._set_headers(line):
+                    rows.append(self.headers)
+                    lines = lines[pos + 1:]
+                    break
+            else:
+                return None
+
+        for line in lines:
+            row = self._split_line(line)
+            if row is None:
+                return None
+            # Encabezado repetido en páginas siguientes: extract_table también lo devuelve como fila
+            if row != self.headers and (not row[self.part_col] or _parse_quantity(row[self.qte_col]) is None):
+                return None
+            rows.append(row)
+        return rows
+
+    def _set_headers(self, line):
+        # Mismas reglas de columnas que StockAnalyzer._items_from_frame (si varias coinciden gana la última)
+        part_col = qte_col = None
+        for pos, (x, text) in enumerate(line):
+            if 'Part' in text:
+                part_col = pos
+            if ('Qté' in text or 'Qte' in text) and 'Produire' in text:
+                qte_col = pos
+        if part_col is None or qte_col is None or part_col == qte_col:
+            return False
+        self.headers = [text for x, text in line]
+        self.anchors = [x for x, text in line]
+        self.part_col = part_col
+        self.qte_col = qte_col
+        return True
+
+    def _split_line(self, line):
+        """
+        Reparte los fragmentos de una línea entre las columnas. Cada fragmento debe empezar en el ancla
+        de una columna (± tolerance) y cada celda recibe como mucho uno; si no, devuelve None.
+        """
+        row = [''] * len(self.anchors)
+        col = 0
+        for x, text in line:
+            while col < len(self.anchors) and x > self.anchors[col] + self.tolerance:
+                col += 1
+            if col == len(self.anchors) or x < self.anchors[col] - self.tolerance or row[col]:
+                # Texto fuera de las columnas (pie de página, celdas partidas o desplazadas...):
+                # extract_table no lo repartiría igual
+                return None
+            row[col] = text
+        return row
+
+
+def _extract_text_rows(source):
+    """
+    Filas de todas las páginas por la ruta rápida (mismo formato que _extract_tables) o None si
+    alguna página no encaja en el layout conocido o el documento no tiene filas de datos.
+    """
+    parser = TextLayoutParser()
+    rows = []
+    for page in PdfReader(_open_source(source)).pages:
+        page_rows = parser.parse_page(page)
+        if page_rows is None:
+            return None
+        rows.extend(page_rows)
+    return rows if len(rows) > 1 else None
+
+
+def _open_source(source):
+    """
+    Entrada para pdfplumber / pandas: las rutas se usan tal cual, los bytes se envuelven en un
+    BytesIO y los archivos binarios se rebobinan (se leen más de una vez: hash de caché y parser).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, 'read'):
+        source.seek(0)
+    return source
+
+
+def _source_label(source, name=None):
+    """Nombre del archivo para logs e historial ('file_path' de los datos cargados)."""
+    if name:
+        return name
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    label = getattr(source, 'name', None)
+    return label if isinstance(label, str) else '<memoria>'
+
+
+def _frame_from_columns(headers, columns):
+    """Reconstruye el DataFrame de una tabla guardada por columnas (admite encabezados repetidos o vacíos)."""
+    df = pd.DataFrame({i: column for i, column in enumerate(columns)})
+    df.columns = headers
+    return df
+
+
+def _clean_column(series):
+    """Texto limpio de una columna: str().strip() por celda, cadena vacía para valores nulos."""
+    return series.where(series.notna(), '').astype(str).str.strip()
+
+
+def _parse_quantity(value):
+    """Cantidad entera de una celda ('3', '3.0'...) o None si no es numérica."""
+    try:
+        return int(float(value))
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+# Clasificaciones posibles; AnalysisResult guarda el índice en esta tupla
+CLASSIFICATIONS = (None, 'A', 'C', 'M', 'S', 'BO')
+_CLASSIFICATION_CODES = {label: code for code, label in enumerate(CLASSIFICATIONS)}
+
+
+class AnalysisResult:
+    """
+    Resultado compacto de un item analizado (registro con __slots__).
+    Se usa como el dict original: result['part_number'], result.get('deficit_internal'), o por
+    atributo desde las plantillas. La clasificación se guarda como código entero y full_row se
+    resuelve bajo demanda desde la tabla del PDF de origen en lugar de copiar la fila.
+    """
+
+    FIELDS = (
+        'origen', 'part_number', 'qte_a_produire', 'materiel', 'epaisseur',
+        'encontrado_en_inventario', 'stopa_quantity', 'external_quantity',
+        'clasificacion', 'razon', 'full_row', 'deficit_internal'
+    )
+    __slots__ = (
+        'origen', 'part_number', 'qte_a_produire', 'materiel', 'epaisseur',
+        'encontrado_en_inventario', 'stopa_quantity', 'external_quantity',
+        'razon', 'deficit_internal', 'code', '_table', '_row'
+    )
+
+    def __init__(self, origen, part_number, qte_a_produire, materiel='', epaisseur='', table=None, row=None):
+        """
+        :param table: DataFrame del PDF de origen y row la posición de la fila en él;
+                      si table es None, row es directamente el dict full_row (o None).
+        """
+        self.origen = origen
+        self.part_number = part_number
+        self.qte_a_produire = qte_a_produire
+        self.materiel = materiel
+        self.epaisseur = epaisseur
+        self.encontrado_en_inventario = False
+        self.stopa_quantity = 0
+        self.external_quantity = 0
+        self.code = 0
+        self.razon = ''
+        # None equivale a la clave ausente en el dict original
+        self.deficit_internal = None
+        self._table = table
+        self._row = row
+
+    @classmethod
+    def from_item(cls, item, source, part_number):
+        """Crea el resultado (aún sin clasificar) de un item de extract_pdf_items."""
+        if 'source_table' in item:
+            table, row = item['source_table'], item['source_row']
+        else:
+            table, row = None, item.get('full_row', {})
+        return cls(source, part_number, item['qte_a_produire'], item.get('materiel', ''), item.get('epaisseur', ''), table, row)
+
+    @property
+    def clasificacion(self):
+        return CLASSIFICATIONS[self.code]
+
+    @clasificacion.setter
+    def clasificacion(self, label):
+        self.code = _CLASSIFICATION_CODES[label]
+
+    @property
+    def source_table(self):
+        """DataFrame del PDF de origen (None si el resultado trae full_row como dict)."""
+        return self._table
+
+    @property
+    def full_row(self):
+        if self._table is None:
+            return self._row if self._row is not None else {}
+        return self._table.iloc[self._row].to_dict()
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS or (key == 'deficit_internal' and self.deficit_internal is None):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS or key == 'full_row':
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        if self.deficit_internal is None:
+            return self.FIELDS[:-1]
+        return self.FIELDS
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    # Campos que se persisten (full_row no: depende de la tabla del PDF de origen)
+    STATE_FIELDS = (
+        'origen', 'part_number', 'qte_a_produire', 'materiel', 'epaisseur',
+        'encontrado_en_inventario', 'stopa_quantity', 'external_quantity',
+        'code', 'razon', 'deficit_internal'
+    )
+
+    @classmethod
+    def to_columns(cls, results):
+        """Resultados (registros o dicts) a un dict de columnas {campo: lista}, sin full_row."""
+        columns = {field: [] for field in cls.STATE_FIELDS}
+        for r in results:
+            for field in cls.STATE_FIELDS:
+                if field == 'code':
+                    value = r.code if isinstance(r, AnalysisResult) else _CLASSIFICATION_CODES.get(r.get('clasificacion'), 0)
+                else:
+                    value = r.get(field)
+                columns[field].append(value)
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Inverso de to_columns(); los resultados reconstruidos tienen full_row vacío."""
+        results = []
+        for values in zip(*(columns[field] for field in cls.STATE_FIELDS)):
+            res = cls(*values[:5])
+            (res.encontrado_en_inventario, res.stopa_quantity, res.external_quantity,
+             res.code, res.razon, res.deficit_internal) = values[5:]
+            results.append(res)
+        return results
+
+    def __repr__(self):
+        return f"AnalysisResult({self.origen!r}, {self.part_number!r}, {self.clasificacion!r})"
+
+
+class StageTimer:
+    """
+    Mide una etapa (tiempo real y CPU del hilo) y la registra en el analizador al salir del bloque.
+    Dentro del bloque se puede asignar timer.rows con el número de filas procesadas.
+    """
+
+    def __init__(self, analyzer, name):
+        self.analyzer = analyzer
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.analyzer._record_stage(self.name, time.perf_counter() - self._wall, time.thread_time() - self._cpu, self.rows)
+        return False
+
+
+class StageClock:
+    """
+    Etapa que avanza por tramos intercalados con otras (pipeline en streaming): cada
+    with clock: ... suma un tramo y record() la registra una vez, igual que StageTimer.
+    """
+
+    def __init__(self, analyzer, name):
+        self.analyzer = analyzer
+        self.name = name
+        self.rows = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall += time.perf_counter() - self._wall
+        self.cpu += time.thread_time() - self._cpu
+        return False
+
+    def record(self):
+        self.analyzer._record_stage(self.name, self.wall, self.cpu, self.rows)
+
+
+class RunLog:
+    """
+    Salida de logs de un StockAnalyzer.
+    - Umbral de nivel (LOG_LEVELS): lo que queda por debajo no se formatea ni se entrega.
+    - Formateo diferido: log(mensaje, tipo, *args) aplica mensaje % args solo si el mensaje pasa el umbral.
+    - Dentro de batch() los mensajes se acumulan y se entregan en bloques (al llenar LOG_BATCH_SIZE,
+      pasado LOG_FLUSH_INTERVAL, al terminar cada etapa medida y al cerrar el bloque); los avisos repetidos (REPEATED_MESSAGES)
+      se cuentan y se emiten como una sola línea con ejemplos al cerrar el bloque exterior.
+    """
+
+    def __init__(self, deliver, level='info', batch_size=LOG_BATCH_SIZE, sample_size=LOG_SAMPLE_SIZE):
+        # deliver(lista de (mensaje, tipo)) entrega un bloque al destino final
+        self.deliver = deliver
+        self.level = level
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.pending = []
+        self.last_flush = time.monotonic()
+        # clave -> [tipo, total, part numbers distintos (en orden de aparición)]
+        self.repeated = {}
+        self.depth = 0
+
+    def enabled(self, msg_type):
+        return LOG_LEVELS.get(msg_type, LOG_LEVELS['info']) >= LOG_LEVELS.get(self.level, LOG_LEVELS['info'])
+
+    def emit(self, message, msg_type="info", args=()):
+        if not self.enabled(msg_type):
+            return
+        if args:
+            message = message % args
+        if not self.depth:
+            self.deliver([(message, msg_type)])
+            return
+        self.pending.append((message, msg_type))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= LOG_FLUSH_INTERVAL:
+            self.flush()
+
+    def repeat(self, key, samples, msg_type="warning"):
+        """Cuenta apariciones de un aviso repetido (samples: valores de ejemplo, uno por aparición)."""
+        if not self.enabled(msg_type):
+            return
+        if not self.depth:
+            for sample in samples:
+                self.emit(REPEATED_MESSAGES[key][0].format(sample=sample), msg_type)
+            return
+        entry = self.repeated.get(key)
+        if entry is None:
+            entry = self.repeated[key] = [msg_type, 0, {}]
+        for sample in samples:
+            entry[1] += 1
+            entry[2][sample] = None
+
+    def flush(self):
+        """Entrega los mensajes acumulados (los avisos repetidos siguen contándose hasta cerrar el bloque)."""
+        self.last_flush = time.monotonic()
+        if self.pending:
+            pending, self.pending = self.pending, []
+            self.deliver(pending)
+
+    def _flush_repeated(self):
+        for key, (msg_type, count, distinct) in self.repeated.items():
+            single, aggregated = REPEATED_MESSAGES[key]
+            if count == 1:
+                self.pending.append((single.format(sample=next(iter(distinct))), msg_type))
+                continue
+            samples = list(itertools.islice(distinct, self.sample_size))
+            listed = ", ".join(map(str, samples)) + (", ..." if len(distinct) > len(samples) else "")
+            self.pending.append((aggregated.format(count=count, distinct=len(distinct), samples=listed), msg_type))
+        self.repeated = {}
+
+    @contextmanager
+    def batch(self):
+        """Bloque de logs (p. ej. una ejecución); los bloques anidados se cierran con el exterior."""
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self._flush_repeated()
+                self.flush()
+
+
+def _plain_value(value):
+    """Valor de celda como tipo nativo de Python ('' si está vacío), para respuestas JSON."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _part_sort_key(item):
+    """Orden por Part Number de menor a mayor (numérico si se puede, luego texto)."""
+    pn = item['part_number']
+    # Intentar separar prefijo/sufijo si es comun, pero lo mas robusto para "menor a mayor"
+    # en numeros es convertir a float. Si falla, usar string.
+    # Para evitar error de comparacion float vs str, devolvemos tupla (tipo, valor)
+    try:
+        val = float(pn)
+        return (0, val)
+    except ValueError:
+        return (1, pn)
+
+
+class ResultSummary:
+    """
+    Estadísticas de un análisis acumuladas resultado a resultado: contadores por clasificación
+    y agregación por Part Number (demanda total y por origen, posiciones de los resultados).
+    El resumen de inventario ordenado se calcula una vez y se guarda.
+    """
+
+    def __init__(self, results=()):
+        self.total = 0
+        self.counts = [0] * len(CLASSIFICATIONS)
+        self.parts = {}
+        self._inventory_summary = None
+        for res in results:
+            self.add(res)
+
+    def add(self, res):
+        # Posición del resultado en la lista del análisis
+        row = self.total
+        self.total += 1
+        if isinstance(res, AnalysisResult):
+            self.counts[res.code] += 1
+        else:
+            self.counts[_CLASSIFICATION_CODES.get(res.get('clasificacion'), 0)] += 1
+
+        pn = res['part_number']
+        if not pn:
+            return
+        entry = self.parts.get(pn)
+        if entry is None:
+            # Stock reportado en la primera aparición de la pieza en este análisis
+            # Nota: Esto asume que el stock reportado en el resultado es el stock DISPONIBLE en ese momento.
+            # Si analizamos secuencialmente, la primera vez que sale el item tiene el stock 'más alto' (antes de consumos de este batch).
+            entry = self.parts[pn] = {
+                'part_number': pn,
+                'materiel': res.get('materiel', ''),
+                'epaisseur': res.get('epaisseur', ''),
+                'total_required': 0,
+                'initial_stock': int(res.get('stopa_quantity', 0)) + int(res.get('external_quantity', 0)), # Tomamos el de la primera aparición como "Inicial del Batch"
+                'missing': 0,
+                'demand': {},
+                'rows': []
+            }
+        entry['total_required'] += res['qte_a_produire']
+        entry['demand'][res['origen']] = entry['demand'].get(res['origen'], 0) + res['qte_a_produire']
+        entry['rows'].append(row)
+        self._inventory_summary = None
+
+    def stats(self):
+        if not self.total:
+            return {}
+        return {
+            'total': self.total,
+            'count_a': self.counts[_CLASSIFICATION_CODES['A']],
+            'count_c': self.counts[_CLASSIFICATION_CODES['C']],
+            'count_none': self.counts[_CLASSIFICATION_CODES[None]],
+            # Calcular BO explícitamente como el resto o si tiene clasif BO
+            'count_bo': self.counts[_CLASSIFICATION_CODES['BO']]
+        }
+
+    def inventory_summary(self):
+        if self._inventory_summary is None:
+            summary_list = []
+            for data in self.parts.values():
+                data['missing'] = max(data['total_required'] - data['initial_stock'], 0)
+                summary_list.append(data)
+            summary_list.sort(key=_part_sort_key)
+            self._inventory_summary = summary_list
+        return self._inventory_summary
+
+
+class ConsumptionLedger:
+    """
+    Registro append-only de los consumos de stock del inventario de trabajo, agrupados por ejecución.
+    Cada ejecución guarda, por columna ('stopa' / 'external'), las posiciones de fila y las cantidades
+    descontadas; deshacerla es sumar de vuelta esos deltas en el índice, sin releer el Excel.
+    """
+
+    COLUMNS = ('stopa', 'external')
+
+    def __init__(self, runs=None):
+        # [(run_id, {'stopa': (posiciones, cantidades), 'external': (...)})], la última al final
+        self.runs = runs or []
+        self._pending = None
+
+    def _pending_column(self, column):
+        if self._pending is None:
+            # Por columna: bloques de consume_many y listas de consumos individuales
+            self._pending = {name: ([], [], [], []) for name in self.COLUMNS}
+        return self._pending[column]
+
+    def record(self, column, pos, qty):
+        pending = self._pending_column(column)
+        pending[2].append(pos)
+        pending[3].append(qty)
+
+    def record_many(self, column, positions, quantities):
+        pending = self._pending_column(column)
+        pending[0].append(np.asarray(positions))
+        pending[1].append(np.asarray(quantities))
+
+    def _take_pending(self):
+        deltas = {}
+        for column in self.COLUMNS:
+            blocks_pos, blocks_qty, single_pos, single_qty = self._pending[column] if self._pending else ([], [], [], [])
+            positions = np.concatenate(blocks_pos + [np.asarray(single_pos, dtype=np.int64)]).astype(np.int64)
+            quantities = np.concatenate(blocks_qty + [np.asarray(single_qty, dtype=np.float64)])
+            deltas[column] = (positions, quantities)
+        self._pending = None
+        return deltas
+
+    def commit(self, run_id):
+        """Cierra los consumos registrados desde el último commit como la ejecución run_id."""
+        self.runs.append((run_id, self._take_pending()))
+
+    def rollback(self, index):
+        """
+        Revierte sobre el índice los consumos registrados desde el último commit (ejecución
+        interrumpida); devuelve False si no había nada pendiente.
+        """
+        if self._pending is None:
+            return False
+        self.apply(index, self._take_pending(), inverse=True)
+        return True
+
+    def apply(self, index, deltas, inverse=False):
+        """Aplica (o revierte con inverse=True) los consumos de una ejecución sobre el índice."""
+        for column, (positions, quantities) in deltas.items():
+            if len(positions) == 0:
+                continue
+            target = index.stopa if column == 'stopa' else index.external
+            (np.add if inverse else np.subtract).at(target, positions, quantities.astype(target.dtype, copy=False))
+            index.dirty = True
+
+    def undo(self, index):
+        """Revierte la última ejecución sobre el índice y la quita del registro; devuelve su run_id."""
+        run_id, deltas = self.runs.pop()
+        self.apply(index, deltas, inverse=True)
+        return run_id
+
+
+class InventoryIndex:
+    """
+    Índice part number -> posición de fila sobre el inventario de trabajo.
+    Las cantidades (stopa / externa) se copian a arreglos NumPy compactos que se
+    consumen in-place; sync_frame() las vuelca de nuevo al DataFrame.
+    Con un ConsumptionLedger, cada consumo queda además registrado para poder deshacerlo.
+    """
+
+    def __init__(self, df_inventory, ledger=None):
+        self.frame = df_inventory
+        self.ledger = ledger
+        self.positions = {}
+        # Igual que el filtro original: la primera fila con ese part number gana
+        for pos, pn in enumerate(df_inventory['partNumber_normalized'].tolist()):
+            if pn not in self.positions:
+                self.positions[pn] = pos
+
+        self.stopa = df_inventory['stopaQuantity'].to_numpy(copy=True)
+        self.external = df_inventory['externalQuantity'].to_numpy(copy=True)
+        self.materials = df_inventory['materialName'].to_numpy() if 'materialName' in df_inventory.columns else None
+        self.gauges = df_inventory['gauge'].to_numpy() if 'gauge' in df_inventory.columns else None
+        self.dirty = False
+
+    def lookup(self, part_number):
+        """Devuelve la posición de la fila del part number o None."""
+        return self.positions.get(part_number)
+
+    def consume(self, pos, column, qty):
+        """Descuenta qty de la columna ('stopa' o 'external') en la posición dada."""
+        quantities = self.stopa if column == 'stopa' else self.external
+        quantities[pos] = quantities[pos] - qty
+        self.dirty = True
+        if self.ledger is not None:
+            self.ledger.record(column, pos, qty)
+
+    def consume_many(self, positions, column, quantities):
+        """Versión vectorizada de consume(); respeta el orden de las posiciones repetidas."""
+        if len(positions) == 0:
+            return
+        target = self.stopa if column == 'stopa' else self.external
+        np.subtract.at(target, positions, quantities)
+        self.dirty = True
+        if self.ledger is not None:
+            self.ledger.record_many(column, positions, quantities)
+
+    def sync_frame(self):
+        """Escribe las cantidades consumidas de vuelta en el DataFrame."""
+        if not self.dirty:
+            return
+        self.frame['stopaQuantity'] = self.stopa.copy()
+        self.frame['externalQuantity'] = self.external.copy()
+        self.dirty = False
+
+
+class _OverlayColumn:
+    """
+    Columna de cantidades de un escenario: el arreglo base (compartido, de solo lectura) más un
+    diccionario posición -> valor con las filas que el escenario ya consumió.
+    Admite los mismos accesos que los motores de análisis hacen sobre InventoryIndex.stopa / external.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.values = {}
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.values.get(int(key), self.base[key])
+        result = self.base[key]
+        if self.values:
+            positions = np.asarray(key)
+            for i in np.flatnonzero(np.isin(positions, list(self.values))):
+                result[i] = self.values[int(positions[i])]
+        return result
+
+    def subtract(self, pos, qty):
+        # Mismo tipo que tendría el valor escrito en el arreglo de InventoryIndex
+        self.values[pos] = self.base.dtype.type(self[pos] - qty)
+
+
+class InventoryOverlay:
+    """
+    Inventario de un escenario "qué pasaría si": lee del índice del inventario de trabajo sin
+    copiarlo y guarda solo las filas que consume (ver _OverlayColumn).
+    Mismo interfaz que InventoryIndex para los motores de análisis; nunca toca el DataFrame.
+    """
+
+    def __init__(self, index):
+        self.positions = index.positions
+        self.materials = index.materials
+        self.gauges = index.gauges
+        self.stopa = _OverlayColumn(_read_only(index.stopa))
+        self.external = _OverlayColumn(_read_only(index.external))
+        self.frame = None
+        self.ledger = None
+
+    def lookup(self, part_number):
+        return self.positions.get(part_number)
+
+    def consume(self, pos, column, qty):
+        (self.stopa if column == 'stopa' else self.external).subtract(int(pos), qty)
+
+    def consume_many(self, positions, column, quantities):
+        """Mismo orden que InventoryIndex.consume_many: los consumos de una fila se aplican en secuencia."""
+        target = self.stopa if column == 'stopa' else self.external
+        for pos, qty in zip(np.asarray(positions).tolist(), np.asarray(quantities).tolist()):
+            target.subtract(pos, qty)
+
+    def sync_frame(self):
+        """El escenario no escribe en el inventario de trabajo."""
+
+    def consumed(self):
+        """Cantidades descontadas por columna y filas tocadas por el escenario."""
+        totals = {}
+        rows = set()
+        for column, quantities in (('stopa', self.stopa), ('external', self.external)):
+            rows.update(quantities.values)
+            totals[column] = float(sum(quantities.base[pos] - value for pos, value in quantities.values.items()))
+        return totals, len(rows)
+
+
+def _read_only(array):
+    """Vista sin copia que no admite escritura."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
 
 class StockAnalyzer:
-    def __init__(self, log_callback=None):
+    def __init__(self, log_callback=None, pdf_cache=None, inventory_cache=None, stage_callback=None, log_level='info'):
         """
         Inicializa el analizador.
         :param log_callback: Función opcional para enviar logs (mensaje, tipo)
+        :param log_level: Nivel mínimo de los mensajes entregados a log_callback (ver LOG_LEVELS)
+        :param pdf_cache: PdfTableCache opcional (compartible entre analizadores) para no re-parsear PDFs repetidos
+        :param inventory_cache: InventorySnapshotCache opcional para no re-parsear el Excel de inventario
+        :param stage_callback: Función opcional llamada al terminar cada etapa (etapa, wall_s, cpu_s, filas)
         """
         self.log_callback = log_callback
+        self.stage_callback = stage_callback
+        # Etapas medidas desde el último análisis; se guardan en su entrada del historial
+        self.stage_timings = []
+        self.pdf_cache = pdf_cache
+        self.inventory_cache = inventory_cache
         self.punch_data = None
         self.laser_data = None
         self.inventory_data = None
         # Inventario de trabajo persistente
         self.df_inventory_working = None
+        # Índice O(1) por part number sobre df_inventory_working
+        self.inventory_index = None
+        # Consumos por ejecución sobre df_inventory_working (undo_last_run)
+        self.ledger = ConsumptionLedger()
         self.last_results = []
+        # Identificador de la ejecución que produjo last_results
+        self.run_id = None
+        # Resumen cacheado de last_results (se invalida con un nuevo análisis o reset)
+        self._summary = None
+        self._summary_results = None
         # Historial de análisis
         self.history = [] 
+        # Motor de clasificación por defecto (ver ANALYSIS_MODES)
+        self.analysis_mode = 'batch'
+        # Procesos para extraer tablas PDF (None = todos los núcleos, 1 = siempre en serie)
+        self.pdf_workers = None
+        # Estrategia de extracción de tablas PDF (ver PDF_STRATEGIES)
+        self.pdf_strategy = 'auto'
+        # Reglas de negocio declaradas (rules.RuleSet); se compilan al inicio de cada análisis
+        self.rules = DEFAULT_RULE_SET
+        # Logs con umbral de nivel, entrega por bloques y avisos repetidos agregados (log_level, RunLog)
+        self.logger = RunLog(self._deliver_logs, log_level)
+
+    @property
+    def log_level(self):
+        """Nivel mínimo de los mensajes que se entregan (ver LOG_LEVELS)."""
+        return self.logger.level
 
-    def log(self, message, msg_type="info"):
+    @log_level.setter
+    def log_level(self, level):
+        if level not in LOG_LEVELS:
+            raise ValueError(f"Nivel de log desconocido: {level}")
+        self.logger.level = level
+
+    def log(self, message, msg_type="info", *args):
+        """
+        Registra un mensaje. Con args, el mensaje se formatea (message % args) solo si supera log_level.
+        Dentro de un análisis los mensajes se entregan en bloques (ver RunLog).
+        """
+        self.logger.emit(message, msg_type, args)
+
+    def _deliver_logs(self, entries):
         if self.log_callback:
-            self.log_callback(message, msg_type)
+            for message, msg_type in entries:
+                self.log_callback(message, msg_type)
         else:
-            print(f"[{msg_type.upper()}] {message}")
+            print("\n".join(f"[{msg_type.upper()}] {message}" for message, msg_type in entries))
+
+    def stage(self, name):
+        """Context manager que mide una etapa: with self.stage('nombre') as timer: ..."""
+        return StageTimer(self, name)
+
+    def stage_clock(self, name):
+        """Etapa medida por tramos (ver StageClock); se registra con clock.record()."""
+        return StageClock(self, name)
+
+    def _record_stage(self, name, wall, cpu, rows=None):
+        self.stage_timings.append({
+            'stage': name,
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'rows': rows
+        })
+        if self.stage_callback:
+            self.stage_callback(name, wall, cpu, rows)
+        # Los mensajes acumulados de la etapa salen al terminarla (progreso visible durante el análisis)
+        self.logger.flush()
 
     def reset(self):
         """Reinicia todo el estado del analizador."""
+        self.stage_timings = []
         self.punch_data = None
         self.laser_data = None
         self.inventory_data = None
         self.df_inventory_working = None
+        self.inventory_index = None
+        self.ledger = ConsumptionLedger()
         self.last_results = []
+        self.run_id = None
+        self._summary = None
+        self._summary_results = None
         self.history = []
         self.log("Estado del analizador reiniciado.", "warning")
 
-    def load_pdf_data(self, file_path, source_name):
-        """Carga datos de un PDF usando pdfplumber."""
+    def load_pdf_data(self, file_path, source_name, workers=None, name=None):
+        """
+        Carga datos de un PDF: con pdf_strategy 'auto' prueba primero la capa de texto (PyPDF2) y,
+        si el documento no encaja en el layout conocido, usa extract_table de pdfplumber.
+        :param file_path: Ruta, bytes o archivo binario abierto (p. ej. un upload en memoria).
+        :param name: Nombre a registrar cuando file_path no es una ruta.
+        :param workers: Procesos para extraer las páginas en paralelo (por defecto self.pdf_workers).
+        Los documentos de menos de PARALLEL_PDF_MIN_PAGES páginas se procesan en serie.
+        """
+        with self.stage(f"load_pdf_data[{source_name}]") as timer:
+            pdf_data = self._load_pdf_data(file_path, source_name, workers, name)
+            timer.rows = len(pdf_data['dataframe']) if pdf_data else 0
+        return pdf_data
+
+    def _load_pdf_data(self, file_path, source_name, workers, name=None):
+        label = _source_label(file_path, name)
         try:
-            with pdfplumber.open(file_path) as pdf:
-                all_tables = []
-                for page in pdf.pages:
-                    table = page.extract_table()
-                    if table:
-                        all_tables.extend(table)
-                
-                if all_tables:
-                    headers = all_tables[0]
-                    df = pd.DataFrame(all_tables[1:], columns=headers)
-                    self.log(f"PDF {source_name} cargado: {len(df)} filas detectadas.", "success")
+            cache_key = None
+            if self.pdf_cache is not None:
+                cache_key = self._pdf_cache_key(file_path)
+                cached = self.pdf_cache.get(cache_key)
+                if cached:
+                    headers, columns = cached
+                    df = _frame_from_columns(headers, columns)
+                    self.log("PDF %s cargado desde caché: %d filas.", "success", source_name, len(df))
                     return {
-                        'file_path': file_path,
+                        'file_path': label,
                         'dataframe': df,
                         'headers': headers
                     }
-                else:
-                    raise Exception("No se encontraron tablas en el PDF")
+
+            all_tables = self._extract_text_rows(file_path, source_name) if self.pdf_strategy == 'auto' else None
+
+            if all_tables is None:
+                workers = workers or self.pdf_workers or os.cpu_count() or 1
+                with pdfplumber.open(_open_source(file_path)) as pdf:
+                    page_count = len(pdf.pages)
+                    if workers <= 1 or page_count < PARALLEL_PDF_MIN_PAGES:
+                        all_tables = _extract_tables(pdf.pages)
+
+                if all_tables is None:
+                    all_tables = self._extract_tables_parallel(file_path, page_count, workers, source_name)
+
+            if all_tables:
+                headers = all_tables[0]
+                df = pd.DataFrame(all_tables[1:], columns=headers)
+                self.log("PDF %s cargado: %d filas detectadas.", "success", source_name, len(df))
+                if cache_key:
+                    try:
+                        self.pdf_cache.put(cache_key, list(headers), [df.iloc[:, i].tolist() for i in range(df.shape[1])])
+                    except Exception as e:
+                        self.log("No se pudo guardar %s en caché: %s", "warning", source_name, e)
+                return {
+                    'file_path': label,
+                    'dataframe': df,
+                    'headers': headers
+                }
+            else:
+                raise Exception("No se encontraron tablas en el PDF")
+        except Exception as e:
+            self.log("Error cargando PDF %s: %s", "error", source_name, e)
+            return None
+
+    def _pdf_cache_key(self, file_path):
+        # La estrategia forma parte de la clave: 'auto' y 'table' pueden dar filas distintas
+        return self.pdf_cache.key(file_path, (PDF_PARSER_VERSION, self.pdf_strategy))
+
+    def _extract_text_rows(self, file_path, source_name):
+        """Ruta rápida (capa de texto); None si no aplica y hay que usar extract_table."""
+        try:
+            rows = _extract_text_rows(file_path)
         except Exception as e:
-            self.log(f"Error cargando PDF {source_name}: {str(e)}", "error")
+            self.log("Capa de texto de %s ilegible (%s), usando extract_table.", "warning", source_name, e)
             return None
+        if rows is None:
+            self.log("%s no coincide con el layout conocido, usando extract_table.", "info", source_name)
+        return rows
+
+    def _extract_tables_parallel(self, file_path, page_count, workers, source_name):
+        """Reparte las páginas en rangos contiguos entre procesos y une las tablas en orden de página."""
+        workers = min(workers, page_count)
+        chunk = -(-page_count // workers)
+        ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+        self.log("Extrayendo %d páginas de %s con %d procesos...", "process", page_count, source_name, len(ranges))
+        if not isinstance(file_path, (str, os.PathLike)):
+            # Los procesos reciben el contenido del archivo en memoria
+            file_path = _open_source(file_path).read()
+        try:
+            with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+                parts = pool.map(_extract_page_range, [file_path] * len(ranges),
+                                 [r[0] for r in ranges], [r[1] for r in ranges])
+                return [row for part in parts for row in part]
+        except Exception as e:
+            # Entornos sin soporte de procesos (p. ej. serverless): extracción en serie
+            self.log("Extracción paralela no disponible (%s), usando modo serie.", "warning", e)
+            with pdfplumber.open(_open_source(file_path)) as pdf:
+                return _extract_tables(pdf.pages)
+
+    def load_inventory_excel(self, file_path, name=None):
+        """
+        Carga el Excel de inventario (ruta, bytes o archivo binario abierto; name es el nombre a
+        registrar cuando no es una ruta).
+        Con inventory_cache, la primera carga guarda un snapshot columnar y las siguientes cargas
+        del mismo archivo (mismo contenido) lo leen en lugar de volver a parsear el Excel.
+        """
+        with self.stage("load_inventory_excel") as timer:
+            inventory_data = self._load_inventory_excel(file_path, name)
+            timer.rows = inventory_data['rows'] if inventory_data else 0
+        return inventory_data
 
-    def load_inventory_excel(self, file_path):
-        """Carga el Excel de inventario."""
+    def _load_inventory_excel(self, file_path, name=None):
+        label = _source_label(file_path, name)
         try:
-            df = pd.read_excel(file_path)
-            self.log(f"Excel Inventario cargado: {len(df)} filas.", "success")
+            cache_key = None
+            if self.inventory_cache is not None:
+                cache_key = self.inventory_cache.key(file_path, INVENTORY_SNAPSHOT_VERSION)
+                df = self.inventory_cache.get(cache_key)
+                if df is not None:
+                    self.log("Excel Inventario cargado desde snapshot: %d filas.", "success", len(df))
+                    return {
+                        'file_path': label,
+                        'dataframe': df,
+                        'rows': len(df)
+                    }
+
+            df = pd.read_excel(_open_source(file_path))
+            self.log("Excel Inventario cargado: %d filas.", "success", len(df))
+            if cache_key:
+                try:
+                    self.inventory_cache.put(cache_key, df)
+                except Exception as e:
+                    self.log("No se pudo guardar el snapshot del inventario: %s", "warning", e)
             return {
-                'file_path': file_path,
+                'file_path': label,
                 'dataframe': df,
                 'rows': len(df)
             }
         except Exception as e:
-            self.log(f"Error cargando Excel Inventario: {str(e)}", "error")
+            self.log("Error cargando Excel Inventario: %s", "error", e)
             return None
 
     def initialize_inventory(self, inventory_data):
@@ -93,10 +1106,30 @@ class StockAnalyzer:
         self.df_inventory_working['partNumber_normalized'] = self.df_inventory_working['partNumber'].astype(str).str.strip()
         self.df_inventory_working['stopaQuantity'] = pd.to_numeric(self.df_inventory_working['stopaQuantity'], errors='coerce').fillna(0)
         self.df_inventory_working['externalQuantity'] = pd.to_numeric(self.df_inventory_working['externalQuantity'], errors='coerce').fillna(0)
+        # Inventario nuevo: los consumos registrados corresponden al anterior
+        self.ledger = ConsumptionLedger()
+        self.inventory_index = InventoryIndex(self.df_inventory_working, self.ledger)
         
         self.log("Inventario de trabajo inicializado.", "info")
         return self.df_inventory_working
 
+    def _get_inventory_index(self, df_inventory):
+        """
+        Devuelve el índice asociado a df_inventory.
+        Si df_inventory es el inventario de trabajo se reutiliza (o reconstruye) el índice persistente;
+        para cualquier otro DataFrame se construye un índice temporal. Un InventoryOverlay (escenario)
+        se usa tal cual.
+        """
+        if isinstance(df_inventory, InventoryOverlay):
+            return df_inventory
+        if self.inventory_index is not None and self.inventory_index.frame is df_inventory:
+            return self.inventory_index
+        if df_inventory is self.df_inventory_working:
+            index = self.inventory_index = InventoryIndex(df_inventory, self.ledger)
+        else:
+            index = InventoryIndex(df_inventory)
+        return index
+
     def extract_pdf_items(self, pdf_data, source_name):
         """Extrae items del PDF."""
         items = []
@@ -105,150 +1138,132 @@ class StockAnalyzer:
 
         try:
             df = pdf_data['dataframe']
-            self.log(f"Extrayendo items de {source_name}...", "process")
-            
-            part_col = None
-            qte_col = None
-            
-            for col in df.columns:
-                if col and 'Part' in str(col):
-                    part_col = col
-                if col and ('Qté' in str(col) or 'Qte' in str(col)) and 'Produire' in str(col):
-                    qte_col = col
-            
-            if part_col and qte_col:
-                # Estrategia de Tablas
-                for idx, row in df.iterrows():
-                    part_num = str(row[part_col]).strip() if pd.notna(row[part_col]) else ""
-                    qte_str = str(row[qte_col]).strip() if pd.notna(row[qte_col]) else ""
-                    
-                    if not part_num or not qte_str:
-                        continue
-                    
-                    try:
-                        qte = int(float(qte_str))
-                        if qte > 0:
-                            # Extraer datos adicionales (Material, Espesor) si las columnas fueron detectadas
-                            materiel_val = ""
-                            epaisseur_val = ""
-                            
-                            # Buscar columnas dinámicamente si no se hizo arriba (o reusar logica)
-                            # Para simplicidad, busquemos en row.keys() que coincidan
-                            for key in row.keys():
-                                k_str = str(key).lower()
-                                if 'materiel' in k_str or 'material' in k_str:
-                                    materiel_val = str(row[key]).strip() if pd.notna(row[key]) else ""
-                                if 'epaisseur' in k_str or 'thickness' in k_str:
-                                    epaisseur_val = str(row[key]).strip() if pd.notna(row[key]) else ""
-
-                            items.append({
-                                'part_number': part_num,
-                                'qte_a_produire': qte,
-                                'materiel': materiel_val,
-                                'epaisseur': epaisseur_val,
-                                'source': source_name,
-                                'full_row': row.to_dict()
-                            })
-                    except (ValueError, TypeError):
-                        continue
-            
-            self.log(f"Total items extraídos de {source_name}: {len(items)}", "success")
+            self.log("Extrayendo items de %s...", "process", source_name)
+            items = self._items_from_frame(df, source_name)
+            self.log("Total items extraídos de %s: %d", "success", source_name, len(items))
 
         except Exception as e:
-            self.log(f"Error extrayendo items de {source_name}: {str(e)}", "error")
+            self.log("Error extrayendo items de %s: %s", "error", source_name, e)
         
         return items
 
-    def analyze_item(self, item, df_inventory, source, enabled_rules=None):
-        """Analiza un item individual contra el inventario."""
-        # Default rules if none provided (backward compatibility)
-        if enabled_rules is None:
-            enabled_rules = {
-                'rule_10034': True,
-                'rule_special_parts': True,
-                'rule_external_low': True
+    def _items_from_frame(self, df, source_name):
+        """
+        Convierte las filas de una tabla PDF en items (part number, cantidad, material, espesor).
+        Las columnas se resuelven una vez por documento y la limpieza/filtrado se hace por columnas.
+        """
+        part_col = None
+        qte_col = None
+        materiel_col = None
+        epaisseur_col = None
+
+        # Si varias columnas coinciden gana la última, como en la búsqueda fila por fila original
+        for pos, col in enumerate(df.columns):
+            if col and 'Part' in str(col):
+                part_col = pos
+            if col and ('Qté' in str(col) or 'Qte' in str(col)) and 'Produire' in str(col):
+                qte_col = pos
+            k_str = str(col).lower()
+            if 'materiel' in k_str or 'material' in k_str:
+                materiel_col = pos
+            if 'epaisseur' in k_str or 'thickness' in k_str:
+                epaisseur_col = pos
+
+        if part_col is None or qte_col is None or df.empty:
+            return []
+
+        # Estrategia de Tablas
+        part_nums = _clean_column(df.iloc[:, part_col])
+        qte_strs = _clean_column(df.iloc[:, qte_col])
+        # Pocas cantidades distintas: se convierten una vez cada una
+        qtes = qte_strs.map({value: _parse_quantity(value) for value in qte_strs.unique()})
+        parsed = qtes.notna()
+        keep = ((part_nums != '') & (qte_strs != '') & parsed & (qtes.where(parsed, 0) > 0)).to_numpy()
+        if not keep.any():
+            return []
+
+        rows = df[keep]
+        blank = [''] * len(rows)
+        # Los textos se repiten mucho entre filas: se internan para compartir una sola copia
+        materiels = list(map(sys.intern, _clean_column(rows.iloc[:, materiel_col]).tolist())) if materiel_col is not None else blank
+        epaisseurs = list(map(sys.intern, _clean_column(rows.iloc[:, epaisseur_col]).tolist())) if epaisseur_col is not None else blank
+
+        # full_row no se copia: cada item referencia la tabla y la posición de su fila
+        return [
+            {
+                'part_number': part_num,
+                'qte_a_produire': int(qte),
+                'materiel': materiel_val,
+                'epaisseur': epaisseur_val,
+                'source': source_name,
+                'source_table': df,
+                'source_row': row
             }
+            for part_num, qte, materiel_val, epaisseur_val, row in zip(
+                map(sys.intern, part_nums[keep].tolist()), qtes[keep].tolist(), materiels, epaisseurs, np.flatnonzero(keep).tolist()
+            )
+        ]
+
+    def compile_rules(self, enabled_rules=None):
+        """
+        Reglas de una ejecución: compila self.rules con el diccionario de reglas activas
+        (las reglas ya compiladas se devuelven tal cual, con sus contadores).
+        """
+        if isinstance(enabled_rules, CompiledRules):
+            return enabled_rules
+        return self.rules.compile(enabled_rules)
+
+    def analyze_item(self, item, df_inventory, source, enabled_rules=None):
+        """
+        Analiza un item individual contra el inventario.
+        :param df_inventory: DataFrame de inventario o InventoryOverlay de un escenario.
+        :param enabled_rules: Diccionario de reglas activas o CompiledRules de la ejecución.
+        """
+        rules = self.compile_rules(enabled_rules)
 
         part_number = str(item['part_number']).strip()
         qte_a_produire = item['qte_a_produire']
         
-        result = {
-            'origen': source,
-            'part_number': part_number,
-            'qte_a_produire': qte_a_produire,
-            'materiel': item.get('materiel', ''),
-            'epaisseur': item.get('epaisseur', ''),
-            'encontrado_en_inventario': False,
-            'stopa_quantity': 0,
-            'external_quantity': 0,
-            'clasificacion': None,
-            'razon': '',
-            'full_row': item.get('full_row', {})
-        }
+        result = AnalysisResult.from_item(item, source, part_number)
         
         try:
-            mask = df_inventory['partNumber_normalized'] == part_number
-            matches = df_inventory.loc[mask]
+            index = self._get_inventory_index(df_inventory)
+            pos = index.lookup(part_number)
             
-            if not matches.empty:
+            if pos is not None:
                 result['encontrado_en_inventario'] = True
-                idx = matches.index[0]
                 
-                stopa_qty = df_inventory.at[idx, 'stopaQuantity']
-                external_qty = df_inventory.at[idx, 'externalQuantity']
+                stopa_qty = index.stopa[pos]
+                external_qty = index.external[pos]
                 
                 # Extraer Material y Espesor del INVENTARIO (Excel)
-                if 'materialName' in df_inventory.columns:
-                     result['materiel'] = df_inventory.at[idx, 'materialName']
-                if 'gauge' in df_inventory.columns:
-                     result['epaisseur'] = df_inventory.at[idx, 'gauge']
+                if index.materials is not None:
+                     result['materiel'] = index.materials[pos]
+                if index.gauges is not None:
+                     result['epaisseur'] = index.gauges[pos]
 
                 result['stopa_quantity'] = stopa_qty
                 result['external_quantity'] = external_qty
                 
-                # Reglas de Negocio Opcionales
-                rule_applied = False
-                
-                # Regla 1: Part # 10034
-                if enabled_rules.get('rule_10034', True) and part_number == '10034':
-                    result['clasificacion'] = 'S'
-                    result['razon'] = 'Part # especial 10034'
-                    rule_applied = True
-                
-                # Regla 2: Special Parts
-                elif enabled_rules.get('rule_special_parts', True) and part_number in ['10089', '10093', '10098', '10016']:
-                    result['clasificacion'] = 'M'
-                    result['razon'] = f'Part # especial {part_number}'
-                    rule_applied = True
-                    
-                # Regla 3: Low External Stock (pero no BO absoluto, ese es standard)
-                # Esta regla es específica para cuando hay poco stock externo (1-2) y fuerza Manual?
-                # La lógica original era: stopa <= 0 and (1 <= ext <= 2) and ext >= qte -> M
-                elif enabled_rules.get('rule_external_low', True) and stopa_qty <= 0 and (1 <= external_qty <= 2) and external_qty >= qte_a_produire:
-                    result['clasificacion'] = 'M'
-                    result['razon'] = f'Stock externo bajo ({external_qty})'
-                    # Consumir stock aunque sea manual? La logica original lo hacía:
-                    df_inventory.at[idx, 'externalQuantity'] = external_qty - qte_a_produire
-                    rule_applied = True
-
-                # Lógica Estándar (Fallback si no se aplicó regla o no cumplió condición)
-                if not rule_applied:
-                    if stopa_qty <= 0 and external_qty <= 0:
-                        result['clasificacion'] = 'BO'
-                        result['razon'] = 'Sin stock disponible (BO)'
-                    elif stopa_qty > 0 and stopa_qty >= qte_a_produire:
-                        result['clasificacion'] = 'A'
-                        result['razon'] = f'Stock interno suficiente'
-                        df_inventory.at[idx, 'stopaQuantity'] = stopa_qty - qte_a_produire
-                    elif stopa_qty == 0 and external_qty >= qte_a_produire:
-                        result['clasificacion'] = 'C'
-                        result['razon'] = f'Stock externo suficiente'
-                        df_inventory.at[idx, 'externalQuantity'] = external_qty - qte_a_produire
-                    else:
-                        result['clasificacion'] = 'BO' 
-                        result['razon'] = f'Stock insuficiente'
+                # Reglas de Negocio por part number (clasificación fija, sin consumo)
+                part_rule = rules.match_part(part_number)
+                if part_rule is not None:
+                    rule_name, result['clasificacion'], result['razon'] = part_rule
+                    rules.hits[rule_name] += 1
+
+                # Regla de stock externo bajo y lógica estándar
+                else:
+                    clasificacion, razon, column = classify_stock(stopa_qty, external_qty, qte_a_produire, rules)
+                    result['clasificacion'] = clasificacion
+                    result['razon'] = razon
+                    if column:
+                        index.consume(pos, column, qte_a_produire)
+
+                # Un índice temporal (DataFrame ajeno) escribe directamente
+                if index is not self.inventory_index:
+                    index.sync_frame()
             else:
-                self.log(f"Item {part_number} no encontrado en inventario.", "warning")
+                self.logger.repeat('missing_part', (part_number,))
 
             # Calcular déficit para automático (A) si no es A
             if result['clasificacion'] in ['C', 'BO', None] and result['encontrado_en_inventario']:
@@ -259,128 +1274,735 @@ class StockAnalyzer:
                      result['deficit_internal'] = balance
 
         except Exception as e:
-            self.log(f"Error analizando item {part_number}: {str(e)}", "error")
+            self.log("Error analizando item %s: %s", "error", part_number, e)
             
         return result
 
-    def run_full_analysis(self, punch_data, laser_data, inventory_data=None, metadata=None, enabled_rules=None):
+    def _analyze_items_batch(self, sourced_items, enabled_rules=None, inventory=None, summary=None):
         """
-        Ejecuta el flujo completo de análisis.
-        Si inventory_data es None, intenta usar el existente.
-        :param metadata: Diccionario con info extra (project, model, module)
-        :param enabled_rules: Diccionario con reglas activas/inactivas.
+        Clasifica todos los items a la vez contra el inventario de trabajo.
+        :param sourced_items: lista de (source, items) en el orden de consumo (Punch, Laser).
+        :param inventory: InventoryOverlay de un escenario en lugar del inventario de trabajo.
+        :param summary: ResultSummary que se actualiza con cada resultado a medida que se genera.
+        Produce exactamente los mismos resultados y consumos que llamar analyze_item en secuencia:
+        las piezas sin contención se resuelven con la demanda acumulada por pieza y solo las piezas
+        cuyo stock se agota a mitad de lote se recorren item por item.
         """
+        rules = self.compile_rules(enabled_rules)
+        low_rule = rules.external_low
+
+        index = self._get_inventory_index(self.df_inventory_working if inventory is None else inventory)
+        items = [(source, item) for source, source_items in sourced_items for item in source_items]
+        n = len(items)
+        if n == 0:
+            return []
+
+        part_numbers = np.array([str(item['part_number']).strip() for _, item in items], dtype=object)
+        qte = np.array([item['qte_a_produire'] for _, item in items])
+        if qte.dtype.kind not in 'iu':
+            raise ValueError("Cantidades no enteras; use el modo secuencial.")
+
+        pos = pd.Series(part_numbers).map(index.positions)
+        found = pos.notna().to_numpy()
+        pos = pos.fillna(-1).to_numpy(dtype=np.int64)
+
+        clasif = np.full(n, None, dtype=object)
+        razon = np.full(n, '', dtype=object)
+        stopa_snap = np.zeros(n, dtype=index.stopa.dtype)
+        external_snap = np.zeros(n, dtype=index.external.dtype)
+        consume_col = np.full(n, None, dtype=object)
+
+        # Reglas por part number: nunca consumen, el stock visto es el inicial
+        is_part_rule = found & np.isin(part_numbers, list(rules.parts)) if rules.parts else np.zeros(n, dtype=bool)
+        sel = np.flatnonzero(is_part_rule)
+        for i in sel:
+            rule_name, clasif[i], razon[i] = rules.parts[part_numbers[i]]
+            rules.hits[rule_name] += 1
+        stopa_snap[sel] = index.stopa[pos[sel]]
+        external_snap[sel] = index.external[pos[sel]]
+
+        # Items que dependen del stock: demanda acumulada por pieza en orden de llegada
+        stock_idx = np.flatnonzero(found & ~is_part_rule)
+        if len(stock_idx):
+            p = pos[stock_idx]
+            q = qte[stock_idx]
+            grouped = pd.Series(q).groupby(p, sort=False)
+            before = grouped.cumsum().to_numpy() - q
+            total = grouped.transform('sum').to_numpy()
+            s0 = index.stopa[p]
+            e0 = index.external[p]
+            integral = (s0 == np.floor(s0)) & (e0 == np.floor(e0))
+
+            # Todo el lote cabe en stock interno -> A
+            all_a = integral & (s0 > 0) & (total <= s0)
+            # Sin stock alguno -> BO
+            no_stock = (s0 <= 0) & (e0 <= 0)
+            # Stock interno en cero y todo el lote cabe en externo -> C (o M por stock externo bajo)
+            all_ext = integral & (s0 == 0) & (total <= e0)
+            # Stock interno negativo con externo que nunca activa la regla de stock bajo -> BO
+            stuck = (s0 < 0) & (e0 > 0) & ((low_rule is None) or (e0 > low_rule.max))
+
+            sel = stock_idx[all_a]
+            clasif[sel] = 'A'
+            razon[sel] = 'Stock interno suficiente'
+            consume_col[sel] = 'stopa'
+            stopa_snap[sel] = s0[all_a] - before[all_a]
+            external_snap[sel] = e0[all_a]
+
+            sel = stock_idx[no_stock]
+            clasif[sel] = 'BO'
+            razon[sel] = 'Sin stock disponible (BO)'
+            stopa_snap[sel] = s0[no_stock]
+            external_snap[sel] = e0[no_stock]
+
+            sel = stock_idx[all_ext]
+            ext_before = e0[all_ext] - before[all_ext]
+            if low_rule is not None:
+                low = (ext_before >= low_rule.min) & (ext_before <= low_rule.max)
+                clasif[sel] = np.where(low, low_rule.classification, 'C')
+                rules.hits[low_rule.name] += int(low.sum())
+            else:
+                low = np.zeros(len(sel), dtype=bool)
+                clasif[sel] = 'C'
+            razon[sel] = 'Stock externo suficiente'
+            consume_col[sel] = 'external'
+            stopa_snap[sel] = s0[all_ext]
+            external_snap[sel] = ext_before
+            for i in sel[low]:
+                razon[i] = rules.external_low_reason(external_snap[i])
+
+            sel = stock_idx[stuck]
+            clasif[sel] = 'BO'
+            razon[sel] = 'Stock insuficiente'
+            stopa_snap[sel] = s0[stuck]
+            external_snap[sel] = e0[stuck]
+
+            # Piezas con contención: recorrido exacto item por item
+            state = {}
+            for k in np.flatnonzero(~(all_a | no_stock | all_ext | stuck)):
+                i = stock_idx[k]
+                row = p[k]
+                stopa_qty, external_qty = state.get(row, (index.stopa[row], index.external[row]))
+                stopa_snap[i] = stopa_qty
+                external_snap[i] = external_qty
+                clasif[i], razon[i], column = classify_stock(stopa_qty, external_qty, q[k], rules)
+                consume_col[i] = column
+                if column == 'stopa':
+                    stopa_qty = stopa_qty - q[k]
+                elif column == 'external':
+                    external_qty = external_qty - q[k]
+                state[row] = (stopa_qty, external_qty)
+
+        # Aplicar consumos en el orden original
+        for column in ('stopa', 'external'):
+            sel = np.flatnonzero(consume_col == column)
+            index.consume_many(pos[sel], column, qte[sel])
+
         results = []
-        
-        # Inicializar inventario solo si se provee nuevo, sino usa el existente
-        if inventory_data:
-             self.initialize_inventory(inventory_data)
-        
-        if self.df_inventory_working is None:
-            self.log("No hay inventario cargado. Imposible analizar.", "error")
+        for i, (source, item) in enumerate(items):
+            result = AnalysisResult.from_item(item, source, part_numbers[i])
+            result.encontrado_en_inventario = bool(found[i])
+            result.clasificacion = clasif[i]
+            result.razon = razon[i]
+            if found[i]:
+                row = pos[i]
+                if index.materials is not None:
+                    result['materiel'] = index.materials[row]
+                if index.gauges is not None:
+                    result['epaisseur'] = index.gauges[row]
+                result['stopa_quantity'] = stopa_snap[i]
+                result['external_quantity'] = external_snap[i]
+                if clasif[i] in ('C', 'BO'):
+                    balance = stopa_snap[i] - item['qte_a_produire']
+                    if balance < 0:
+                        result['deficit_internal'] = balance
+            results.append(result)
+            if summary is not None:
+                summary.add(result)
+
+        if not found.all():
+            self.logger.repeat('missing_part', part_numbers[~found].tolist())
+        return results
+
+    def _analyze_items(self, sourced_items, enabled_rules=None, mode=None, inventory=None, summary=None):
+        """
+        Clasifica los items de cada origen, en orden, contra el inventario de trabajo.
+        :param sourced_items: lista de (source, items) en el orden de consumo.
+        :param mode: 'batch' o 'sequential' (ver ANALYSIS_MODES). Por defecto self.analysis_mode.
+        :param inventory: InventoryOverlay de un escenario en lugar del inventario de trabajo.
+        :param summary: ResultSummary que se actualiza con cada resultado a medida que se genera.
+        """
+        mode = mode or self.analysis_mode
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"Modo de análisis desconocido: {mode}")
+
+        with self.logger.batch():
+            rules = self.compile_rules(enabled_rules)
+            if mode == 'batch':
+                hits = dict(rules.hits)
+                summarized = summary.total if summary is not None else 0
+                try:
+                    return self._analyze_items_batch(sourced_items, rules, inventory, summary)
+                except Exception as e:
+                    # Ya se resumieron resultados del lote: no se puede repetir sin contarlos dos veces
+                    if summary is not None and summary.total != summarized:
+                        raise
+                    # El lote no consume nada hasta el final, así que se puede repetir en secuencial
+                    rules.hits = hits
+                    self.log("Análisis por lote no disponible (%s), usando modo secuencial.", "warning", e)
+
+            results = []
+            for source, items in sourced_items:
+                for item in items:
+                    res = self.analyze_item(item, self.df_inventory_working if inventory is None else inventory, source, rules)
+                    results.append(res)
+                    if summary is not None:
+                        summary.add(res)
             return results
 
-        # 1. Punch
-        punch_items = self.extract_pdf_items(punch_data, "Punch")
-        for item in punch_items:
-            res = self.analyze_item(item, self.df_inventory_working, "Punch", enabled_rules)
-            results.append(res)
-            
-        # 2. Laser
-        laser_items = self.extract_pdf_items(laser_data, "Laser")
-        for item in laser_items:
-            res = self.analyze_item(item, self.df_inventory_working, "Laser", enabled_rules)
-            results.append(res)
+    def _record_run(self, results, punch_file, laser_file, metadata, enabled_rules, summary=None):
+        """
+        Vuelca los consumos al DataFrame de trabajo, guarda los resultados y agrega la entrada al historial.
+        :param enabled_rules: CompiledRules de la ejecución (o el diccionario de reglas activas).
+        :param summary: ResultSummary ya acumulado durante el análisis; si no se da, se calcula aquí en una pasada.
+        """
+        rules = self.compile_rules(enabled_rules)
+        # Volcar los consumos del índice al DataFrame de trabajo
+        if self.inventory_index is not None:
+            self.inventory_index.sync_frame()
             
         self.last_results = results
+        # Identificador único de la ejecución (clave de las exportaciones ya generadas)
+        self.run_id = uuid.uuid4().hex
+        self.ledger.commit(self.run_id)
         
         # Agregar al historial
-        stats = self.get_summary_stats()
+        with self.stage("get_summary_stats") as timer:
+            self._summary = summary if summary is not None else ResultSummary(results)
+            self._summary_results = results
+            stats = self.get_summary_stats()
+            timer.rows = len(results)
+        timings, self.stage_timings = self.stage_timings, []
         history_entry = {
             "id": len(self.history) + 1,
+            "run_id": self.run_id,
             "timestamp": datetime.now().strftime("%H:%M:%S"),
             "stats": stats,
-            "punch_file": punch_data['file_path'] if punch_data else "N/A",
-            "laser_file": laser_data['file_path'] if laser_data else "N/A",
+            "punch_file": punch_file or "N/A",
+            "laser_file": laser_file or "N/A",
             "metadata": metadata or {},
-            "rules_used": enabled_rules # Guardar qué reglas se usaron
+            "rules_used": rules.enabled, # Guardar qué reglas se usaron
+            "rule_hits": dict(rules.hits), # Items clasificados por cada regla activa
+            "timings": timings # Etapas medidas (cargas previas + este análisis)
         }
         self.history.append(history_entry)
+
+    def run_full_analysis(self, punch_data, laser_data, inventory_data=None, metadata=None, enabled_rules=None, mode=None):
+        """
+        Ejecuta el flujo completo de análisis.
+        Si inventory_data es None, intenta usar el existente.
+        :param metadata: Diccionario con info extra (project, model, module)
+        :param enabled_rules: Diccionario con reglas activas/inactivas.
+        :param mode: 'batch' o 'sequential' (ver ANALYSIS_MODES). Por defecto self.analysis_mode.
+        """
+        results = []
+        if (mode or self.analysis_mode) not in ANALYSIS_MODES:
+            raise ValueError(f"Modo de análisis desconocido: {mode or self.analysis_mode}")
+        
+        # Inicializar inventario solo si se provee nuevo, sino usa el existente
+        if inventory_data:
+            with self.stage("initialize_inventory") as timer:
+                self.initialize_inventory(inventory_data)
+                timer.rows = inventory_data.get('rows')
+        
+        if self.df_inventory_working is None:
+            self.log("No hay inventario cargado. Imposible analizar.", "error")
+            return results
+
+        # Avisos de la ejecución agregados y entregados en bloques
+        with self.logger.batch():
+            # 1. Punch, 2. Laser
+            with self.stage("extract_pdf_items[Punch]") as timer:
+                punch_items = self.extract_pdf_items(punch_data, "Punch")
+                timer.rows = len(punch_items)
+            with self.stage("extract_pdf_items[Laser]") as timer:
+                laser_items = self.extract_pdf_items(laser_data, "Laser")
+                timer.rows = len(laser_items)
+            # Reglas compiladas una vez por ejecución (acumulan los aciertos por regla)
+            rules = self.compile_rules(enabled_rules)
+            # Estadísticas acumuladas a medida que se generan los resultados
+            summary = ResultSummary()
+            with self.stage(f"analyze[{mode or self.analysis_mode}]") as timer:
+                results = self._analyze_items([("Punch", punch_items), ("Laser", laser_items)], rules, mode, summary=summary)
+                timer.rows = len(results)
+
+            self._record_run(
+                results,
+                punch_data['file_path'] if punch_data else None,
+                laser_data['file_path'] if laser_data else None,
+                metadata, rules, summary
+            )
         
         return results
 
+    def iter_pdf_chunks(self, file_path, source_name, chunk_rows=PIPELINE_CHUNK_ROWS):
+        """
+        Genera DataFrames de hasta chunk_rows filas a medida que se procesa cada página.
+        Mismo criterio que load_pdf_data: la primera fila de la primera tabla es el encabezado.
+        Con pdf_cache, una tabla ya extraída se lee de la caché por bloques y, si no estaba, cada
+        bloque se escribe en la entrada a medida que se genera (se publica al terminar el documento).
+        La lectura (sin contar lo que hace el llamador con cada bloque) se registra como la etapa
+        load_pdf_data[source_name].
+        """
+        clock = self.stage_clock(f"load_pdf_data[{source_name}]")
+        chunks = self._iter_pdf_chunks(file_path, source_name, chunk_rows)
+        try:
+            while True:
+                # Solo cuenta el trabajo del generador hasta entregar cada bloque
+                with clock:
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                clock.rows += len(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+            clock.record()
+
+    def _iter_pdf_chunks(self, file_path, source_name, chunk_rows):
+        cache_key = self._pdf_cache_key(file_path) if self.pdf_cache is not None else None
+        if cache_key:
+            cached = self.pdf_cache.get_blocks(cache_key)
+            if cached:
+                headers, blocks = cached
+                rows = 0
+                for columns in blocks:
+                    df = _frame_from_columns(headers, columns)
+                    rows += len(df)
+                    for start in range(0, len(df), chunk_rows):
+                        yield df.iloc[start:start + chunk_rows]
+                self.log("PDF %s cargado desde caché: %d filas.", "success", source_name, rows)
+                return
+            with self.pdf_cache.writer(cache_key) as writer:
+                for chunk in self._iter_table_chunks(file_path, source_name, chunk_rows):
+                    if not writer.failed:
+                        try:
+                            writer.write(list(chunk.columns), [chunk.iloc[:, i].tolist() for i in range(chunk.shape[1])])
+                        except Exception as e:
+                            self.log("No se pudo guardar %s en caché: %s", "warning", source_name, e)
+                    yield chunk
+            return
+        yield from self._iter_table_chunks(file_path, source_name, chunk_rows)
+
+    def _iter_table_chunks(self, file_path, source_name, chunk_rows):
+        headers = None
+        buffer = []
+        for table in self._iter_page_tables(file_path, source_name):
+            if not table:
+                continue
+            if headers is None:
+                headers, table = table[0], table[1:]
+            buffer.extend(table)
+            while len(buffer) >= chunk_rows:
+                chunk = pd.DataFrame(buffer[:chunk_rows], columns=headers)
+                buffer = buffer[chunk_rows:]
+                yield chunk
+
+        if headers is None:
+            raise Exception("No se encontraron tablas en el PDF")
+        if buffer:
+            yield pd.DataFrame(buffer, columns=headers)
+
+    def _iter_page_tables(self, file_path, source_name):
+        """
+        Filas de cada página (o rango de páginas), en orden. Con pdf_strategy 'auto' se usa la capa de
+        texto mientras las páginas encajen en el layout conocido; desde la primera que no encaja se sigue
+        con extract_table, repartida entre procesos como en load_pdf_data (pdf_workers, PARALLEL_PDF_MIN_PAGES).
+        """
+        start = 0
+        if self.pdf_strategy == 'auto':
+            parser = TextLayoutParser()
+            try:
+                for page in PdfReader(_open_source(file_path)).pages:
+                    rows = parser.parse_page(page)
+                    if rows is None:
+                        break
+                    yield rows
+                    start += 1
+                else:
+                    return
+                self.log("%s: la página %d no coincide con el layout conocido, usando extract_table.", "info", source_name, start + 1)
+            except Exception as e:
+                self.log("Capa de texto de %s ilegible (%s), usando extract_table.", "warning", source_name, e)
+
+        with pdfplumber.open(_open_source(file_path)) as pdf:
+            page_count = len(pdf.pages)
+        workers = min(self.pdf_workers or os.cpu_count() or 1, page_count - start)
+        if workers > 1 and page_count - start >= PARALLEL_PDF_MIN_PAGES:
+            yield from self._iter_tables_parallel(file_path, start, page_count, workers, source_name)
+        else:
+            yield from _iter_tables_serial(file_path, start)
+
+    def _iter_tables_parallel(self, file_path, start, page_count, workers, source_name):
+        """
+        Tablas de las páginas [start, page_count) extraídas por un pool de procesos en rangos contiguos,
+        generadas en orden de página. Hay como máximo dos rangos en curso por proceso; si el pool
+        falla se sigue en serie desde la primera página no entregada.
+        """
+        size = -(-(page_count - start) // (workers * PIPELINE_RANGES_PER_WORKER))
+        ranges = iter([(first, min(first + size, page_count)) for first in range(start, page_count, size)])
+        self.log("Extrayendo %d páginas de %s con %d procesos...", "process", page_count - start, source_name, workers)
+        if not isinstance(file_path, (str, os.PathLike)):
+            # Los procesos reciben el contenido del archivo en memoria
+            file_path = _open_source(file_path).read()
+        delivered = start
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque((pool.submit(_extract_page_range, file_path, first, stop), stop)
+                                for first, stop in itertools.islice(ranges, 2 * workers))
+                try:
+                    while pending:
+                        future, stop = pending.popleft()
+                        rows = future.result()
+                        following = next(ranges, None)
+                        if following:
+                            pending.append((pool.submit(_extract_page_range, file_path, *following), following[1]))
+                        delivered = stop
+                        yield rows
+                finally:
+                    for future, _ in pending:
+                        future.cancel()
+            return
+        except Exception as e:
+            # Entornos sin soporte de procesos (p. ej. serverless): extracción en serie
+            self.log("Extracción paralela no disponible (%s), usando modo serie.", "warning", e)
+        yield from _iter_tables_serial(file_path, delivered)
+
+    def iter_pdf_items(self, file_path, source_name, chunk_rows=PIPELINE_CHUNK_ROWS):
+        """
+        Genera listas de items por bloque de filas del PDF. Cada PDF se analiza entero o no se analiza:
+        un error antes del primer bloque se registra y omite solo este PDF (como un PDF sin tablas en
+        load_pdf_data); un error a mitad de documento, con bloques ya entregados, se propaga como ValueError.
+        La conversión de filas a items se registra como la etapa extract_pdf_items[source_name].
+        """
+        self.log("Extrayendo items de %s (streaming)...", "process", source_name)
+        clock = self.stage_clock(f"extract_pdf_items[{source_name}]")
+        delivered = False
+        try:
+            for chunk in self.iter_pdf_chunks(file_path, source_name, chunk_rows):
+                with clock:
+                    items = self._items_from_frame(chunk, source_name)
+                    clock.rows += len(items)
+                if items:
+                    delivered = True
+                    yield items
+        except Exception as e:
+            self.log("Error extrayendo items de %s: %s", "error", source_name, e)
+            if delivered:
+                raise ValueError(f"Error extrayendo items de {source_name} a mitad del documento: {e}") from e
+            return
+        finally:
+            clock.record()
+        self.log("Total items extraídos de %s: %d", "success", source_name, clock.rows)
+
+    def iter_analysis(self, punch_path, laser_path, enabled_rules=None, mode=None, chunk_rows=PIPELINE_CHUNK_ROWS):
+        """
+        Pipeline en streaming: páginas -> filas -> items -> resultados.
+        Genera los resultados en el mismo orden que run_full_analysis (Punch y luego Laser); cada bloque
+        se clasifica y consume antes de leer el siguiente. Las filas de tabla en memoria no dependen del
+        tamaño del documento, también con pdf_cache: el bloque en curso (hasta chunk_rows filas) más la
+        página que se está leyendo (con extract_table en paralelo, los rangos de páginas en curso) o el
+        bloque de la caché que se está leyendo.
+        Requiere un inventario de trabajo inicializado.
+        Cada PDF registra sus etapas load_pdf_data[...] y extract_pdf_items[...]; la clasificación de
+        todos los bloques se registra como analyze[modo], igual que en run_full_analysis.
+        Si la ejecución falla a mitad (ver iter_pdf_items), el stock ya consumido por los bloques
+        clasificados se restituye con el ledger antes de propagar el error.
+        """
+        if self.df_inventory_working is None:
+            self.log("No hay inventario cargado. Imposible analizar.", "error")
+            return
+
+        rules = self.compile_rules(enabled_rules)
+        clock = self.stage_clock(f"analyze[{mode or self.analysis_mode}]")
+        try:
+            for source, path in (("Punch", punch_path), ("Laser", laser_path)):
+                if not path:
+                    continue
+                for items in self.iter_pdf_items(path, source, chunk_rows):
+                    with clock:
+                        results = self._analyze_items([(source, items)], rules, mode)
+                        clock.rows += len(results)
+                    yield from results
+        except Exception:
+            self._rollback_pending()
+            raise
+        finally:
+            if self.inventory_index is not None:
+                self.inventory_index.sync_frame()
+            clock.record()
+
+    def run_streaming_analysis(self, punch_path, laser_path, inventory_data=None, metadata=None, enabled_rules=None, mode=None, on_result=None,
+                               punch_name=None, laser_name=None):
+        """
+        Igual que run_full_analysis pero leyendo los PDFs por páginas con iter_analysis,
+        sin cargar las tablas completas en memoria. Es el flujo de /analyze y de batch_cli.
+        :param punch_path: Ruta, bytes o archivo binario abierto (p. ej. un upload) del PDF Punch; laser_path igual.
+        :param on_result: Función opcional llamada con cada resultado en cuanto está disponible.
+        :param punch_name: Nombre a registrar en el historial cuando punch_path no es una ruta (laser_name igual).
+        Si los PDFs no aportan ningún item la ejecución no se registra. Si un PDF falla a mitad del
+        documento se propaga el error sin registrar la ejecución y sin consumir stock (ver iter_analysis).
+        """
+        results = []
+        if inventory_data:
+            with self.stage("initialize_inventory") as timer:
+                self.initialize_inventory(inventory_data)
+                timer.rows = inventory_data.get('rows')
+        if self.df_inventory_working is None:
+            self.log("No hay inventario cargado. Imposible analizar.", "error")
+            return results
+
+        summary = ResultSummary()
+        rules = self.compile_rules(enabled_rules)
+        with self.logger.batch():
+            analysis = self.iter_analysis(punch_path, laser_path, rules, mode)
+            try:
+                for res in analysis:
+                    results.append(res)
+                    summary.add(res)
+                    if on_result:
+                        on_result(res)
+            except Exception:
+                # También si falla on_result: nada de la ejecución queda consumido ni medido
+                analysis.close()
+                self._rollback_pending()
+                self.stage_timings = []
+                raise
+
+            if not results:
+                self.log("No se extrajeron items de los PDFs; la ejecución no se registra.", "error")
+                return results
+            self._record_run(
+                results,
+                _source_label(punch_path, punch_name) if punch_path else None,
+                _source_label(laser_path, laser_name) if laser_path else None,
+                metadata, rules, summary
+            )
+        return results
+
+    def _rollback_pending(self):
+        """Restituye el stock consumido desde el último commit del ledger (ejecución que no terminó)."""
+        index = self._get_inventory_index(self.df_inventory_working)
+        if self.ledger.rollback(index):
+            index.sync_frame()
+            self.log("Análisis interrumpido: se restituyó el stock consumido.", "warning")
+
+    def undo_last_run(self):
+        """
+        Deshace la última ejecución: devuelve al inventario de trabajo los consumos que registró el
+        ledger y la quita del historial, sin releer ningún archivo.
+        :return: run_id de la ejecución deshecha, o None si no hay nada que deshacer.
+        """
+        if not self.history or not self.ledger.runs or self.history[-1].get('run_id') != self.ledger.runs[-1][0]:
+            self.log("No hay ejecuciones para deshacer.", "warning")
+            return None
+
+        index = self._get_inventory_index(self.df_inventory_working)
+        run_id = self.ledger.undo(index)
+        index.sync_frame()
+        entry = self.history.pop()
+        # Los resultados de ejecuciones anteriores no se conservan
+        self.last_results = []
+        self.run_id = None
+        self._summary = None
+        self._summary_results = None
+        self.log("Análisis %s deshecho: stock restituido.", "warning", entry['id'])
+        return run_id
+
+    def run_scenarios(self, modules, scenarios, mode=None, workers=None):
+        """
+        Evalúa escenarios "qué pasaría si" (orden de los módulos, reglas activas) contra el
+        inventario de trabajo sin modificarlo: cada escenario consume sobre su propio
+        InventoryOverlay y el inventario, el ledger y el historial quedan intactos.
+        :param modules: Lista de (nombre, punch_data, laser_data) en el orden por defecto.
+        :param scenarios: Lista de {'name', 'order': [nombres de módulo], 'enabled_rules': {...}};
+                          'order' y 'enabled_rules' son opcionales (orden de modules, reglas por defecto).
+        :param workers: Hilos para evaluar los escenarios en paralelo (por defecto uno por escenario, hasta os.cpu_count()).
+        :return: Lista de resúmenes, en el orden de scenarios, con stats totales y por módulo,
+                 aciertos por regla y stock consumido.
+        """
+        if self.df_inventory_working is None:
+            raise ValueError("No hay inventario cargado. Imposible evaluar escenarios.")
+        mode = mode or self.analysis_mode
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"Modo de análisis desconocido: {mode}")
+
+        names = [name for name, _, _ in modules]
+        for i, scenario in enumerate(scenarios):
+            unknown = set(scenario.get('order') or ()) - set(names)
+            if unknown:
+                raise ValueError(f"Escenario {scenario.get('name', i + 1)}: módulos desconocidos {', '.join(sorted(unknown))}")
+
+        # Los items de cada módulo se extraen una vez y los comparten todos los escenarios
+        module_items = {
+            name: [("Punch", self.extract_pdf_items(punch_data, "Punch")),
+                   ("Laser", self.extract_pdf_items(laser_data, "Laser"))]
+            for name, punch_data, laser_data in modules
+        }
+        index = self._get_inventory_index(self.df_inventory_working)
+        workers = max(1, min(workers or os.cpu_count() or 1, len(scenarios)))
+        self.log("Evaluando %d escenarios con %d hilos...", "process", len(scenarios), workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda scenario: self._run_scenario(index, module_items, names, scenario, mode), scenarios))
+
+    def _run_scenario(self, index, module_items, names, scenario, mode):
+        """Un escenario de run_scenarios. Usa un analizador propio (sin logs ni estado) para aislar los hilos."""
+        started = time.perf_counter()
+        worker = StockAnalyzer(log_callback=lambda message, msg_type: None, log_level='error')
+        worker.rules = self.rules
+        rules = worker.compile_rules(scenario.get('enabled_rules'))
+        overlay = InventoryOverlay(index)
+        order = list(scenario.get('order') or names)
+
+        total = ResultSummary()
+        per_module = []
+        for name in order:
+            module_summary = ResultSummary()
+            results = worker._analyze_items(module_items[name], rules, mode, overlay, module_summary)
+            for res in results:
+                total.add(res)
+            per_module.append({'module': name, 'stats': module_summary.stats()})
+
+        consumed, rows = overlay.consumed()
+        return {
+            'name': scenario.get('name') or ' -> '.join(order),
+            'order': order,
+            'rules_used': rules.enabled,
+            'rule_hits': dict(rules.hits),
+            'stats': total.stats(),
+            'modules': per_module,
+            'stock_consumed': consumed,
+            'parts_touched': rows,
+            'wall_s': round(time.perf_counter() - started, 6)
+        }
+
+    def memory_usage(self):
+        """
+        Bytes aproximados que ocupa el estado en memoria: inventario de trabajo, resultados
+        (incluidas las tablas PDF a las que apuntan) y ledger.
+        """
+        total = 0
+        if self.df_inventory_working is not None:
+            total += int(self.df_inventory_working.memory_usage(deep=True).sum())
+        tables = {}
+        for res in self.last_results:
+            total += sys.getsizeof(res)
+            table = getattr(res, 'source_table', None)
+            if table is not None:
+                tables[id(table)] = table
+        total += sum(int(table.memory_usage(deep=True).sum()) for table in tables.values())
+        for _, deltas in self.ledger.runs:
+            total += sum(positions.nbytes + quantities.nbytes for positions, quantities in deltas.values())
+        return total
+
+    def get_state(self):
+        """
+        Estado que debe sobrevivir entre peticiones (ver state_store): inventario de trabajo con las
+        columnas STATE_INVENTORY_COLUMNS, consumos por ejecución (ledger), últimos resultados en
+        columnas, historial y run_id.
+        Los PDFs y el Excel cargados no forman parte del estado.
+        """
+        inventory = None
+        if self.df_inventory_working is not None:
+            if self.inventory_index is not None:
+                self.inventory_index.sync_frame()
+            inventory = self.df_inventory_working
+        return {
+            'inventory': inventory,
+            'ledger': self.ledger.runs,
+            'results': AnalysisResult.to_columns(self.last_results),
+            'history': self.history,
+            'run_id': self.run_id
+        }
+
+    def set_state(self, state):
+        """Restaura un estado de get_state() (el inventario puede traer solo STATE_INVENTORY_COLUMNS)."""
+        self.df_inventory_working = state['inventory']
+        self.ledger = ConsumptionLedger(list(state.get('ledger') or []))
+        self.inventory_index = InventoryIndex(state['inventory'], self.ledger) if state['inventory'] is not None else None
+        self.last_results = AnalysisResult.from_columns(state['results'])
+        self._summary = None
+        self._summary_results = None
+        self.history = state['history']
+        self.run_id = state['run_id']
+
+    def _get_summary(self):
+        """Resumen del último análisis; se recalcula solo si last_results fue reemplazado."""
+        if self._summary is None or self._summary_results is not self.last_results:
+            self._summary = ResultSummary(self.last_results)
+            self._summary_results = self.last_results
+        return self._summary
+
     def get_summary_stats(self):
         if not self.last_results:
             return {}
-        
-        count_a = sum(1 for r in self.last_results if r.get('clasificacion') == 'A')
-        count_c = sum(1 for r in self.last_results if r.get('clasificacion') == 'C')
-        count_none = sum(1 for r in self.last_results if r.get('clasificacion') is None)
-        total = len(self.last_results)
-        
-        return {
-            'total': total,
-            'count_a': count_a,
-            'count_c': count_c,
-            'count_none': count_none,
-            # Calcular BO explícitamente como el resto o si tiene clasif BO
-            'count_bo': sum(1 for r in self.last_results if r.get('clasificacion') == 'BO')
-        }
+        return self._get_summary().stats()
+
+    def lookup_parts(self, part_numbers):
+        """
+        Consulta por pieza sin recorrer resultados ni inventario: O(1) por part number sobre el
+        resumen del último análisis (ResultSummary.parts) y el índice del inventario de trabajo.
+        :return: Diccionario {part number: datos} con la demanda del último análisis (total y por
+                 origen), las posiciones en last_results, el stock inicial (primera aparición), el
+                 stock restante en el inventario de trabajo y el faltante; None si la pieza no está
+                 ni en el análisis ni en el inventario.
+        """
+        parts = self._get_summary().parts if self.last_results else {}
+        index = None
+        if self.df_inventory_working is not None:
+            index = self._get_inventory_index(self.df_inventory_working)
+
+        found = {}
+        for part_number in part_numbers:
+            pn = str(part_number).strip()
+            entry = parts.get(pn)
+            pos = index.lookup(pn) if index is not None else None
+            if entry is None and pos is None:
+                found[pn] = None
+                continue
+            remaining = None
+            if pos is not None:
+                # Sin truncar: el inventario admite cantidades fraccionarias
+                stopa, external = float(index.stopa[pos]), float(index.external[pos])
+                remaining = {'stopa': stopa, 'external': external, 'total': stopa + external}
+            if entry is not None:
+                initial_stock = entry['initial_stock']
+                total_required = entry['total_required']
+                materiel, epaisseur = entry['materiel'], entry['epaisseur']
+            else:
+                # Pieza del inventario que el último análisis no usó
+                initial_stock = remaining['total']
+                total_required = 0
+                materiel = index.materials[pos] if index.materials is not None else ''
+                epaisseur = index.gauges[pos] if index.gauges is not None else ''
+            found[pn] = {
+                'part_number': pn,
+                'in_inventory': pos is not None,
+                'materiel': _plain_value(materiel),
+                'epaisseur': _plain_value(epaisseur),
+                'total_required': total_required,
+                'demand': dict(entry['demand']) if entry is not None else {},
+                'rows': list(entry['rows']) if entry is not None else [],
+                'initial_stock': initial_stock,
+                'remaining_stock': remaining,
+                'deficit': max(total_required - initial_stock, 0)
+            }
+        return found
 
     def get_inventory_summary(self):
         """
         Agrupa los resultados por Part Number para mostrar en el tab de Inventario.
         Calcula total requerido, stock inicial (detectado en el primer uso) y faltante global.
+        Se calcula una vez por análisis (ver ResultSummary).
         """
-        summary_map = {}
-        
-        for res in self.last_results:
-            pn = res['part_number']
-            if not pn: continue
-            
-            qte = res['qte_a_produire']
-            
-            # Obtener stock inicial reportado en la primera aparición de la pieza en este análisis
-            # Nota: Esto asume que el stock reportado en el resultado es el stock DISPONIBLE en ese momento.
-            # Si analizamos secuencialmente, la primera vez que sale el item tiene el stock 'más alto' (antes de consumos de este batch).
-            current_snap_stock = (int(res.get('stopa_quantity', 0)) + int(res.get('external_quantity', 0)))
-            
-            if pn not in summary_map:
-                summary_map[pn] = {
-                    'part_number': pn,
-                    'materiel': res.get('materiel', ''),
-                    'epaisseur': res.get('epaisseur', ''),
-                    'total_required': 0,
-                    'initial_stock': current_snap_stock, # Tomamos el de la primera aparición como "Inicial del Batch"
-                    'missing': 0
-                }
-            
-            summary_map[pn]['total_required'] += qte
-            
-        # Calcular lista final
-        summary_list = []
-        for pn, data in summary_map.items():
-            req = data['total_required']
-            stock = data['initial_stock']
-            missing = req - stock
-            if missing < 0:
-                missing = 0
-            
-            data['missing'] = missing
-            summary_list.append(data)
-            
-        # Ordenar por Part Number de menor a mayor (Numeric aware sort)
-        def sort_key(item):
-            pn = item['part_number']
-            # Intentar separar prefijo/sufijo si es comun, pero lo mas robusto para "menor a mayor"
-            # en numeros es convertir a float. Si falla, usar string.
-            # Para evitar error de comparacion float vs str, devolvemos tupla (tipo, valor)
-            try:
-                val = float(pn)
-                return (0, val)
-            except ValueError:
-                return (1, pn)
-
-        summary_list.sort(key=sort_key)
-        
-        return summary_list
+        return self._get_summary().inventory_summary()
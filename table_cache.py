@@ -0,0 +1,377 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+class _DiskCache:
+    """
+    Base de las cachés en disco direccionadas por contenido.
+    La clave es el SHA-256 de los bytes del archivo más una versión de formato; al superar
+    max_bytes se eliminan las entradas usadas hace más tiempo (LRU por fecha de acceso).
+    """
+
+    suffix = ''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_digest(file_path):
+        """SHA-256 del contenido (ruta, bytes o archivo binario abierto), leído por bloques."""
+        digest = hashlib.sha256()
+        if isinstance(file_path, (bytes, bytearray, memoryview)):
+            digest.update(file_path)
+        elif hasattr(file_path, 'read'):
+            file_path.seek(0)
+            for block in iter(lambda: file_path.read(1024 * 1024), b''):
+                digest.update(block)
+        else:
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def key(self, file_path, version):
+        """Clave de caché para un archivo y una versión del formato/parser."""
+        version = hashlib.sha256(str(version).encode('utf-8')).hexdigest()[:12]
+        return f"{self.file_digest(file_path)}-{version}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _entry_size(path):
+        if not os.path.isdir(path):
+            return os.stat(path).st_size
+        return sum(os.stat(os.path.join(path, name)).st_size for name in os.listdir(path))
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def _entries(self):
+        return [name for name in os.listdir(self.directory) if name.endswith(self.suffix) and not name.startswith('.')]
+
+    def _evict(self):
+        entries = []
+        for name in self._entries():
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.stat(path).st_mtime, self._entry_size(path), path))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                self._remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        """Elimina todas las entradas de la caché."""
+        for name in self._entries():
+            self._remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class PdfTableCache(_DiskCache):
+    """
+    Caché en disco de tablas extraídas de PDFs.
+    Cada entrada es JSON por líneas comprimido: los encabezados en la primera línea y después las
+    columnas de cada bloque de hasta block_rows filas, de modo que se puede escribir y leer por bloques.
+    """
+
+    suffix = '.json.gz'
+    block_rows = 500
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024):
+        super().__init__(directory or os.path.join(tempfile.gettempdir(), 'xnrgy_cache', 'pdf_tables'), max_bytes)
+
+    def get(self, key):
+        """Devuelve (headers, columns) o None si la entrada no existe."""
+        entry = self.get_blocks(key)
+        if entry is None:
+            return None
+        headers, blocks = entry
+        columns = [[] for _ in headers]
+        for block in blocks:
+            for column, values in zip(columns, block):
+                column.extend(values)
+        return headers, columns
+
+    def get_blocks(self, key):
+        """
+        Devuelve (headers, bloques) o None si la entrada no existe; bloques genera las columnas de
+        cada bloque a medida que se leen del disco.
+        """
+        path = self._path(key)
+        try:
+            f = gzip.open(path, 'rt', encoding='utf-8')
+            try:
+                first = json.loads(f.readline())
+            except Exception:
+                f.close()
+                raise
+            # Marcar como usada recientemente para la política LRU
+            os.utime(path)
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+        self._count(True)
+        if isinstance(first, dict):
+            # Entradas escritas de una vez, antes del formato por bloques
+            f.close()
+            return first['headers'], iter([first['columns']])
+        return first, self._read_blocks(f)
+
+    @staticmethod
+    def _read_blocks(f):
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def put(self, key, headers, columns):
+        """Guarda la tabla (escritura atómica) y aplica el límite de tamaño."""
+        rows = len(columns[0]) if columns else 0
+        with self.writer(key) as writer:
+            for start in range(0, max(rows, 1), self.block_rows):
+                writer.write(headers, [column[start:start + self.block_rows] for column in columns])
+
+    @contextmanager
+    def writer(self, key):
+        """
+        Escritura por bloques: with cache.writer(key) as w: w.write(headers, columnas_del_bloque)...
+        La entrada se publica (rename) al salir del bloque sin errores si se escribió algún bloque y
+        ninguna escritura falló; ante una excepción (o si el generador que la usa se cierra antes)
+        el temporal se borra.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        writer = PdfTableWriter(os.fdopen(fd, 'wb'))
+        try:
+            yield writer
+            writer.close()
+            if writer.complete:
+                os.replace(tmp_path, self._path(key))
+        finally:
+            writer.close(ignore_errors=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if writer.complete:
+            self._evict()
+
+
+class PdfTableWriter:
+    """Entrada de PdfTableCache en escritura (ver PdfTableCache.writer)."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.file = gzip.GzipFile(fileobj=raw, mode='wb')
+        self.blocks = 0
+        self.failed = False
+
+    @property
+    def complete(self):
+        return self.blocks > 0 and not self.failed
+
+    def write(self, headers, columns):
+        """
+        Agrega un bloque (lista de columnas); los encabezados se escriben con el primero.
+        Si falla, la entrada ya no se publica.
+        """
+        try:
+            if not self.blocks:
+                self.file.write(json.dumps(headers, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.file.write(json.dumps(columns, ensure_ascii=False).encode('utf-8') + b'\n')
+        except Exception:
+            self.failed = True
+            raise
+        self.blocks += 1
+
+    def close(self, ignore_errors=False):
+        try:
+            self.file.close()
+        except Exception:
+            if not ignore_errors:
+                raise
+        finally:
+            self.raw.close()
+
+
+class InventorySnapshotCache(_DiskCache):
+    """
+    Snapshots columnares del Excel de inventario.
+    Cada entrada es un directorio con un manifest.json y una columna por archivo: las columnas
+    NumPy nativas (números, booleanos, fechas) se guardan como .npy y se cargan con memory-map;
+    el resto (texto, tipos mixtos) como JSON junto con su dtype de pandas.
+    Una columna no serializable hace fallar put(), y el Excel se sigue leyendo normalmente.
+    """
+
+    def __init__(self, directory=None, max_bytes=512 * 1024 * 1024):
+        super().__init__(directory or os.path.join(tempfile.gettempdir(), 'xnrgy_cache', 'inventory'), max_bytes)
+
+    def get(self, key):
+        """Devuelve el DataFrame del snapshot o None si no existe."""
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+            data = {}
+            for i, column in enumerate(manifest['columns']):
+                file_name = os.path.join(path, column['file'])
+                if column['kind'] == 'npy':
+                    data[i] = np.load(file_name, mmap_mode='r')
+                else:
+                    with open(file_name, encoding='utf-8') as f:
+                        data[i] = pd.Series(json.load(f), dtype=column['dtype'])
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            self._count(False)
+            return None
+        self._count(True)
+
+        df = pd.DataFrame(data, index=pd.RangeIndex(manifest['rows']))
+        df.columns = [column['name'] for column in manifest['columns']]
+        return df
+
+    def put(self, key, df):
+        """Escribe el snapshot en un directorio temporal y lo publica con un rename atómico."""
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.')
+        try:
+            columns = []
+            for i in range(df.shape[1]):
+                series = df.iloc[:, i]
+                entry = {'name': df.columns[i], 'dtype': str(series.dtype)}
+                if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM':
+                    entry.update(kind='npy', file=f"{i}.npy")
+                    np.save(os.path.join(tmp_dir, entry['file']), series.to_numpy())
+                else:
+                    entry.update(kind='json', file=f"{i}.json")
+                    with open(os.path.join(tmp_dir, entry['file']), 'w', encoding='utf-8') as f:
+                        json.dump(series.astype(object).tolist(), f, ensure_ascii=False)
+                columns.append(entry)
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump({'rows': len(df), 'columns': columns}, f, ensure_ascii=False)
+
+            path = self._path(key)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.replace(tmp_dir, path)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._evict()
+
+
+class ExportCache(_DiskCache):
+    """
+    Archivos de exportación ya generados, por ejecución de análisis.
+    La clave es (run_id, tipo, formato); un run_id nuevo por ejecución hace que las entradas
+    de ejecuciones anteriores no se vuelvan a pedir, e invalidate() las borra de inmediato.
+    """
+
+    def __init__(self, directory=None, max_bytes=128 * 1024 * 1024):
+        super().__init__(directory or os.path.join(tempfile.gettempdir(), 'xnrgy_cache', 'exports'), max_bytes)
+
+    @staticmethod
+    def export_key(run_id, export_type, file_format):
+        return f"{run_id}-{export_type}.{file_format}"
+
+    def get(self, key):
+        """Archivo ya generado, abierto en modo binario, o None si no existe."""
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            os.utime(path)
+        except OSError:
+            self._count(False)
+            return None
+        self._count(True)
+        return f
+
+    def put(self, key, write):
+        """
+        Genera la entrada con write(archivo_binario) (escritura atómica), aplica el límite de
+        tamaño y devuelve el archivo abierto para lectura (sigue siendo legible aunque se desaloje).
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, self._path(key))
+            f = open(self._path(key), 'rb')
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+        return f
+
+    def stream(self, key, chunks):
+        """
+        Genera los chunks (bytes) a medida que se producen y los escribe a la vez en la entrada;
+        la entrada se publica (rename) solo si se completa. Si el cliente corta la descarga, el
+        temporal se borra y la próxima petición vuelve a generarla.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self._path(key))
+            complete = True
+        finally:
+            if not complete and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict()
+
+    def invalidate(self, run_id):
+        """Elimina todas las exportaciones de una ejecución."""
+        if not run_id:
+            return
+        for name in self._entries():
+            if name.startswith(f"{run_id}-"):
+                try:
+                    self._remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
@@ -0,0 +1,92 @@
+import random
+
+import pandas as pd
+import pytest
+
+from stock_analyzer import AnalysisResult, StockAnalyzer
+
+PDF_HEADERS = ['Part #', 'Qté à Produire', 'Matériel', 'Épaisseur']
+
+
+def make_inventory():
+    """Inventario con stock fraccionario, negativo y no numérico, piezas especiales y stock externo bajo."""
+    rows = [
+        ('10001', 5, 0),        # interno suficiente para algunos items y luego agotado
+        ('10002', 2.5, 0),      # fraccionario
+        ('10003', 0.5, 1.5),    # fraccionario en ambas columnas
+        ('10004', -2, 4),       # interno negativo, externo suficiente
+        ('10005', 'abc', 3),    # interno no numérico (cuenta como 0)
+        ('10006', 0, 'n/a'),    # externo no numérico
+        ('10007', 0, 1),        # stock externo bajo (regla)
+        ('10008', 0, 2),
+        ('10009', 3, -1),
+        ('10034', 10, 10),      # regla 'S'
+        ('10089', 4, 0),        # partes especiales 'M'
+        ('10016', 0, 0),
+        (' 10010 ', 1, 1),      # part number con espacios
+        ('10011', -1, 2),       # interno negativo con stock externo bajo
+        ('10012', 3.3, 0),      # fraccionarios que no se representan exactos en binario
+        ('10013', 0, 5.7),
+        ('10014', 7.1, 0.2),
+    ]
+    rows += [(str(20000 + i), random.Random(i).choice([0, 1, 2.5, -1, 'x', 7]), random.Random(-i).choice([0, 1, 2, 0.5, 9]))
+             for i in range(40)]
+    return pd.DataFrame(rows, columns=['partNumber', 'stopaQuantity', 'externalQuantity'])
+
+
+def make_items(seed, count):
+    """Filas de un reporte PDF con demanda repetida por pieza, piezas ausentes del inventario y cantidades no numéricas."""
+    rng = random.Random(seed)
+    parts = ['10001', '10002', '10003', '10004', '10005', '10006', '10007', '10008', '10009',
+             '10011', '10012', '10013', '10014', '10034', '10089', '10016', '10010', '99999', '88888']
+    parts += [str(20000 + i) for i in range(40)]
+    rows = []
+    for _ in range(count):
+        qty = rng.choice(['1', '2', '3', '2.0', '0', '5', 'abc', ''])
+        rows.append([rng.choice(parts), qty, rng.choice(['AL', 'SS']), rng.choice(['16', '14'])])
+    return {'file_path': f'items_{seed}.pdf', 'dataframe': pd.DataFrame(rows, columns=PDF_HEADERS)}
+
+
+def run(mode, punch_data, laser_data, enabled_rules, runs=2):
+    analyzer = StockAnalyzer(log_callback=lambda message, msg_type: None)
+    inventory_data = {'dataframe': make_inventory(), 'rows': 0}
+    outputs = []
+    for i in range(runs):
+        # Varias ejecuciones seguidas: la segunda consume sobre el stock que dejó la primera
+        results = analyzer.run_full_analysis(punch_data, laser_data, inventory_data if i == 0 else None,
+                                             enabled_rules=enabled_rules, mode=mode)
+        outputs.append([tuple(res.get(field) for field in AnalysisResult.FIELDS) for res in results])
+    return analyzer, outputs
+
+
+@pytest.mark.parametrize('enabled_rules', [
+    None,
+    {'rule_10034': False, 'rule_special_parts': True, 'rule_external_low': False},
+    {'rule_10034': True, 'rule_special_parts': False, 'rule_external_low': True},
+])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_batch_matches_sequential(seed, enabled_rules):
+    punch_data = make_items(seed, 300)
+    laser_data = make_items(seed + 100, 200)
+
+    sequential, expected = run('sequential', punch_data, laser_data, enabled_rules)
+    batch, actual = run('batch', punch_data, laser_data, enabled_rules)
+
+    # Mismos resultados (clasificación, razón, cantidades, faltantes...) en el mismo orden
+    assert actual == expected
+    # Mismo inventario final y mismas estadísticas por ejecución
+    for column in ('stopaQuantity', 'externalQuantity'):
+        assert batch.df_inventory_working[column].tolist() == sequential.df_inventory_working[column].tolist()
+    assert [entry['stats'] for entry in batch.history] == [entry['stats'] for entry in sequential.history]
+    assert [entry['rule_hits'] for entry in batch.history] == [entry['rule_hits'] for entry in sequential.history]
+    assert batch.get_inventory_summary() == sequential.get_inventory_summary()
+
+
+def test_edge_cases_are_covered():
+    """Los datos de la prueba ejercitan las clasificaciones y casos que debe igualar el modo por lote."""
+    analyzer, (results, _) = run('sequential', make_items(1, 300), make_items(101, 200), None)
+    labels = {row[AnalysisResult.FIELDS.index('clasificacion')] for row in results}
+    assert {'A', 'C', 'M', 'S', 'BO', None} <= labels
+    found = {row[AnalysisResult.FIELDS.index('encontrado_en_inventario')] for row in results}
+    assert found == {True, False}
+    assert any(row[AnalysisResult.FIELDS.index('deficit_internal')] is not None for row in results)